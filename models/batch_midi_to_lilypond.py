@@ -0,0 +1,209 @@
+"""
+Converts whole directories of midi files to lilypond code in parallel.
+
+Example usage:
+
+python batch_midi_to_lilypond.py \
+    -i ../data/datasets/recorded_data \
+    -o ../data/lilypond \
+    -r batch_report.csv
+
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+
+MIDI_EXTENSIONS = ('.mid', '.midi')
+
+# Set in every worker process by _init_worker, so the magenta imports
+# behind midi_to_lilypond are paid once per worker instead of once per file.
+_converter = None
+
+
+def _init_worker():
+  global _converter
+  import midi_to_lilypond
+  _converter = midi_to_lilypond
+
+
+def find_midi_files(input_path):
+  """
+  Collects the midi files to convert.
+
+  Args:
+    input_path: Either a directory, which is searched recursively for midi
+      files, or a manifest text file with one midi path per line. Blank lines
+      and lines starting with '#' are ignored, relative paths are resolved
+      against the manifest's directory.
+
+  Returns:
+    Sorted list of midi file paths.
+  """
+  if os.path.isdir(input_path):
+    midi_paths = []
+    for root, _, filenames in os.walk(input_path):
+      for filename in filenames:
+        if filename.lower().endswith(MIDI_EXTENSIONS):
+          midi_paths.append(os.path.join(root, filename))
+    return sorted(midi_paths)
+
+  manifest_dir = os.path.dirname(os.path.abspath(input_path))
+  midi_paths = []
+  with open(input_path, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      midi_paths.append(os.path.join(manifest_dir, line))
+  return midi_paths
+
+
+def output_path_for(midi_path, output_dir, base_dir):
+  """
+  Maps a midi file to its lilypond output file, mirroring its path relative
+  to base_dir under output_dir so same-named files in different directories
+  do not collide.
+  """
+  relative_path = os.path.relpath(os.path.abspath(midi_path), os.path.abspath(base_dir))
+  return os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.ly')
+
+
+def output_paths_for(midi_paths, output_dir, base_dir=None):
+  """
+  Maps midi files to their lilypond output files, see output_path_for.
+
+  Args:
+    midi_paths: List of midi file paths.
+    output_dir: Directory the lilypond files are written to.
+    base_dir: Directory whose structure is mirrored, defaults to the deepest
+      directory holding all midi files.
+
+  Returns:
+    List of lilypond file paths, one per midi file.
+
+  Raises:
+    ValueError: If two midi files map to the same output file, e.g. take.mid
+      and take.midi.
+  """
+  if base_dir is None and midi_paths:
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(midi_path))
+                                   for midi_path in midi_paths])
+  ly_paths = [output_path_for(midi_path, output_dir, base_dir) for midi_path in midi_paths]
+  first_input = {}
+  for midi_path, ly_path in zip(midi_paths, ly_paths):
+    if ly_path in first_input:
+      raise ValueError("'{}' and '{}' would both be converted to '{}'.".format(
+          first_input[ly_path], midi_path, ly_path))
+    first_input[ly_path] = midi_path
+  return ly_paths
+
+
+def is_up_to_date(midi_path, ly_path):
+  """Returns True if ly_path exists and is newer than midi_path."""
+  return (os.path.exists(ly_path) and
+          os.path.getmtime(ly_path) >= os.path.getmtime(midi_path))
+
+
+def convert_job(job):
+  """
+  Converts a single midi file inside a worker process.
+
+  Args:
+    job: Tuple of (midi_path, ly_path, num_notes, tempo_window, force)
+
+  Returns:
+    Tuple of (midi_path, ly_path, status, seconds, error) where status is one
+      of 'converted', 'skipped' or 'failed'.
+  """
+  midi_path, ly_path, num_notes, tempo_window, force = job
+  start = time.time()
+  if not force and is_up_to_date(midi_path, ly_path):
+    return midi_path, ly_path, 'skipped', 0.0, ''
+  try:
+    _converter.convert_midi_to_ly(midi_path, ly_path, num_notes, verbose=False,
+                                  tempo_window=tempo_window)
+  except Exception as e:
+    return midi_path, ly_path, 'failed', time.time()-start, repr(e)
+  return midi_path, ly_path, 'converted', time.time()-start, ''
+
+
+def convert_batch(midi_paths, output_dir, num_notes=-1, num_workers=None,
+                  force=False, report_path=None, tempo_window=0):
+  """
+  Converts many midi files to lilypond code using a pool of worker processes.
+
+  Args:
+    midi_paths: List of midi file paths.
+    output_dir: Directory the lilypond files are written to, mirroring the
+      directories of the midi files, see output_paths_for.
+    num_notes: Number of notes to convert per file, -1 for all of them.
+    num_workers: Number of worker processes, defaults to the number of cores.
+    force: If True, also converts files whose output is already up to date.
+    report_path: Optional path of a csv file receiving one row per file.
+    tempo_window: If > 0, number of notes the local tempo is tracked over.
+
+  Returns:
+    List of (midi_path, ly_path, status, seconds, error) tuples.
+  """
+  ly_paths = output_paths_for(midi_paths, output_dir)
+  for ly_dir in set([output_dir] + [os.path.dirname(ly_path) for ly_path in ly_paths]):
+    if not os.path.exists(ly_dir):
+      os.makedirs(ly_dir)
+  num_workers = num_workers or multiprocessing.cpu_count()
+  jobs = [(midi_path, ly_path, num_notes, tempo_window, force)
+          for midi_path, ly_path in zip(midi_paths, ly_paths)]
+  # Small chunks keep the workers evenly loaded when file sizes vary a lot.
+  chunksize = max(1, len(jobs)//(num_workers*8))
+
+  results = []
+  pool = multiprocessing.Pool(num_workers, initializer=_init_worker)
+  try:
+    for result in pool.imap_unordered(convert_job, jobs, chunksize):
+      results.append(result)
+  finally:
+    pool.close()
+    pool.join()
+
+  if report_path:
+    with open(report_path, 'w') as f:
+      writer = csv.writer(f)
+      writer.writerow(['midi_path', 'ly_path', 'status', 'seconds', 'error'])
+      for midi_path, ly_path, status, seconds, error in results:
+        writer.writerow([midi_path, ly_path, status, '{:.4f}'.format(seconds), error])
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-i", "--input_path", required=True, help="Directory of "
+    "midi files, or a manifest text file listing one midi path per line")
+  parser.add_argument("-o", "--output_dir", required=True, help="Directory to "
+    "store the lilypond code files in")
+  parser.add_argument("-n", "--num_notes", help="Number of notes to convert per file.",
+    type=int, default=-1)
+  parser.add_argument("-t", "--tempo_window", help="Number of notes to track the "
+    "local tempo over, 0 to use a single tempo per piece.", type=int, default=0)
+  parser.add_argument("-w", "--num_workers", help="Number of worker processes, "
+    "defaults to the number of cores.", type=int, default=None)
+  parser.add_argument("-f", "--force", action="store_true", help="Convert files "
+    "even if their lilypond output is already up to date")
+  parser.add_argument("-r", "--report_path", help="Path to csv file to store the "
+    "per-file status and timing report", default="batch_report.csv")
+  args = parser.parse_args()
+
+  midi_paths = find_midi_files(args.input_path)
+  start = time.time()
+  results = convert_batch(midi_paths, args.output_dir, args.num_notes,
+                          args.num_workers, args.force, args.report_path,
+                          args.tempo_window)
+  counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+  for result in results:
+    counts[result[2]] += 1
+  print ("{} files in {:.2f}s: {converted} converted, {skipped} skipped, "
+         "{failed} failed".format(len(results), time.time()-start, **counts))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,176 @@
+"""
+Exact 1-D clustering of note durations.
+
+Finds the optimal k-means partition of a column of values by dynamic
+programming over the sorted data (as in Ckmeans.1d.dp). Each DP layer is filled
+with the divide-and-conquer optimization, one recursion depth at a time, so the
+whole clustering runs in O(k n log n) vectorized NumPy operations and, unlike
+sklearn's KMeans, always returns the same answer.
+
+Example usage (benchmark):
+
+python duration_quantizer.py -s 1000 10000 100000 1000000
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+def _segment_costs(prefix_count, prefix_sum, prefix_sq_sum, starts, ends):
+  """
+  Sum of squared distances to the mean of unique values[starts:ends+1], each
+  value counted as often as it occurs.
+  """
+  sizes = prefix_count[ends+1] - prefix_count[starts]
+  sums = prefix_sum[ends+1] - prefix_sum[starts]
+  return prefix_sq_sum[ends+1] - prefix_sq_sum[starts] - sums*sums/sizes
+
+
+def _fill_layer(prev_costs, prefix_count, prefix_sum, prefix_sq_sum, layer, n):
+  """
+  Computes one row of the DP table.
+
+  Args:
+    prev_costs: Optimal cost of splitting values[:i+1] into `layer` clusters.
+    prefix_count: Prefix sums of the counts of the unique values.
+    prefix_sum: Count weighted prefix sums of the unique values.
+    prefix_sq_sum: Count weighted prefix sums of the squared unique values.
+    layer: Zero based index of the last cluster.
+    n: Number of unique values.
+
+  Returns:
+    Tuple of (costs, starts) where costs[i] is the optimal cost of splitting
+      values[:i+1] into layer+1 clusters and starts[i] is where the last of
+      them begins.
+  """
+  costs = np.full(n, np.inf)
+  starts = np.zeros(n, dtype=np.int64)
+  # Pending intervals of i, each with the range its optimal start lies in.
+  lo = np.array([layer])
+  hi = np.array([n-1])
+  opt_lo = np.array([layer])
+  opt_hi = np.array([n-1])
+  while lo.size:
+    mid = (lo+hi)//2
+    counts = np.minimum(mid, opt_hi) - opt_lo + 1
+    offsets = np.cumsum(counts) - counts
+    segment = np.repeat(np.arange(mid.size), counts)
+    candidates = opt_lo[segment] + np.arange(counts.sum()) - offsets[segment]
+    candidate_costs = (prev_costs[candidates-1] +
+                       _segment_costs(prefix_count, prefix_sum, prefix_sq_sum, candidates, mid[segment]))
+    best = np.minimum.reduceat(candidate_costs, offsets)
+    hits = np.flatnonzero(candidate_costs == best[segment])
+    first_hits = hits[np.r_[True, segment[hits][1:] != segment[hits][:-1]]]
+    best_starts = candidates[first_hits]
+    costs[mid] = best
+    starts[mid] = best_starts
+
+    # The optimal start is monotone in i, which bounds both halves.
+    lo, hi, opt_lo, opt_hi = (np.concatenate([lo, mid+1]),
+                              np.concatenate([mid-1, hi]),
+                              np.concatenate([opt_lo, best_starts]),
+                              np.concatenate([best_starts, opt_hi]))
+    keep = lo <= hi
+    lo, hi, opt_lo, opt_hi = lo[keep], hi[keep], opt_lo[keep], opt_hi[keep]
+  return costs, starts
+
+
+def cluster_1d(values, n_clusters):
+  """
+  Optimal 1-D k-means clustering.
+
+  The DP runs over the distinct values weighted by their counts, so equal
+  values always share a cluster. Quantized takes often have fewer distinct
+  values than clusters, and splitting a value across clusters would make the
+  largest cluster a fragment of it.
+
+  Args:
+    values: 1-D array of values to cluster.
+    n_clusters: Number of clusters, clipped to the number of distinct values.
+
+  Returns:
+    Tuple of (labels, centers, sizes). Clusters are numbered in increasing
+      order of their centers, labels follows the order of values.
+  """
+  values = np.asarray(values, dtype=np.float64).ravel()
+  unique_values, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+  n = unique_values.size
+  n_clusters = min(n_clusters, n)
+  if n_clusters < 1:
+    return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+  # Centering keeps the prefix sums of squares well conditioned.
+  centered = unique_values - np.dot(unique_values, counts)/values.size
+  prefix_count = np.concatenate([[0], np.cumsum(counts)])
+  prefix_sum = np.concatenate([[0.], np.cumsum(centered*counts)])
+  prefix_sq_sum = np.concatenate([[0.], np.cumsum(centered*centered*counts)])
+
+  all_starts = [np.zeros(n, dtype=np.int64)]
+  costs = _segment_costs(prefix_count, prefix_sum, prefix_sq_sum, np.zeros(n, dtype=np.int64), np.arange(n))
+  for layer in range(1, n_clusters):
+    costs, starts = _fill_layer(costs, prefix_count, prefix_sum, prefix_sq_sum, layer, n)
+    all_starts.append(starts)
+
+  boundaries = np.zeros(n_clusters+1, dtype=np.int64)
+  boundaries[n_clusters] = n
+  end = n-1
+  for layer in range(n_clusters-1, 0, -1):
+    boundaries[layer] = all_starts[layer][end]
+    end = boundaries[layer]-1
+
+  unique_labels = np.repeat(np.arange(n_clusters), np.diff(boundaries))
+  sizes = np.add.reduceat(counts, boundaries[:-1])
+  centers = np.add.reduceat(unique_values*counts, boundaries[:-1])/sizes
+  return unique_labels[inverse.ravel()], centers, sizes
+
+
+def largest_cluster_mean(values, n_clusters):
+  """
+  Mean of the most populated cluster of values, which should correspond to the
+  most frequent note value.
+
+  Args:
+    values: 1-D array of values to cluster.
+    n_clusters: Number of clusters.
+
+  Returns:
+    Mean of cluster values as a float.
+  """
+  _, centers, sizes = cluster_1d(values, n_clusters)
+  return float(centers[np.argmax(sizes)])
+
+
+def benchmark(sizes, n_clusters=4, seed=0):
+  """
+  Times cluster_1d on synthetic performances with four note values played with
+  some timing jitter.
+
+  Args:
+    sizes: Iterable of note counts to time.
+    n_clusters: Number of clusters.
+    seed: Random seed of the synthetic deltas.
+
+  Returns:
+    List of (size, seconds) tuples.
+  """
+  rng = np.random.RandomState(seed)
+  results = []
+  for size in sizes:
+    note_values = rng.choice([0.25, 0.5, 1., 2.], size=size, p=[0.2, 0.5, 0.2, 0.1])
+    deltas = note_values*0.5*(1 + 0.05*rng.randn(size))
+    start = time.time()
+    cluster_1d(deltas, n_clusters)
+    results.append((size, time.time()-start))
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the 1-D duration quantizer')
+  parser.add_argument("-s", "--sizes", nargs='+', type=int,
+    default=[1000, 10000, 100000, 1000000], help="Note counts to benchmark")
+  parser.add_argument("-k", "--n_clusters", type=int, default=4, help="Number of clusters")
+  args = parser.parse_args()
+  for size, seconds in benchmark(args.sizes, args.n_clusters):
+    print ("{:>9} notes: {:.4f}s".format(size, seconds))
@@ -1,4 +1,5 @@
 import argparse
+import sys
 
 import numpy as np
 from magenta.common import tf_utils
@@ -6,74 +7,62 @@ from magenta.music import audio_io
 import magenta.music as mm
 from magenta.music import midi_io
 from magenta.music import sequences_lib
-from sklearn.cluster import KMeans
-from collections import defaultdict
+
+from duration_quantizer import largest_cluster_mean
+import note_table
+import tempo_map
 
 MIDI_OFFSET = 21
 MIDI_LETTER_NAMES = ['A', 'Bb', 'B', 'C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab']
 
-def extract_deltas(note_seq, num_notes):
+def extract_deltas(notes):
   """
     Args:
-      note_seq: NoteSequence input
-      num_notes: Number of notes in the note sequence to consider from beginning
+      notes: Note table sorted by start time, see note_table.from_note_sequence
 
     Returns:
-      List of time deltas between notes.
+      Array of time deltas between notes.
   """
-  times = [note.start_time for note in note_seq.notes[:num_notes]]
-  times = sorted(times)
-  deltas = [times[i+1]-times[i] for i in range(len(times)-1)]
-  return deltas
+  return np.diff(notes['start'])
 
-def find_largest_cluster_mean(cluster_to_deltas, cluster_to_size, n_clusters):
+def find_tempo_map(notes, n_diff_lengths=4, tempo_window=32):
   """
-  Find the largest cluster, which should correspond to the most frequent note
-  value
+  Tracks the local unit length over the course of a piece.
 
   Args:
-    cluster_to_deltas: maps cluster index to list of deltas in that cluster
-    cluster_to_size: maps cluster index to cluster size
-    n_clusters: number of clusters
+    notes: Note table sorted by start time
+    n_diff_lengths: How many different notelengths to cluster into
+    tempo_window: Number of notes the local unit length is averaged over
 
   Returns:
-    Mean of cluster values as a float.
-
+    Array of unit lengths in seconds, one per note.
   """
-  max_cl = 0
-  max_size = 0
-  for cl in range(0, n_clusters):
-    if cluster_to_size[cl] > max_size:
-      max_cl = cl
-      max_size = cluster_to_size[cl]
-  cl_mean = np.mean(cluster_to_deltas[max_cl])
-  return cl_mean
-  
-def find_note_lengths(note_seq, num_notes, n_diff_lengths=4):
+  deltas = extract_deltas(notes)
+  if not deltas.size:
+    return np.ones(len(notes))
+  unit_len = largest_cluster_mean(deltas, n_diff_lengths)
+  unit_lens = tempo_map.track_unit_lengths(deltas, unit_len, tempo_window)
+  return np.append(unit_lens, unit_lens[-1])
+
+def find_note_lengths(notes, n_diff_lengths=4, unit_lens=None):
   """
   Args:
-    note_seq: NoteSequence input
-    num_notes: Number of notes in the NoteSequence to consider from beginning
+    notes: Note table sorted by start time
     n_diff_lengths: How many different notelengths to cluster into
+    unit_lens: Optional tempo map from find_tempo_map. If None, a single unit
+      length is used for the whole sequence.
 
   Returns:
     List of note_lengths expressed as ints.
   """
-  deltas = np.array(extract_deltas(note_seq, num_notes))
-  kmeans = KMeans(n_clusters=n_diff_lengths, random_state=0).fit(np.array(deltas).reshape(-1, 1))
-  cluster_to_deltas = defaultdict(list)
-  cluster_to_size = defaultdict(int)
-  for i in range(len(deltas)):
-    cl = kmeans.labels_[i]
-    cluster_to_deltas[cl].append(deltas[i])
-    cluster_to_size[cl] += 1
-  unit_len = find_largest_cluster_mean(cluster_to_deltas, cluster_to_size, n_diff_lengths)
-  note_lengths = []
-  
-  for d in deltas:
-    ratio = d/float(unit_len)
-    note_length = np.round(ratio * 2)
-    note_lengths.append(int(note_length))
+  deltas = extract_deltas(notes)
+  if not deltas.size:
+    return [2]
+  if unit_lens is None:
+    unit_len = largest_cluster_mean(deltas, n_diff_lengths)
+  else:
+    unit_len = unit_lens[:-1]
+  note_lengths = np.round(deltas/unit_len * 2).astype(int).tolist()
   note_lengths.append(2)
   
   return note_lengths
@@ -95,6 +84,20 @@ def convert_pitch(midi_pitch):
   letter_name = letter_names[(midi_pitch-offset)-octave*12].lower()
   return octave, letter_name
 
+def convert_pitches(midi_pitches):
+  """
+  Vectorized convert_pitch.
+
+  Args:
+    midi_pitches: Array of midi pitches
+
+  Returns:
+    Tuple of (octaves, letter_names) arrays
+  """
+  octaves, letter_indices = np.divmod(np.asarray(midi_pitches, dtype=np.int64)-MIDI_OFFSET, 12)
+  letter_names = np.array([name.lower() for name in MIDI_LETTER_NAMES])[letter_indices]
+  return octaves, letter_names
+
 def convert_to_midi_pitch(octave, letter_name):
   """
   Converts letter name and octave to midi pitch.
@@ -102,45 +105,39 @@ def convert_to_midi_pitch(octave, letter_name):
   return 12*octave + MIDI_OFFSET + MIDI_LETTER_NAMES.index(letter_name)
   
   
-def get_note_pitch_names(note_seq, num_notes):
+def get_note_pitch_names(notes):
   """
-  Extracts letter octave pitchesfrom a NoteSequence with midi pitches.
+  Extracts letter octave pitches from a note table with midi pitches.
 
   Args:
-    note_seq: NoteSequence input
-    num_notes: Number of notes in the NoteSequence to consider from beginning
+    notes: Note table sorted by start time
 
   Returns:
     List of pitch_name tuples of (octave, letter_name)
   """
+  octaves, letter_names = convert_pitches(notes['pitch'])
+  return list(zip(octaves.tolist(), letter_names.tolist()))
 
-  notes = [(note.pitch, note.start_time) for note in note_seq.notes[:num_notes]]
-  
-  notes.sort(key=lambda elem: elem[1])
-  pitches, _ = zip(*notes)
-  
-  pitch_names = [convert_pitch(p) for p in pitches]
-    
-  return pitch_names
 
-
-def get_note_pitch_names_and_lengths(note_seq, num_notes):
+def get_note_pitch_names_and_lengths(notes, verbose=True, unit_lens=None):
   """
-  Extracts pitches and note lengths from a NoteSequence object.
+  Extracts pitches and note lengths from a note table.
 
   Args:
-    note_seq: NoteSequence input
-    num_notes: Number of notes in the NoteSequence to consider from beginning
+    notes: Note table sorted by start time
+    verbose: If True, prints the extracted pitches and note lengths
+    unit_lens: Optional tempo map from find_tempo_map
 
   Returns:
     List of tuples of (note_pitch_name, note_length), where note_pitch_name is a
       tuple of (note_octave, letter_name)
 
   """
-  note_pitch_names = get_note_pitch_names(note_seq, num_notes)
-  note_lengths = find_note_lengths(note_seq, num_notes)
-  print (note_pitch_names)
-  print (note_lengths)
+  note_pitch_names = get_note_pitch_names(notes)
+  note_lengths = find_note_lengths(notes, unit_lens=unit_lens)
+  if verbose:
+    print (note_pitch_names)
+    print (note_lengths)
   
   return list(zip(note_pitch_names, note_lengths))
   
@@ -153,16 +150,21 @@ def lilypond_pitch(octave, name):
   return name + suffix
 
 
-def note_sequence_to_lilypond_code(notes):
+def iter_lilypond_code(notes, tempo_marks=None, bar_length=None, chunk_size=1024):
   """
-  Produces compilable lilypond code from a list of note tuples.
+  Produces compilable lilypond code from note tuples, chunk by chunk.
 
   Args:
-    notes: List of tuples of (note_pitch_name, note_length), where note_pitch_name is a
-      tuple of (note_octave, letter_name)
+    notes: Iterable of tuples of (note_pitch_name, note_length), where
+      note_pitch_name is a tuple of (note_octave, letter_name)
+    tempo_marks: Optional dict mapping note index to the quarter note bpm
+      starting at that note, see tempo_map.tempo_marks
+    bar_length: If given, bar length in note_length units (eighths), e.g. 8
+      for 4/4. A bar check is written whenever a new bar is entered.
+    chunk_size: Number of notes per yielded chunk of the track.
 
-  Returns:
-    Lilypond code representing the passed in sequence of notes.
+  Yields:
+    Consecutive pieces of the lilypond code representing the notes.
 
   """
 
@@ -191,53 +193,142 @@ def note_sequence_to_lilypond_code(notes):
   }
   """
 
-  TRACK_FORMAT = """
-  notes= {{
-  {}
+  TRACK_START = """
+  notes= {
+  """
+
+  TRACK_END = """
   \\bar "|."
-  }}
+  }
   """
 
   RHYTHM_MAP = {0: '0', 1: '8', 2: '4', 3: '4.', 4: '2', 6: '2.', 8: '1', 12: '1.'}
 
-  note_pitches, note_lengths = zip(*notes)
-  note_octaves, note_names = zip(*note_pitches)
+  tempo_marks = tempo_marks or {}
+  pitch_strings = {}
+  position = 0
+  bar = 0
+  tokens = []
 
-  note_string = ''
-
-  for i in range(len(notes)):
-    note = notes[i]
-    pitch, length = note
-    octave, name = pitch
+  yield HEADER
+  yield TRACK_START
+  for i, (pitch, length) in enumerate(notes):
+    if i in tempo_marks:
+      tokens.append(' \\tempo 4 = {}'.format(tempo_marks[i]))
 
     if length==0:
       continue
 
-    new_note = lilypond_pitch(octave, name) + RHYTHM_MAP[length]
-    note_string += ' ' + new_note
+    if pitch not in pitch_strings:
+      pitch_strings[pitch] = lilypond_pitch(*pitch)
+    tokens.append(' ' + pitch_strings[pitch] + RHYTHM_MAP[length])
+
+    if bar_length:
+      position += length
+      if position//bar_length > bar:
+        bar = position//bar_length
+        tokens.append(' |')
 
-  track = TRACK_FORMAT.format(note_string)
-  return HEADER + track + BODY
+    if len(tokens) >= chunk_size:
+      yield ''.join(tokens)
+      tokens = []
+  yield ''.join(tokens)
+  yield TRACK_END
+  yield BODY
 
-def convert_midi_to_ly(midi_input_path, ly_output_path, num_notes=-1):
+def note_sequence_to_lilypond_code(notes, tempo_marks=None, bar_length=None):
   """
-  Given a midi file, produces the score as lilypond_code and saves it to a file.
+  Produces compilable lilypond code from a list of note tuples.
+
+  Args:
+    notes: List of tuples of (note_pitch_name, note_length), where note_pitch_name is a
+      tuple of (note_octave, letter_name)
+    tempo_marks: Optional dict mapping note index to the quarter note bpm
+      starting at that note, see tempo_map.tempo_marks
+    bar_length: Optional bar length in eighths, see iter_lilypond_code
+
+  Returns:
+    Lilypond code representing the passed in sequence of notes.
+
+  """
+  return ''.join(iter_lilypond_code(notes, tempo_marks, bar_length))
+
+def parse_note_sequence(note_seq, num_notes=-1, verbose=True, tempo_window=0):
+  """
+  Extracts the note tuples and tempo marks of a NoteSequence.
+
+  Args:
+    note_seq: NoteSequence input
+    num_notes: Number of notes to convert, counted in order of their start
+      times, -1 for all of them.
+    verbose: If True, prints the extracted pitches and note lengths
+    tempo_window: If > 0, number of notes the local tempo is tracked over, so
+      tempo drift in long performances is followed and marked in the score.
+
+  Returns:
+    Tuple of (parsed_notes, tempo_marks) as taken by iter_lilypond_code.
+  """
+  notes = note_table.from_note_sequence(note_seq)
+  if num_notes != -1:
+    notes = notes[:num_notes]
+
+  unit_lens = None
+  marks = None
+  if tempo_window > 0:
+    unit_lens = find_tempo_map(notes, tempo_window=tempo_window)
+    marks = tempo_map.tempo_marks(unit_lens)
+
+  parsed_notes = get_note_pitch_names_and_lengths(notes, verbose, unit_lens)
+  return parsed_notes, marks
+
+def note_sequence_to_lilypond(note_seq, num_notes=-1, verbose=True, tempo_window=0,
+                              bar_length=None):
+  """
+  Produces the score of a NoteSequence as lilypond code.
+
+  Args:
+    note_seq: NoteSequence input
+    num_notes: Number of notes to convert, counted in order of their start
+      times, -1 for all of them.
+    verbose: If True, prints the intermediate note lists and the lilypond code.
+    tempo_window: If > 0, number of notes the local tempo is tracked over, so
+      tempo drift in long performances is followed and marked in the score.
+    bar_length: Optional bar length in eighths, see iter_lilypond_code
+
+  Returns:
+    Lilypond code as a string.
+  """
+  parsed_notes, marks = parse_note_sequence(note_seq, num_notes, verbose, tempo_window)
+  lilypond_code = note_sequence_to_lilypond_code(parsed_notes, marks, bar_length)
+  if verbose:
+    print (lilypond_code)
+  return lilypond_code
+
+def convert_midi_to_ly(midi_input_path, ly_output_path, num_notes=-1, verbose=True,
+                       tempo_window=0, bar_length=None):
+  """
+  Given a midi file, produces the score as lilypond_code and streams it to a file.
 
   Args:
     midi_input_path: Path to input midi file.
     ly_output_path: Path to output lilypond code file.
+    num_notes: Number of notes to convert, -1 for all of them.
+    verbose: If True, prints the intermediate note lists and the lilypond code.
+    tempo_window: If > 0, number of notes the local tempo is tracked over, so
+      tempo drift in long performances is followed and marked in the score.
+    bar_length: Optional bar length in eighths, see iter_lilypond_code
 
   """
 
   note_seq = midi_io.midi_file_to_note_sequence(midi_input_path)
-  if num_notes == -1:
-    num_notes = len(note_seq.notes)
-
-  parsed_notes = get_note_pitch_names_and_lengths(note_seq, num_notes)
-  lilypond_code = note_sequence_to_lilypond_code(parsed_notes)
-  print (lilypond_code)
+  parsed_notes, marks = parse_note_sequence(note_seq, num_notes, verbose, tempo_window)
   with open(ly_output_path, 'w+') as f:
-    f.write(lilypond_code)
+    for chunk in iter_lilypond_code(parsed_notes, marks, bar_length):
+      f.write(chunk)
+      if verbose:
+        sys.stdout.write(chunk)
+  if verbose:
+    sys.stdout.write('\n')
 
 
 def main():
@@ -248,9 +339,17 @@ def main():
   parser.add_argument("-n", "--num_notes", help="Number of notes to convert.", type=int, default=-1)
   parser.add_argument("-s", "--ly_output_path", help="Absolute or relative path "
     "to output text file to store lilypond code", default="output.ly")
+  parser.add_argument("-t", "--tempo_window", help="Number of notes to track the "
+    "local tempo over, 0 to use a single tempo for the whole piece.", type=int, default=0)
+  parser.add_argument("-b", "--bar_length", help="Bar length in eighths, e.g. 8 for "
+    "4/4, to write bar checks into the score.", type=int, default=None)
+  parser.add_argument("-q", "--quiet", action="store_true", help="Do not print the "
+    "extracted notes and the lilypond code")
   args = parser.parse_args()
 
-  convert_midi_to_ly(args.midi_input_path, args.ly_output_path, args.num_notes)
+  convert_midi_to_ly(args.midi_input_path, args.ly_output_path, args.num_notes,
+                     verbose=not args.quiet, tempo_window=args.tempo_window,
+                     bar_length=args.bar_length)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,253 @@
+"""
+Long-lived midi to lilypond conversion server and its thin client.
+
+The server imports midi_to_lilypond (and with it magenta) once and then answers
+convert requests on a Unix socket, or on a localhost port, so each conversion
+only costs the conversion itself. The client only uses the standard library
+and starts instantly; if no server is running it falls back to converting in
+process.
+
+A request is one JSON object sent before the client shuts down its write side:
+
+  {"midi_path": "...", "num_notes": -1, "tempo_window": 0}
+
+with "midi_bytes" (base64 encoded midi file) instead of "midi_path" to send the
+file contents, and an optional "bar_length". The response is
+{"lilypond": "..."} or {"error": "..."}.
+
+midi_to_lilypond.py itself always converts in process: importing it already
+loads magenta, so handing its conversions to a server would save nothing. Use
+the convert command of this module to get the fast path.
+
+Example usage:
+
+python midi_to_lilypond_server.py serve &
+python midi_to_lilypond_server.py convert \
+    -m ../data/midifiles/transcription_alle_voegel.mid \
+    -s output.ly
+
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+
+DEFAULT_SOCKET_PATH = '/tmp/melydi_midi_to_lilypond.sock'
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+  """Handles one convert request per connection."""
+
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.read().decode('utf-8'))
+      response = {'lilypond': convert_request(request)}
+    except Exception as e:
+      response = {'error': repr(e)}
+    self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+  class ThreadingUnixStreamServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def convert_request(request):
+  """
+  Converts the midi file of a request to lilypond code.
+
+  Args:
+    request: Dict with either "midi_path" or base64 encoded "midi_bytes", and
+      optional "num_notes", "tempo_window" and "bar_length".
+
+  Returns:
+    Lilypond code as a string.
+  """
+  import midi_to_lilypond
+  if 'midi_bytes' in request:
+    midi_data = base64.b64decode(request['midi_bytes'])
+    note_seq = midi_to_lilypond.midi_io.midi_to_note_sequence(midi_data)
+  else:
+    note_seq = midi_to_lilypond.midi_io.midi_file_to_note_sequence(request['midi_path'])
+  return midi_to_lilypond.note_sequence_to_lilypond(
+      note_seq, request.get('num_notes', -1), verbose=False,
+      tempo_window=request.get('tempo_window', 0),
+      bar_length=request.get('bar_length'))
+
+
+def remove_stale_socket(socket_path):
+  """
+  Removes a Unix socket left behind by a server that is gone.
+
+  Args:
+    socket_path: Path of the Unix socket.
+
+  Raises:
+    OSError: If a server is still listening on the socket, or the path is not
+      a socket.
+  """
+  try:
+    mode = os.stat(socket_path).st_mode
+  except FileNotFoundError:
+    return
+  if not stat.S_ISSOCK(mode):
+    raise OSError("{} exists and is not a socket".format(socket_path))
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socket_path)
+  except ConnectionRefusedError:
+    os.remove(socket_path)
+    return
+  except FileNotFoundError:
+    return
+  finally:
+    sock.close()
+  raise OSError("A conversion server is already listening on {}".format(socket_path))
+
+
+def serve(socket_path=DEFAULT_SOCKET_PATH, port=None):
+  """
+  Runs the conversion server until interrupted.
+
+  Args:
+    socket_path: Path of the Unix socket to listen on.
+    port: If given, listens on this localhost port instead of a Unix socket.
+  """
+  # Pay for the heavy imports before accepting the first request.
+  import midi_to_lilypond
+  if port is not None:
+    server = ThreadingTCPServer(('127.0.0.1', port), ConversionHandler)
+  else:
+    remove_stale_socket(socket_path)
+    server = ThreadingUnixStreamServer(socket_path, ConversionHandler)
+  print ("Conversion server listening on {}".format(port or socket_path))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if port is None and os.path.exists(socket_path):
+      os.remove(socket_path)
+
+
+def request_conversion(request, socket_path=DEFAULT_SOCKET_PATH, port=None):
+  """
+  Sends a convert request to a running server.
+
+  Args:
+    request: Request dict, see convert_request.
+    socket_path: Path of the server's Unix socket.
+    port: If given, connects to this localhost port instead of a Unix socket.
+
+  Returns:
+    Lilypond code as a string.
+
+  Raises:
+    OSError: If no server is listening.
+    RuntimeError: If the server failed to convert the file.
+  """
+  if port is not None:
+    sock = socket.create_connection(('127.0.0.1', port))
+  else:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+  try:
+    sock.sendall(json.dumps(request).encode('utf-8'))
+    sock.shutdown(socket.SHUT_WR)
+    chunks = []
+    while True:
+      chunk = sock.recv(65536)
+      if not chunk:
+        break
+      chunks.append(chunk)
+  finally:
+    sock.close()
+  response = json.loads(b''.join(chunks).decode('utf-8'))
+  if 'error' in response:
+    raise RuntimeError(response['error'])
+  return response['lilypond']
+
+
+def convert(midi_input_path, ly_output_path, num_notes=-1, tempo_window=0,
+            send_bytes=False, socket_path=DEFAULT_SOCKET_PATH, port=None,
+            bar_length=None):
+  """
+  Converts a midi file through the server, or in process if none is running.
+
+  Args:
+    midi_input_path: Path to input midi file.
+    ly_output_path: Path to output lilypond code file.
+    num_notes: Number of notes to convert, -1 for all of them.
+    tempo_window: If > 0, number of notes the local tempo is tracked over.
+    send_bytes: If True, sends the midi file contents instead of its path, for
+      servers that do not share the client's file system.
+    socket_path: Path of the server's Unix socket.
+    port: If given, connects to this localhost port instead of a Unix socket.
+    bar_length: Optional bar length in eighths, to write bar checks.
+  """
+  request = {'num_notes': num_notes, 'tempo_window': tempo_window,
+             'bar_length': bar_length}
+  if send_bytes:
+    with open(midi_input_path, 'rb') as f:
+      request['midi_bytes'] = base64.b64encode(f.read()).decode('ascii')
+  else:
+    request['midi_path'] = os.path.abspath(midi_input_path)
+
+  try:
+    lilypond_code = request_conversion(request, socket_path, port)
+  except OSError:
+    sys.stderr.write("No conversion server running, converting in process.\n")
+    import midi_to_lilypond
+    midi_to_lilypond.convert_midi_to_ly(midi_input_path, ly_output_path, num_notes,
+                                        verbose=False, tempo_window=tempo_window,
+                                        bar_length=bar_length)
+    return
+  with open(ly_output_path, 'w+') as f:
+    f.write(lilypond_code)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--socket_path", help="Path of the server's Unix socket",
+    default=DEFAULT_SOCKET_PATH)
+  parser.add_argument("--port", help="Use this localhost port instead of a Unix socket",
+    type=int, default=None)
+  subparsers = parser.add_subparsers(dest="command")
+  subparsers.required = True
+  subparsers.add_parser("serve", help="Run the conversion server")
+  convert_parser = subparsers.add_parser("convert", help="Convert a midi file")
+  convert_parser.add_argument("-m", "--midi_input_path", help="Absolute or relative path to "
+    "midi file to convert to lilypond code",
+    default='../data/midifiles/transcription_alle_voegel.mid')
+  convert_parser.add_argument("-n", "--num_notes", help="Number of notes to convert.",
+    type=int, default=-1)
+  convert_parser.add_argument("-s", "--ly_output_path", help="Absolute or relative path "
+    "to output text file to store lilypond code", default="output.ly")
+  convert_parser.add_argument("-t", "--tempo_window", help="Number of notes to track the "
+    "local tempo over, 0 to use a single tempo for the whole piece.", type=int, default=0)
+  convert_parser.add_argument("-b", "--send_bytes", action="store_true", help="Send the "
+    "midi file contents instead of its path")
+  convert_parser.add_argument("--bar_length", help="Bar length in eighths, e.g. 8 "
+    "for 4/4, to write bar checks into the score.", type=int, default=None)
+  args = parser.parse_args()
+
+  if args.command == 'serve':
+    serve(args.socket_path, args.port)
+  else:
+    convert(args.midi_input_path, args.ly_output_path, args.num_notes,
+            args.tempo_window, args.send_bytes, args.socket_path, args.port,
+            args.bar_length)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+"""
+Columnar note table shared by the transcription steps.
+
+A NoteSequence is turned into one structured NumPy array, sorted by start time,
+once per file. Later steps take slices of it (which are views, not copies) and
+work on its columns instead of walking the protobuf notes again.
+"""
+import numpy as np
+
+NOTE_DTYPE = np.dtype([
+    ('pitch', np.int16),
+    ('start', np.float64),
+    ('end', np.float64),
+    ('velocity', np.int16),
+    ('instrument', np.int16),
+])
+
+
+def from_note_sequence(note_seq):
+  """
+  Builds the note table of a NoteSequence.
+
+  Args:
+    note_seq: NoteSequence input
+
+  Returns:
+    Structured array of NOTE_DTYPE sorted by start time. Notes starting at the
+      same time keep their order in the NoteSequence.
+  """
+  notes = np.fromiter(
+      ((note.pitch, note.start_time, note.end_time, note.velocity, note.instrument)
+       for note in note_seq.notes),
+      dtype=NOTE_DTYPE, count=len(note_seq.notes))
+  return notes[np.argsort(notes['start'], kind='mergesort')]
+
+
+def from_arrays(pitches, starts, ends, velocities=64, instruments=0):
+  """
+  Builds a note table from note columns.
+
+  Args:
+    pitches: Midi pitches.
+    starts: Start times in seconds.
+    ends: End times in seconds.
+    velocities: Note velocities, a scalar applies to all notes.
+    instruments: Instrument numbers as in NoteSequence notes, a scalar applies
+      to all notes.
+
+  Returns:
+    Structured array of NOTE_DTYPE sorted by start time.
+  """
+  notes = np.empty(len(pitches), dtype=NOTE_DTYPE)
+  notes['pitch'] = pitches
+  notes['start'] = starts
+  notes['end'] = ends
+  notes['velocity'] = velocities
+  notes['instrument'] = instruments
+  return notes[np.argsort(notes['start'], kind='mergesort')]
@@ -0,0 +1,69 @@
+"""
+Local tempo tracking for long, freely played performances.
+
+A single global unit length quantizes badly once the player speeds up or slows
+down. Here the unit length is re-estimated around every note from a sliding
+window over the onset deltas: the deltas in the window are divided by the note
+values they were quantized to. Window sums come from cumulative sums, so a
+whole performance is tracked in O(n) regardless of the window size.
+"""
+import numpy as np
+
+
+def _window_sums(values, half_window):
+  """Sum of values[i-half_window:i+half_window+1] for every i."""
+  n = values.size
+  cumsum = np.concatenate([[0.], np.cumsum(values)])
+  indices = np.arange(n)
+  lo = np.maximum(indices-half_window, 0)
+  hi = np.minimum(indices+half_window+1, n)
+  return cumsum[hi] - cumsum[lo]
+
+
+def track_unit_lengths(deltas, unit_len, window=32, n_iter=3, max_drift=2.):
+  """
+  Estimates the local unit length (duration of a quarter note) at every delta.
+
+  Args:
+    deltas: Array of time deltas between consecutive notes.
+    unit_len: Global unit length, e.g. the largest cluster mean of the deltas.
+    window: Number of deltas the local estimate is averaged over.
+    n_iter: Number of quantize and re-estimate passes.
+    max_drift: Largest factor the local unit length may deviate from unit_len.
+
+  Returns:
+    Array of local unit lengths, one per delta.
+  """
+  deltas = np.asarray(deltas, dtype=np.float64)
+  unit_lens = np.full(deltas.size, float(unit_len))
+  half_window = max(window//2, 1)
+  for _ in range(n_iter):
+    # Note values in quarter notes, on the same half-unit grid as find_note_lengths.
+    note_values = np.round(deltas/unit_lens * 2)/2.
+    timed = note_values > 0
+    value_sums = _window_sums(note_values, half_window)
+    delta_sums = _window_sums(np.where(timed, deltas, 0.), half_window)
+    estimate = np.where(value_sums > 0, delta_sums/np.maximum(value_sums, 1e-12), unit_lens)
+    unit_lens = np.clip(estimate, unit_len/max_drift, unit_len*max_drift)
+  return unit_lens
+
+
+def tempo_marks(unit_lens, tolerance=0.05):
+  """
+  Turns a tempo map into tempo marks for the score.
+
+  Args:
+    unit_lens: Local unit length per note, as produced by track_unit_lengths.
+    tolerance: Relative tempo change needed before a new mark is written.
+
+  Returns:
+    Dict mapping note index to the quarter note bpm starting at that note.
+  """
+  bpms = np.round(60./np.asarray(unit_lens)).astype(int)
+  marks = {}
+  last_bpm = None
+  for i, bpm in enumerate(bpms.tolist()):
+    if last_bpm is None or abs(bpm-last_bpm) > tolerance*last_bpm:
+      marks[i] = bpm
+      last_bpm = bpm
+  return marks
@@ -0,0 +1,317 @@
+"""
+Aligns a recorded midi file to the audio recorded alongside it.
+
+Both recordings are turned into frames of chroma and onset chroma features on
+the same time grid, then matched by multiscale dynamic time warping: the path
+found between coarse versions of the features bounds a narrow band of cells
+at the next finer level, so time and memory grow with the number of frames
+times the band width instead of the product of the two lengths. The cost of
+a cell is only computed inside the band, and every row of the band is filled
+in one vectorized step, since the step sizes (1, 1), (1, 2) and (2, 1) only
+look back at earlier rows. The warping path then moves every midi event to
+the audio time it was heard at. Leading and trailing silence is left out of
+the alignment, the events before and after it keep their offsets to it.
+
+Example usage:
+
+python alignment.py -m take.mid -a take.wav -o take_aligned.mid
+
+"""
+import argparse
+import time
+
+import mido
+import numpy as np
+
+from pitch_processing import frame_signal, hz_to_midi, read_audio
+
+STEPS = np.array([(1, 1), (1, 2), (2, 1)])
+# a step costs its Manhattan length, so no slope is favored
+STEP_WEIGHTS = STEPS.sum(axis=1).astype(np.float64)
+
+
+def normalize(features):
+    """Scales every frame of features to unit length, silent frames stay zero."""
+    norms = np.sqrt(np.einsum('ij,ij->i', features, features))
+    return features/np.maximum(norms, 1e-9)[:, None]
+
+
+def onset_features(chroma):
+    """Half-wave rectified frame to frame increase of chroma."""
+    return np.maximum(np.diff(chroma, axis=0, prepend=chroma[:1]), 0)
+
+
+def chroma_matrix(fs, n_fft, fmin=27.5, fmax=4200.):
+    """(n_fft//2+1, 12) matrix summing the spectrum bins of every pitch class."""
+    f = np.arange(n_fft//2+1)*fs/float(n_fft)
+    in_range = (f >= fmin) & (f <= fmax)
+    pitch_classes = np.round(hz_to_midi(np.maximum(f, 1e-9))).astype(np.int64) % 12
+    matrix = np.zeros((len(f), 12))
+    matrix[np.flatnonzero(in_range), pitch_classes[in_range]] = 1.
+    return matrix
+
+
+def audio_features(fs, x, frame_size=4096, hop_size=1024, block_size=512, silence_db=-50.):
+    """
+    Chroma and onset chroma of every frame of x. Frames are analyzed in
+    blocks, so long recordings never hold their whole spectrogram. Frames
+    more than silence_db below the loudest one are silent and left zero.
+
+    Returns:
+        (num_frames, 24) array, frame k starting at sample k*hop_size
+    """
+    num_frames = 1 + max(int(np.ceil((len(x)-frame_size)/float(hop_size))), 0)
+    matrix = chroma_matrix(fs, frame_size)
+    window = np.hanning(frame_size)
+    chroma = np.empty((num_frames, 12))
+    for first in range(0, num_frames, block_size):
+        count = min(block_size, num_frames-first)
+        segment = x[first*hop_size:(first+count-1)*hop_size+frame_size]
+        frames = frame_signal(segment, frame_size, hop_size)[:count]
+        chroma[first:first+count] = np.abs(np.fft.rfft(frames*window, axis=1)).dot(matrix)
+    energy = chroma.sum(axis=1)
+    chroma[energy < 10**(silence_db/20.)*energy.max()] = 0
+    chroma = normalize(np.log1p(100*chroma/max(chroma.max(), 1e-9)))
+    return np.hstack([chroma, normalize(onset_features(chroma))])
+
+
+def sounding_frames(features):
+    """
+    Range of frames from the first to the last one that is not silent.
+
+    Returns:
+        Tuple of (first, stop)
+    """
+    sounding = np.flatnonzero(features.any(axis=1))
+    if not len(sounding):
+        return 0, len(features)
+    return sounding[0], sounding[-1]+1
+
+
+def read_midi_events(midi_file):
+    """
+    Reads all messages of a midi file with their times in seconds.
+
+    Returns:
+        Tuple of (messages, times)
+    """
+    messages, times = [], []
+    now = 0.
+    for msg in mido.MidiFile(midi_file):
+        now += msg.time
+        messages.append(msg)
+        times.append(now)
+    return messages, np.array(times)
+
+
+def midi_features(messages, times, num_frames, frame_rate, frame_offset, decay=1.):
+    """
+    Chroma and onset chroma of the notes of a midi file on the frame grid of
+    audio_features. A held note fades like a struck string.
+
+    Args:
+        messages (list): Midi messages
+        times (array): Message times in seconds
+        num_frames (int): Number of frames
+        frame_rate (float): Frames per second
+        frame_offset (float): Time of the center of the first frame
+        decay (float): Decay rate of held notes, per second
+
+    Returns:
+        (num_frames, 24) array
+    """
+    chroma = np.zeros((num_frames, 12))
+    held = {}
+    frame_times = frame_offset + np.arange(num_frames)/frame_rate
+    for msg, t in zip(messages, times):
+        if msg.type == 'note_on' and msg.velocity > 0:
+            held[(msg.channel, msg.note)] = (t, msg.velocity)
+        elif msg.type in ('note_on', 'note_off') and (msg.channel, msg.note) in held:
+            start, velocity = held.pop((msg.channel, msg.note))
+            first, stop = np.searchsorted(frame_times, [start, max(t, start+1./frame_rate)])
+            chroma[first:stop, msg.note % 12] += velocity*np.exp(-decay*(frame_times[first:stop]-start))
+    chroma = normalize(np.log1p(100*chroma/max(chroma.max(), 1e-9)))
+    return np.hstack([chroma, normalize(onset_features(chroma))])
+
+
+def _band_values(row, row_lo, cols):
+    """Values of a stored band row at cols, inf outside of the band."""
+    values = np.full(len(cols), np.inf)
+    index = cols - row_lo
+    valid = (index >= 0) & (index < len(row))
+    values[valid] = row[index[valid]]
+    return values
+
+
+def banded_dtw(X, Y, lo, hi):
+    """
+    Dynamic time warping of X against Y, only visiting columns lo[i] to hi[i]
+    of every row i. Feature frames are compared by cosine distance.
+
+    Args:
+        X (array): (n, d) unit length feature frames
+        Y (array): (m, d) unit length feature frames
+        lo (array): First column of every row
+        hi (array): End column of every row
+
+    Returns:
+        (path_length, 2) array of (i, j) path cells from (0, 0) to (n-1, m-1)
+    """
+    n, m = len(X), len(Y)
+    width = int((hi-lo).max())
+    steps = np.zeros((n, width), dtype=np.int8)
+    rows = [None, None]  # band rows i-1 and i-2 as (lo, costs)
+    for i in range(n):
+        cols = np.arange(lo[i], hi[i])
+        cost = 1. - Y[cols].dot(X[i])
+        candidates = np.full((len(STEPS), len(cols)), np.inf)
+        for k, (di, dj) in enumerate(STEPS):
+            if rows[di-1] is not None:
+                candidates[k] = _band_values(rows[di-1][1], rows[di-1][0], cols-dj) + STEP_WEIGHTS[k]*cost
+        best = np.argmin(candidates, axis=0)
+        total = candidates[best, np.arange(len(cols))]
+        if i == 0:
+            total = np.where(cols == 0, 2*cost, np.inf)
+        steps[i, :len(cols)] = best
+        rows = [(lo[i], total), rows[0]]
+    if not np.isfinite(_band_values(rows[0][1], rows[0][0], np.array([m-1]))[0]):
+        raise ValueError('No warping path within the band, the recordings differ in '
+                         'length by more than a factor of two.')
+
+    path = [(n-1, m-1)]
+    i, j = n-1, m-1
+    while i > 0:
+        di, dj = STEPS[steps[i, j-lo[i]]]
+        i, j = i-di, j-dj
+        path.append((i, j))
+    return np.array(path[::-1])
+
+
+def _downsample(features, factor):
+    n = len(features)
+    padded = np.zeros((-(-n//factor)*factor, features.shape[1]))
+    padded[:n] = features
+    return normalize(padded.reshape(-1, factor, features.shape[1]).sum(axis=1))
+
+
+def band_around_path(path, factor, n, m, radius):
+    """
+    Projects a path found on features downsampled by factor to the full
+    resolution and widens it by radius frames on both sides.
+
+    Returns:
+        Tuple of (lo, hi) column bounds of every row
+    """
+    offsets = np.arange(factor)
+    rows = (path[:, :1]*factor + offsets).ravel()
+    col_lo = np.repeat(path[:, 1]*factor, factor)
+    col_hi = col_lo + factor
+    valid = rows < n
+    lo = np.full(n, m, dtype=np.int64)
+    hi = np.zeros(n, dtype=np.int64)
+    np.minimum.at(lo, rows[valid], col_lo[valid])
+    np.maximum.at(hi, rows[valid], col_hi[valid])
+    # rows skipped by (2, 1) steps get the bounds of their neighbours
+    lo = np.minimum.accumulate(lo[::-1])[::-1]
+    hi = np.maximum.accumulate(hi)
+    return np.clip(lo-radius, 0, m-1), np.clip(hi+radius, 1, m)
+
+
+def multiscale_dtw(X, Y, radius=16, factor=4, min_size=256):
+    """
+    Dynamic time warping of X against Y, refining the path found between
+    downsampled features within a band of radius frames.
+
+    Returns:
+        (path_length, 2) array of (i, j) path cells, see banded_dtw
+    """
+    n, m = len(X), len(Y)
+    if min(n, m) <= min_size:
+        return banded_dtw(X, Y, np.zeros(n, dtype=np.int64), np.full(n, m, dtype=np.int64))
+    coarse_path = multiscale_dtw(_downsample(X, factor), _downsample(Y, factor), radius, factor, min_size)
+    return banded_dtw(X, Y, *band_around_path(coarse_path, factor, n, m, radius))
+
+
+def warp_times(times, path, frame_rate, frame_offset):
+    """
+    Maps midi times to audio times along a warping path.
+
+    Returns:
+        Array of audio times, nondecreasing in times
+    """
+    # average the audio frames a midi frame is matched to, so the map is a function
+    midi_frames, first = np.unique(path[:, 0], return_index=True)
+    audio_frames = np.add.reduceat(path[:, 1], first)/np.diff(np.append(first, len(path)))
+    midi_times = frame_offset + midi_frames/frame_rate
+    audio_times = frame_offset + audio_frames/frame_rate
+    # times outside of the path keep their offset to its ends
+    times = np.asarray(times, dtype=np.float64)
+    warped = np.interp(times, midi_times, audio_times)
+    warped = np.where(times < midi_times[0], times-midi_times[0]+audio_times[0], warped)
+    warped = np.where(times > midi_times[-1], times-midi_times[-1]+audio_times[-1], warped)
+    return np.maximum(np.maximum.accumulate(warped), 0)
+
+
+def write_midi(messages, times, output_file, ticks_per_beat=480):
+    """Writes messages at the given times in seconds as a single track midi file at 120 bpm."""
+    track = mido.MidiTrack()
+    ticks = np.round(np.asarray(times)*2*ticks_per_beat).astype(np.int64)
+    last_tick = 0
+    for msg, tick in zip(messages, ticks.tolist()):
+        if msg.is_meta and msg.type in ('set_tempo', 'end_of_track'):
+            continue
+        track.append(msg.copy(time=tick-last_tick))
+        last_tick = tick
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    midi_file.tracks.append(track)
+    midi_file.save(output_file)
+
+
+def align_midi_to_audio(midi_file, audio_file, output_file, frame_size=4096, hop_size=1024, radius=16,
+                        verbose=True):
+    """
+    Moves the events of a midi file to the times they can be heard at in an
+    audio recording of the same performance.
+
+    Args:
+        midi_file (str): Input midi file name
+        audio_file (str): Wav file name
+        output_file (str): Aligned midi file name
+        frame_size (int): Samples per feature frame
+        hop_size (int): Samples between feature frames
+        radius (int): Band radius in frames around the coarser path
+        verbose (bool): If True, prints timings
+
+    Returns:
+        (path_length, 2) warping path between midi and audio frames
+    """
+    start = time.time()
+    fs, x = read_audio(audio_file)
+    messages, times = read_midi_events(midi_file)
+    frame_rate = fs/float(hop_size)
+    frame_offset = frame_size/2./fs
+    Y = audio_features(fs, x, frame_size, hop_size)
+    num_midi_frames = max(int(np.ceil(times[-1]*frame_rate)) if len(times) else 0, 1)
+    X = midi_features(messages, times, num_midi_frames, frame_rate, frame_offset)
+    features_time = time.time()-start
+    # silence before and after the performance differs between the recordings,
+    # only the sounding frames are aligned
+    x_first, x_stop = sounding_frames(X)
+    y_first, y_stop = sounding_frames(Y)
+    path = multiscale_dtw(X[x_first:x_stop], Y[y_first:y_stop], radius) + [x_first, y_first]
+    write_midi(messages, warp_times(times, path, frame_rate, frame_offset), output_file)
+    if verbose:
+        print ('{} midi x {} audio frames: features {:.2f}s, alignment {:.2f}s, '
+               'a full cost matrix would take {:.0f} MB'.format(
+                   len(X), len(Y), features_time, time.time()-start-features_time, len(X)*len(Y)*8/1e6))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Align a midi recording to an audio recording')
+    parser.add_argument('-m', '--midi_input', required=True, help='Path to input midi file')
+    parser.add_argument('-a', '--audio_input', required=True, help='Path to wav file')
+    parser.add_argument('-o', '--midi_output', required=True, help='Path to aligned output midi file')
+    parser.add_argument('-r', '--radius', type=int, default=16, help='Band radius in frames')
+    args = parser.parse_args()
+    align_midi_to_audio(args.midi_input, args.audio_input, args.midi_output, radius=args.radius)
@@ -0,0 +1,200 @@
+"""
+Memory mapped bank of note templates and a matched filter note recognizer.
+
+A template is the normalized mean spectrum of a note recording. The bank file
+holds a fixed-size header, the midi pitch of every template and the templates
+as one contiguous float32 matrix, so loading it only maps the file. The
+recognizer normalizes the spectra of all frames of a signal the same way and
+scores them against every template in a single matrix multiply.
+
+Replaces data/piano_notes/note_models.dat, a pickle of power spectra keyed by
+pitch class that had to be unpickled completely before use.
+
+Example usage (build the bank from the sample library, then recognize a file):
+
+python note_templates.py build ../data/piano_notes/5_octaves ../data/piano_notes/note_templates.tpl
+python note_templates.py recognize ../data/piano_notes/note_templates.tpl ../data/piano_notes/one_octave/C4.wav
+
+"""
+import argparse
+import os
+
+import numpy as np
+
+from pitch_processing import get_onset, note_name_to_midi, read_audio, stft
+
+MAGIC = b'MELYTPL1'
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('num_templates', '<u4'),
+    ('num_bins', '<u4'),
+    ('sample_rate', '<u4'),
+    ('frame_size', '<u4'),
+    ('hop_size', '<u4'),
+    ('n_fft', '<u4'),
+])
+PITCH_DTYPE = np.dtype('<i2')
+TEMPLATE_DTYPE = np.dtype('<f4')
+
+
+def frame_features(x, frame_size, hop_size, n_fft, num_bins):
+    """
+    Square root compressed magnitude spectra of all frames of x, cut to
+    num_bins and scaled to unit length.
+
+    Returns:
+        (num_frames, num_bins) float32 array
+    """
+    features = np.sqrt(stft(x, frame_size, hop_size, n_fft)[:, :num_bins]).astype(np.float32)
+    norms = np.sqrt(np.einsum('ij,ij->i', features, features))
+    features /= np.maximum(norms, 1e-12)[:, None]
+    return features
+
+
+def build_templates(paths, frame_size=4096, hop_size=1024, n_fft=8192, fmax=5000., duration=0.5):
+    """
+    Computes a template for every note recording.
+
+    Args:
+        paths (list): Wav files named by their notes, e.g. a2.wav or Ab4.wav
+        frame_size (int): Samples per frame
+        hop_size (int): Samples between frame starts
+        n_fft (int): FFT size
+        fmax (float): Highest frequency in Hz kept in the templates
+        duration (float): Seconds after the onset averaged into a template
+
+    Returns:
+        Tuple of (header, pitches, templates), see write_templates
+    """
+    header = np.zeros(1, dtype=HEADER_DTYPE)[0]
+    header['magic'] = MAGIC
+    header['frame_size'] = frame_size
+    header['hop_size'] = hop_size
+    header['n_fft'] = n_fft
+    pitches = []
+    templates = []
+    for path in paths:
+        fs, x = read_audio(path)
+        if header['sample_rate'] and fs != header['sample_rate']:
+            raise ValueError("'{}' has a sample rate of {}, expected {}.".format(path, fs, header['sample_rate']))
+        header['sample_rate'] = fs
+        header['num_bins'] = min(int(fmax*n_fft/fs)+1, n_fft//2+1)
+        start = int(get_onset(fs, x)*fs)
+        features = frame_features(x[start:start+int(duration*fs)+frame_size],
+                                  frame_size, hop_size, n_fft, header['num_bins'])
+        template = features.mean(axis=0)
+        templates.append(template/max(np.linalg.norm(template), 1e-12))
+        pitches.append(note_name_to_midi(os.path.splitext(os.path.basename(path))[0]))
+    header['num_templates'] = len(pitches)
+    order = np.argsort(pitches, kind='mergesort')
+    return (header, np.asarray(pitches, dtype=PITCH_DTYPE)[order],
+            np.asarray(templates, dtype=TEMPLATE_DTYPE).reshape(len(pitches), -1)[order])
+
+
+def write_templates(filename, header, pitches, templates):
+    """
+    Writes a template bank: the header, then the pitch of every template, then
+    the (num_templates, num_bins) template matrix.
+    """
+    with open(filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(pitches, dtype=PITCH_DTYPE).tobytes())
+        f.write(np.ascontiguousarray(templates, dtype=TEMPLATE_DTYPE).tobytes())
+
+
+def build_template_file(directory, filename, **kwargs):
+    """Builds a template bank from every wav file of a directory, see build_templates."""
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith('.wav'))
+    write_templates(filename, *build_templates(paths, **kwargs))
+
+
+class TemplateBank():
+    def __init__(self, filename):
+        """
+        Memory mapped template bank.
+
+        Args:
+            filename (str): Template bank file name, see build_template_file
+
+        """
+        self.header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+        if not len(self.header) or self.header['magic'][0] != MAGIC:
+            raise ValueError("'{}' is not a template bank.".format(filename))
+        self.header = self.header[0]
+        num_templates = int(self.header['num_templates'])
+        self.pitches = np.memmap(filename, dtype=PITCH_DTYPE, mode='r',
+                                 offset=HEADER_DTYPE.itemsize, shape=(num_templates,))
+        self.templates = np.memmap(filename, dtype=TEMPLATE_DTYPE, mode='r',
+                                   offset=HEADER_DTYPE.itemsize + num_templates*PITCH_DTYPE.itemsize,
+                                   shape=(num_templates, int(self.header['num_bins'])))
+
+    def __len__(self):
+        return len(self.pitches)
+
+    @property
+    def frame_duration(self):
+        """Seconds between the starts of two scored frames."""
+        return self.header['hop_size']/float(self.header['sample_rate'])
+
+    def score(self, fs, x):
+        """
+        Matched filter scores of all frames of x against all templates.
+
+        Returns:
+            (num_frames, num_templates) array of cosine similarities
+        """
+        if fs != self.header['sample_rate']:
+            raise ValueError("Sample rate {} does not match the bank's {}.".format(fs, self.header['sample_rate']))
+        features = frame_features(x, int(self.header['frame_size']), int(self.header['hop_size']),
+                                  int(self.header['n_fft']), int(self.header['num_bins']))
+        return features.dot(self.templates.T)
+
+    def recognize(self, fs, x, min_score=0.5):
+        """
+        Best matching template of every frame of x.
+
+        Args:
+            fs (int): Sample rate
+            x (array): Samples
+            min_score (float): Frames scoring lower against all templates are
+                reported as -1
+
+        Returns:
+            Tuple of (pitches, scores), one entry per frame
+        """
+        scores = self.score(fs, x)
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(len(best)), best]
+        return np.where(best_scores >= min_score, self.pitches[best], -1), best_scores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a note template bank or recognize notes with it')
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='Build a template bank from a sample library')
+    build_parser.add_argument('directory', help='Directory of wav files named by their notes, e.g. a2.wav')
+    build_parser.add_argument('filename', help='Template bank file to write')
+    recognize_parser = subparsers.add_parser('recognize', help='Print the notes recognized in wav files')
+    recognize_parser.add_argument('filename', help='Template bank file')
+    recognize_parser.add_argument('wav_files', nargs='+')
+    args = parser.parse_args()
+
+    import time
+    if args.command == 'build':
+        build_template_file(args.directory, args.filename)
+    elif args.command == 'recognize':
+        start = time.time()
+        bank = TemplateBank(args.filename)
+        print ('Loaded {} templates in {:.2f} ms'.format(len(bank), 1000*(time.time()-start)))
+        for path in args.wav_files:
+            fs, x = read_audio(path)
+            start = time.time()
+            pitches, scores = bank.recognize(fs, x)
+            elapsed = time.time()-start
+            values, counts = np.unique(pitches[pitches >= 0], return_counts=True)
+            print ('{}: most frequent pitch {}, {:.0f}x real time'.format(
+                os.path.basename(path), values[np.argmax(counts)] if len(values) else None,
+                len(x)/float(fs)/max(elapsed, 1e-9)))
+    else:
+        parser.print_help()
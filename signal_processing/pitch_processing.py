@@ -0,0 +1,304 @@
+"""
+Onset, f0 and harmonic peak detection for piano recordings.
+
+All frames of a file go through a single FFT call, and f0 estimation, peak
+picking and outlier detection work on whole arrays. Directories are analyzed
+by a pool of worker processes.
+
+Example usage (check the sample library against its file names):
+
+python pitch_processing.py ../data/piano_notes/5_octaves
+
+"""
+import argparse
+import multiprocessing
+import os
+import re
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.io.wavfile import read
+
+NATURAL_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+ACCIDENTALS = {None: 0, 'b': -1, 's': 1, '#': 1}
+
+
+def note_name_to_midi(name):
+    """
+    Parses note names like 'A2', 'Ab4', 'Bb3', 'as2' or 'cs4' (s for sharp).
+
+    Returns:
+        Midi pitch as an int, e.g. 69 for 'A4'
+    """
+    match = re.match(r'^([a-gA-G])(b|s|#)?(-?\d+)$', name)
+    if not match:
+        raise ValueError("'{}' is not a note name.".format(name))
+    letter, accidental, octave = match.groups()
+    return 12*(int(octave)+1) + NATURAL_PITCH_CLASSES[letter.upper()] + ACCIDENTALS[accidental]
+
+
+def midi_to_hz(midi_pitch):
+    return 440. * 2**((np.asarray(midi_pitch, dtype=np.float64)-69)/12.)
+
+
+def hz_to_midi(f):
+    return 69 + 12*np.log2(np.asarray(f, dtype=np.float64)/440.)
+
+
+def read_audio(path):
+    """
+    Reads a wav file as mono float64 samples scaled to a peak of 1.
+
+    Returns:
+        Tuple of (fs, x)
+    """
+    fs, x = read(path)
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim > 1:
+        x = x.mean(axis=1)
+    peak = np.abs(x).max()
+    if peak > 0:
+        x /= peak
+    return fs, x
+
+
+def frame_signal(x, frame_size, hop_size):
+    """
+    Splits x into overlapping frames without copying.
+
+    Returns:
+        Read-only (num_frames, frame_size) view of x, zero padded at the end
+    """
+    num_frames = 1 + max(int(np.ceil((len(x)-frame_size)/float(hop_size))), 0)
+    padded = np.zeros((num_frames-1)*hop_size + frame_size)
+    padded[:len(x)] = x[:len(padded)]
+    return as_strided(padded, shape=(num_frames, frame_size),
+                      strides=(padded.strides[0]*hop_size, padded.strides[0]), writeable=False)
+
+
+def stft(x, frame_size=2048, hop_size=512, n_fft=None):
+    """
+    Magnitude spectrogram of x, all frames in one FFT call.
+
+    Args:
+        x (array): Samples
+        frame_size (int): Samples per frame
+        hop_size (int): Samples between frame starts
+        n_fft (int): FFT size, frames are zero padded to it, defaults to frame_size
+
+    Returns:
+        (num_frames, n_fft//2+1) array of magnitudes
+    """
+    frames = frame_signal(x, frame_size, hop_size)
+    return np.abs(np.fft.rfft(frames * np.hanning(frame_size), n=n_fft or frame_size, axis=1))
+
+
+def get_onset(fs, x, frame_size=1024, hop_size=256, threshold=0.1):
+    """
+    Time of the first note onset, where the frame energy first rises above
+    threshold times its maximum.
+
+    Returns:
+        Onset time in seconds
+    """
+    energy = np.square(frame_signal(x, frame_size, hop_size)).sum(axis=1)
+    first = np.flatnonzero(energy >= threshold*energy.max())
+    return first[0]*hop_size/float(fs) if len(first) else 0.
+
+
+def framewise_f0(fs, x, frame_size=4096, hop_size=1024, n_fft=16384, fmin=25., fmax=4200.,
+                 n_harmonics=8, resolution=0.1):
+    """
+    Estimates the f0 of every frame by weighted harmonic summation.
+
+    Every f0 candidate on a log-frequency grid scores the sum of the compressed
+    magnitudes at its first n_harmonics multiples. Candidates, harmonics and
+    frames are evaluated together as one array. The grid is anchored on
+    integer midi pitches, and the best candidate of every frame is refined by
+    a parabola through its salience and that of its neighbours, so estimates
+    are not snapped to the grid.
+
+    Args:
+        fs (int): Sample rate
+        x (array): Samples
+        frame_size (int): Samples per frame
+        hop_size (int): Samples between frame starts
+        n_fft (int): FFT size
+        fmin (float): Lowest f0 candidate in Hz
+        fmax (float): Highest f0 candidate in Hz
+        n_harmonics (int): Number of harmonics summed per candidate
+        resolution (float): Candidate spacing in semitones
+
+    Returns:
+        Tuple of (f0s, saliences), one entry per frame
+    """
+    magnitudes = stft(x, frame_size, hop_size, n_fft)
+    # square root compression relative to the loudest bin of each frame, a
+    # stronger (log) compression lets the noise floor summed over the many
+    # harmonics of low candidates outweigh the few harmonics of high notes
+    magnitudes = np.sqrt(magnitudes/np.maximum(magnitudes.max(axis=1, keepdims=True), 1e-12))
+    candidate_pitches = np.arange(np.floor(hz_to_midi(fmin)), hz_to_midi(fmax), resolution)
+    candidates = midi_to_hz(candidate_pitches)
+    harmonics = np.arange(1, n_harmonics+1)
+    weights = 0.85**(harmonics-1)
+    bins = np.outer(candidates, harmonics) * n_fft/float(fs)
+    bins = np.minimum(bins, magnitudes.shape[1]-2)
+    lower = bins.astype(np.int64)
+    frac = bins - lower
+    # linear interpolation of the magnitude at every candidate harmonic
+    values = magnitudes[:, lower]*(1-frac) + magnitudes[:, lower+1]*frac
+    saliences = (values*weights).sum(axis=2)
+    best = np.argmax(saliences, axis=1)
+    frames = np.arange(len(best))
+    inner = np.clip(best, 1, len(candidates)-2)
+    left, center, right = (saliences[frames, inner-1], saliences[frames, inner],
+                           saliences[frames, inner+1])
+    curvature = left-2*center+right
+    offset = np.where(curvature < 0, 0.5*(left-right)/np.where(curvature < 0, curvature, -1.), 0.)
+    # no refinement at the edges of the grid
+    offset = np.where(best == inner, np.clip(offset, -0.5, 0.5), 0.)
+    return midi_to_hz(candidate_pitches[best] + offset*resolution), saliences[frames, best]
+
+
+def get_f0(fs, x, duration=0.5, **kwargs):
+    """
+    Estimates the f0 of a single note starting at the beginning of x.
+
+    Args:
+        fs (int): Sample rate
+        x (array): Samples
+        duration (float): Seconds after the start the frame estimates are taken from
+        kwargs: Passed to framewise_f0
+
+    Returns:
+        Median f0 in Hz of the frames, weighted toward the loudest ones
+    """
+    f0s, saliences = framewise_f0(fs, x[:int(duration*fs)+kwargs.get('frame_size', 4096)], **kwargs)
+    loud = saliences >= 0.5*saliences.max()
+    return float(np.exp(np.median(np.log(f0s[loud]))))
+
+
+def get_peaks(fs, x, frame_size=2048, n_fft=8192, min_db=-60.):
+    """
+    Picks the spectral peaks of the first frame of x.
+
+    Returns:
+        Tuple of (list_of_peaks, f_peaks, dBs) where list_of_peaks holds
+        (frequency, dB) tuples and f_peaks and dBs are arrays, peak frequencies
+        refined by parabolic interpolation
+    """
+    spectrum = stft(x[:frame_size], frame_size, frame_size, n_fft)[0]
+    db = 20*np.log10(np.maximum(spectrum/spectrum.max(), 1e-12))
+    is_peak = (db[1:-1] > db[:-2]) & (db[1:-1] >= db[2:]) & (db[1:-1] > min_db)
+    k = np.flatnonzero(is_peak) + 1
+    left, center, right = db[k-1], db[k], db[k+1]
+    offset = 0.5*(left-right)/np.where(left-2*center+right == 0, -1e-12, left-2*center+right)
+    f_peaks = (k+offset)*fs/float(n_fft)
+    dBs = center - 0.25*(left-right)*offset
+    return list(zip(f_peaks.tolist(), dBs.tolist())), f_peaks, dBs
+
+
+def harmonic_peaks(fs, x, f0, n_harmonics=10, tolerance=0.03, frame_size=4096, n_fft=16384):
+    """
+    Finds the strongest spectral peak near every harmonic of f0.
+
+    Args:
+        fs (int): Sample rate
+        x (array): Samples, the first frame is analyzed
+        f0 (float): Fundamental frequency in Hz
+        n_harmonics (int): Number of harmonics
+        tolerance (float): Relative search range around each harmonic
+        frame_size (int): Samples analyzed
+        n_fft (int): FFT size
+
+    Returns:
+        Tuple of (frequencies, dBs) arrays, one entry per harmonic
+    """
+    spectrum = stft(x[:frame_size], frame_size, frame_size, n_fft)[0]
+    db = 20*np.log10(np.maximum(spectrum/spectrum.max(), 1e-12))
+    targets = f0*np.arange(1, n_harmonics+1)*n_fft/float(fs)
+    half_width = max(int(np.ceil(tolerance*f0*n_fft/float(fs))), 1)
+    window = np.arange(-half_width, half_width+1)
+    bins = np.clip(np.round(targets).astype(np.int64)[:, None] + window, 0, len(db)-1)
+    best = bins[np.arange(n_harmonics), np.argmax(db[bins], axis=1)]
+    return best*fs/float(n_fft), db[best]
+
+
+def detect_outliers(data, m=2.):
+    """
+    Indices of the values more than m median absolute deviations away from the median.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    deviations = np.abs(data - np.median(data))
+    mad = np.median(deviations)
+    return np.flatnonzero(deviations > m*mad).tolist()
+
+
+def peak_quality(peaks):
+    """
+    Regularity of a list of (frequency, dB) peaks, as spacing and slope statistics.
+
+    Returns:
+        Tuple of (spacing mean, spacing std, slope mean, slope std)
+    """
+    f, db = np.asarray(peaks, dtype=np.float64).T
+    spacings = np.diff(f)
+    slopes = np.abs(np.diff(db))/spacings
+    return spacings.mean(), spacings.std(), slopes.mean(), slopes.std()
+
+
+def analyze_file(path):
+    """
+    Estimates the pitch of a single note recording and compares it with the
+    note its file name stands for.
+
+    Returns:
+        Tuple of (path, f0, detected midi pitch, expected midi pitch or None, cents error)
+    """
+    fs, x = read_audio(path)
+    onset = get_onset(fs, x)
+    f0 = get_f0(fs, x[int(onset*fs):])
+    detected = hz_to_midi(f0)
+    try:
+        expected = note_name_to_midi(os.path.splitext(os.path.basename(path))[0])
+    except ValueError:
+        return path, f0, int(np.round(detected)), None, None
+    return path, f0, int(np.round(detected)), expected, float(100*(detected-expected))
+
+
+def analyze_directory(directory, num_workers=None):
+    """
+    Analyzes every wav file of a directory in a pool of worker processes.
+
+    Returns:
+        List of analyze_file results, sorted by path
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith('.wav'))
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        return pool.map(analyze_file, paths)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect the pitch of single note recordings')
+    parser.add_argument('directory', help='Directory of wav files named by their notes, e.g. a2.wav')
+    parser.add_argument('-w', '--num_workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    import time
+    start = time.time()
+    results = analyze_directory(args.directory, args.num_workers)
+    num_correct = 0
+    for path, f0, detected, expected, cents in results:
+        if expected is None:
+            print ('{:>12}: {:8.2f} Hz'.format(os.path.basename(path), f0))
+            continue
+        num_correct += detected == expected
+        print ('{:>12}: {:8.2f} Hz, {:+7.1f} cents{}'.format(
+            os.path.basename(path), f0, cents, '' if detected == expected else ' MISMATCH'))
+    print ('{} of {} files match their names, {:.2f}s'.format(
+        num_correct, sum(r[3] is not None for r in results), time.time()-start))
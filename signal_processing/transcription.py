@@ -0,0 +1,480 @@
+"""
+CPU polyphonic transcription of piano recordings to midi.
+
+Long recordings are memory mapped and cut into chunks of a few seconds that a
+pool of worker processes turns into piano rolls with magenta's onsets and
+frames model, the local version of notebooks/colab_archive/onset_and_frames.ipynb.
+Every worker restores the checkpoint once and runs the chunks of a job as one
+batch. Chunks are analyzed with context on both sides, which is cut off again
+afterwards, so the network sees the notes around chunk borders, and a note
+tracker carries held notes from one chunk into the next. Only the chunks in
+flight are held in memory, whatever the recording length.
+
+Without magenta or the checkpoint (see the setup cell of the notebook for
+where to get it) a spectral peak picker is used instead: the spectral peaks
+of every frame are sorted into the 88 piano keys, from which active keys and
+onsets are picked. It is much faster and much less accurate.
+
+The midi output feeds straight into models/midi_to_lilypond.py.
+
+Example usage (transcribe a recording and typeset it):
+
+python transcription.py -i ../data/wavfiles/goldberg.wav -m goldberg.mid -l goldberg.ly \
+    -ckpt ../data/onsets_frames/train
+
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import mido
+import numpy as np
+from scipy.io import wavfile
+
+from pitch_processing import frame_signal, midi_to_hz
+
+MIN_PITCH = 21
+NUM_PITCHES = 88
+# semitones from a key to its 2nd to 6th harmonic
+HARMONIC_INTERVALS = (12, 19, 24, 28, 31)
+TICKS_PER_BEAT = 480
+TICKS_PER_SECOND = 2*TICKS_PER_BEAT  # at the default tempo of 120 bpm
+DEFAULT_CHECKPOINT = '../data/onsets_frames/train'
+
+# Set in every worker process by _init_worker
+_samples = None
+_settings = None
+_model = None
+
+
+def _init_worker(path, settings, checkpoint=None):
+    global _samples, _settings, _model
+    _, _samples = wavfile.read(path, mmap=True)
+    _settings = settings
+    if checkpoint is not None:
+        _model = OnsetsFramesModel(checkpoint)
+
+
+def to_float(samples):
+    """Scales integer samples to [-1, 1) and mixes them down to mono."""
+    x = np.asarray(samples)
+    if x.dtype.kind in 'iu':
+        info = np.iinfo(x.dtype)
+        x = (x.astype(np.float64) - (info.max+1 if x.dtype.kind == 'u' else 0)/2.)/(info.max+1)
+    else:
+        x = x.astype(np.float64)
+    return x.mean(axis=1) if x.ndim > 1 else x
+
+
+def read_segment(samples, start, stop):
+    """Samples [start, stop) of samples as floats, zero padded outside of it."""
+    segment = np.zeros(stop-start)
+    lower, upper = max(start, 0), min(stop, len(samples))
+    if upper > lower:
+        segment[lower-start:upper-start] = to_float(samples[lower:upper])
+    return segment
+
+
+def key_amplitudes(fs, frames, n_fft=16384):
+    """
+    Amplitude of every piano key in every frame.
+
+    The spectral peaks of every frame are sorted into bands a semitone wide
+    centered on the keys, so a key only gets an amplitude when there is a
+    peak close to its frequency, and the inharmonic partials of piano strings
+    still land in the band of their key.
+
+    Args:
+        fs (int): Sample rate
+        frames (array): (num_frames, frame_size) samples
+        n_fft (int): FFT size, zero padding sharpens the peak positions the
+            low keys are told apart by
+
+    Returns:
+        (num_frames, NUM_PITCHES) array in units of a full scale sine
+    """
+    window = np.hanning(frames.shape[1])
+    spectrum = np.abs(np.fft.rfft(frames*window, n=n_fft, axis=1))/(window.sum()/2.)
+    is_peak = np.zeros(spectrum.shape, dtype=bool)
+    is_peak[:, 1:-1] = (spectrum[:, 1:-1] > spectrum[:, :-2]) & (spectrum[:, 1:-1] >= spectrum[:, 2:])
+    peaks = np.where(is_peak, spectrum, 0.)
+    edges = midi_to_hz(np.arange(MIN_PITCH, MIN_PITCH+NUM_PITCHES+1) - 0.5)*n_fft/float(fs)
+    edges = np.minimum(np.ceil(edges).astype(np.int64), spectrum.shape[1]-1)
+    return np.maximum.reduceat(peaks, edges, axis=1)[:, :NUM_PITCHES]
+
+
+def pick_keys(amplitudes, min_amplitude=0.005, min_relative=0.1, ghost_ratio=1.):
+    """
+    Decides which keys sound in every frame.
+
+    A key is active when its amplitude is loud enough on its own and relative
+    to the loudest key of the frame. Keys sitting on one of the first six
+    harmonics of an active key are dropped when they are quieter than
+    ghost_ratio times its fundamental.
+
+    Returns:
+        (num_frames, NUM_PITCHES) boolean array
+    """
+    active = ((amplitudes >= min_amplitude) &
+              (amplitudes >= min_relative*amplitudes.max(axis=1, keepdims=True)))
+    ghost = np.zeros_like(active)
+    for interval in HARMONIC_INTERVALS:
+        lower = active[:, :-interval]
+        ghost[:, interval:] |= lower & (amplitudes[:, interval:] < ghost_ratio*amplitudes[:, :-interval])
+    return active & ~ghost
+
+
+def analyze_chunk(job):
+    """
+    Piano roll of the core frames of a chunk, inside a worker process.
+
+    Args:
+        job: Tuple of (first_frame, stop_frame, context) in frames of the
+            whole recording
+
+    Returns:
+        Tuple of (first_frame, active, onsets, velocities), the last three
+        (stop_frame-first_frame, NUM_PITCHES) arrays
+    """
+    first_frame, stop_frame, context = job
+    fs, frame_size, hop_size, n_fft, onset_ratio = _settings
+    context_start = max(first_frame-context, 0)
+    context_stop = stop_frame+context
+    # frames are centered on multiples of hop_size
+    x = read_segment(_samples, context_start*hop_size - frame_size//2,
+                     (context_stop-1)*hop_size + frame_size - frame_size//2)
+    frames = frame_signal(x, frame_size, hop_size)[:context_stop-context_start]
+    amplitudes = key_amplitudes(fs, frames, n_fft)
+    active = pick_keys(amplitudes)
+    # an onset is a key turning active, or a struck key jumping in amplitude
+    previous = np.vstack([np.zeros((1, NUM_PITCHES)), amplitudes[:-1]])
+    previous_active = np.vstack([np.zeros((1, NUM_PITCHES), dtype=bool), active[:-1]])
+    onsets = active & (~previous_active | (amplitudes > onset_ratio*previous))
+    db = 20*np.log10(np.maximum(amplitudes, 1e-6))
+    velocities = np.clip(np.round(127*(1+db/60.)), 1, 127).astype(np.uint8)
+    core = slice(first_frame-context_start, stop_frame-context_start)
+    return first_frame, active[core], onsets[core], velocities[core]
+
+
+def find_checkpoint(path):
+    """
+    Checks that magenta can be imported and finds the checkpoint to restore.
+
+    Args:
+        path (str): Checkpoint file prefix, or a directory of checkpoints of
+            which the latest is used
+
+    Returns:
+        Checkpoint file prefix, None if magenta or the checkpoint is missing
+    """
+    try:
+        import tensorflow as tf
+        from magenta.models.onsets_frames_transcription import configs
+    except ImportError:
+        return None
+    if path and os.path.isdir(path):
+        return tf.train.latest_checkpoint(path)
+    if path and tf.train.checkpoint_exists(path):
+        return path
+    return None
+
+
+class OnsetsFramesModel():
+    def __init__(self, checkpoint, config='onsets_frames'):
+        """
+        Magenta's onsets and frames model, restored for inference on batches
+        of spectrograms.
+
+        Args:
+            checkpoint (str): Checkpoint file prefix, see find_checkpoint
+            config (str): Name of the model configuration in magenta's CONFIG_MAP
+
+        """
+        import tensorflow as tf
+        from magenta.models.onsets_frames_transcription import configs, constants, data
+        from magenta.protobuf import music_pb2
+        self.data = data
+        self.hparams = configs.CONFIG_MAP[config].hparams
+        self.hparams.use_cudnn = False
+        self.hparams.truncated_length_secs = 0
+        self.hop_size = self.hparams.spec_hop_length
+        self.sample_rate = self.hparams.sample_rate
+        self.seconds_per_frame = 1./data.hparams_frames_per_second(self.hparams)
+        graph = tf.Graph()
+        with graph.as_default():
+            self.spec = tf.placeholder(tf.float32, [None, None, data.hparams_frame_size(self.hparams), 1])
+            self.lengths = tf.placeholder(tf.int32, [None])
+            batch_size = tf.shape(self.spec)[0]
+            features = data.FeatureTensors(spec=self.spec, length=self.lengths,
+                                           sequence_id=tf.fill([batch_size], ''))
+            # the model function wants labels even when predicting, they only feed its metrics
+            no_labels = tf.zeros([batch_size, tf.shape(self.spec)[1], constants.MIDI_PITCHES])
+            labels = data.LabelTensors(
+                labels=no_labels, label_weights=no_labels, onsets=no_labels, offsets=no_labels,
+                velocities=no_labels,
+                note_sequence=tf.fill([batch_size], music_pb2.NoteSequence().SerializeToString()))
+            predictions = configs.CONFIG_MAP[config].model_fn(
+                features, labels, tf.estimator.ModeKeys.PREDICT, self.hparams, None).predictions
+            # frames of all examples one after another, each cut to its length
+            self.outputs = [predictions['frame_predictions'][0], predictions['onset_predictions'][0],
+                            predictions['velocity_values'][0]]
+            # one worker per core
+            self.session = tf.Session(config=tf.ConfigProto(
+                intra_op_parallelism_threads=1, inter_op_parallelism_threads=1))
+            tf.train.Saver().restore(self.session, checkpoint)
+
+    def spectrogram(self, samples, fs):
+        """Spectrogram of float samples at any sample rate, resampled as magenta does."""
+        from magenta.music import audio_io
+        return self.data.wav_to_spec(audio_io.samples_to_wav_data(samples, fs), self.hparams)
+
+    def predict(self, specs):
+        """
+        Runs the model on a batch of spectrograms.
+
+        Args:
+            specs (list): (num_frames, num_bins) spectrograms of any lengths
+
+        Returns:
+            List of (frames, onsets, velocity_values) tuples, one per
+            spectrogram, each a (num_frames, NUM_PITCHES) array
+        """
+        lengths = np.array([len(spec) for spec in specs])
+        batch = np.zeros((len(specs), lengths.max(), specs[0].shape[1], 1), dtype=np.float32)
+        for i, spec in enumerate(specs):
+            batch[i, :len(spec), :, 0] = spec
+        outputs = self.session.run(self.outputs, {self.spec: batch, self.lengths: lengths})
+        splits = np.cumsum(lengths)[:-1]
+        return list(zip(*[np.split(output, splits) for output in outputs]))
+
+
+def model_chunks(jobs):
+    """
+    Piano rolls of the core frames of a batch of chunks, inside a worker
+    process, with the onsets and frames model.
+
+    Args:
+        jobs (list): Tuples of (first_frame, stop_frame, context) in frames of
+            the whole recording, on the frame grid of the model
+
+    Returns:
+        List of (first_frame, active, onsets, velocities) tuples, see analyze_chunk
+    """
+    fs = _settings[0]
+    specs = []
+    for first_frame, stop_frame, context in jobs:
+        context_start = max(first_frame-context, 0)
+        num_frames = stop_frame+context-context_start
+        # frames of the model are centered on multiples of its hop size
+        start = int(round(context_start*_model.hop_size*fs/float(_model.sample_rate)))
+        stop = start + int(np.ceil(num_frames*_model.hop_size*fs/float(_model.sample_rate)))
+        spec = _model.spectrogram(read_segment(_samples, start, stop), fs)[:num_frames]
+        specs.append(np.pad(spec, [(0, num_frames-len(spec)), (0, 0)], 'constant'))
+    chunks = []
+    for (first_frame, stop_frame, context), (frames, onsets, velocity_values) in zip(jobs, _model.predict(specs)):
+        context_start = max(first_frame-context, 0)
+        # like magenta's decoding: onsets are active, and a held onset is no new one
+        previous_onsets = np.vstack([np.zeros((1, NUM_PITCHES), dtype=bool), onsets[:-1]])
+        active = frames | onsets
+        onsets = onsets & ~previous_onsets
+        velocities = (np.clip(velocity_values, 0., 1.)*80+10).astype(np.uint8)
+        core = slice(first_frame-context_start, stop_frame-context_start)
+        chunks.append((first_frame, active[core], onsets[core], velocities[core]))
+    return chunks
+
+
+class NoteTracker():
+    def __init__(self, min_frames=4, require_onsets=False):
+        """
+        Turns consecutive piano roll chunks into notes.
+
+        Args:
+            min_frames (int): Notes shorter than this many frames are dropped
+            require_onsets (bool): If True, a key turning active without an
+                onset starts no note, as in magenta's decoding
+
+        """
+        self.min_frames = min_frames
+        self.require_onsets = require_onsets
+        self.starts = np.full(NUM_PITCHES, -1, dtype=np.int64)
+        self.velocities = np.zeros(NUM_PITCHES, dtype=np.uint8)
+        self.held = np.zeros(NUM_PITCHES, dtype=bool)
+
+    def update(self, first_frame, active, onsets, velocities):
+        """
+        Feeds the next piano roll chunk.
+
+        Returns:
+            List of (pitch, start_frame, end_frame, velocity) tuples of the
+            notes that ended in the chunk
+        """
+        previous = np.vstack([self.held[None], active[:-1]])
+        starts = active & (~previous | onsets)
+        ends = previous & (~active | starts)
+        notes = []
+        # events are few compared to frames, so they are paired in order
+        for frame, key, is_start in sorted(
+                [(f, k, False) for f, k in zip(*np.nonzero(ends))] +
+                [(f, k, True) for f, k in zip(*np.nonzero(starts))]):
+            if is_start and self.require_onsets and not onsets[frame, key]:
+                self.starts[key] = -1
+            elif is_start:
+                self.starts[key] = first_frame+frame
+                self.velocities[key] = velocities[frame, key]
+            else:
+                notes.append(self._end(key, first_frame+frame))
+        self.held = active[-1].copy()
+        return [note for note in notes if note is not None]
+
+    def close(self, stop_frame):
+        """Ends the notes still held at stop_frame."""
+        notes = [self._end(key, stop_frame) for key in np.flatnonzero(self.held)]
+        self.held[:] = False
+        return [note for note in notes if note is not None]
+
+    def _end(self, key, frame):
+        start = self.starts[key]
+        self.starts[key] = -1
+        if start < 0 or frame-start < self.min_frames:
+            return None
+        return MIN_PITCH+int(key), int(start), int(frame), int(self.velocities[key])
+
+
+def write_midi(notes, seconds_per_frame, output_file):
+    """
+    Writes notes as a single track midi file at 120 bpm.
+
+    Args:
+        notes (list): (pitch, start_frame, end_frame, velocity) tuples
+        seconds_per_frame (float): Frame duration
+        output_file (str): Midi file name
+
+    """
+    events = []
+    for pitch, start, end, velocity in notes:
+        events.append((int(round(end*seconds_per_frame*TICKS_PER_SECOND)), 0, pitch, 0))
+        events.append((int(round(start*seconds_per_frame*TICKS_PER_SECOND)), 1, pitch, velocity))
+    events.sort()
+    track = mido.MidiTrack()
+    last_tick = 0
+    for tick, _, pitch, velocity in events:
+        track.append(mido.Message('note_on', note=pitch, velocity=velocity, time=tick-last_tick))
+        last_tick = tick
+    midi_file = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    midi_file.tracks.append(track)
+    midi_file.save(output_file)
+
+
+def transcribe(wav_file, midi_file, chunk_seconds=10., frame_size=4096, hop_size=512, n_fft=16384,
+               onset_ratio=2., num_workers=None, verbose=True, checkpoint=DEFAULT_CHECKPOINT,
+               batch_size=4, context_seconds=1.):
+    """
+    Transcribes a wav file to a midi file, with the onsets and frames model
+    if magenta and its checkpoint are available, else with the peak picker.
+
+    Args:
+        wav_file (str): Input wav file name
+        midi_file (str): Output midi file name
+        chunk_seconds (float): Length of the chunks the workers analyze
+        frame_size (int): Samples per frame of the peak picker
+        hop_size (int): Samples between frame centers of the peak picker
+        n_fft (int): FFT size of the peak picker
+        onset_ratio (float): Amplitude jump of an active key counted as a new
+            onset by the peak picker
+        num_workers (int): Number of worker processes, defaults to the number of cores
+        verbose (bool): If True, prints progress and the real time factor
+        checkpoint (str): Onsets and frames checkpoint, see find_checkpoint,
+            None for the peak picker
+        batch_size (int): Number of chunks a worker runs through the model at once
+        context_seconds (float): Audio the model sees on both sides of a chunk
+
+    Returns:
+        Tuple of (number of notes, real time factor), where the real time
+        factor is seconds of audio transcribed per second of processing
+    """
+    start = time.time()
+    fs, samples = wavfile.read(wav_file, mmap=True)
+    num_samples = len(samples)
+    del samples
+    checkpoint_path = find_checkpoint(checkpoint) if checkpoint else None
+    if checkpoint and checkpoint_path is None:
+        sys.stderr.write("No onsets and frames model (magenta or the checkpoint '{}' is missing), "
+                         "using the peak picker.\n".format(checkpoint))
+    if checkpoint_path is not None:
+        from magenta.models.onsets_frames_transcription import configs
+        hparams = configs.CONFIG_MAP['onsets_frames'].hparams
+        seconds_per_frame = hparams.spec_hop_length/float(hparams.sample_rate)
+        context = int(np.ceil(context_seconds/seconds_per_frame))
+        tracker = NoteTracker(min_frames=1, require_onsets=True)
+        analyze, job_size = model_chunks, batch_size
+    else:
+        seconds_per_frame = hop_size/float(fs)
+        # frames are analyzed on their own, only onsets look one frame back
+        context = 1
+        tracker = NoteTracker()
+        analyze, job_size = analyze_chunk, 1
+    num_frames = int(np.ceil(num_samples/float(fs)/seconds_per_frame))
+    chunk_frames = max(int(chunk_seconds/seconds_per_frame), 1)
+    chunks = [(first, min(first+chunk_frames, num_frames), context)
+              for first in range(0, num_frames, chunk_frames)]
+    if job_size > 1:
+        jobs = [chunks[i:i+job_size] for i in range(0, len(chunks), job_size)]
+    else:
+        jobs = chunks
+
+    notes = []
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                initargs=(wav_file, (fs, frame_size, hop_size, n_fft, onset_ratio),
+                                          checkpoint_path))
+    try:
+        done = 0
+        for result in pool.imap(analyze, jobs):
+            for chunk in (result if job_size > 1 else [result]):
+                notes.extend(tracker.update(*chunk))
+                done += 1
+            if verbose:
+                sys.stdout.write('\rchunk {}/{}, {} notes'.format(done, len(chunks), len(notes)))
+                sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    notes.extend(tracker.close(num_frames))
+    notes.sort(key=lambda note: (note[1], note[0]))
+    write_midi(notes, seconds_per_frame, midi_file)
+
+    real_time_factor = num_samples/float(fs)/max(time.time()-start, 1e-9)
+    if verbose:
+        print ('\n{} notes, {:.1f}x real time'.format(len(notes), real_time_factor))
+    return len(notes), real_time_factor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe a piano recording to midi')
+    parser.add_argument('-i', '--wav_input', required=True, help='Path to input wav file')
+    parser.add_argument('-m', '--midi_output', required=True, help='Path to output midi file')
+    parser.add_argument('-l', '--ly_output', help='Optional path to output lilypond code file, '
+                        'the midi file is converted with models/midi_to_lilypond.py')
+    parser.add_argument('-c', '--chunk_seconds', type=float, default=10.,
+                        help='Length of the chunks analyzed by the workers')
+    parser.add_argument('-w', '--num_workers', type=int, default=None,
+                        help='Number of worker processes, defaults to the number of cores')
+    parser.add_argument('-ckpt', '--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help='Onsets and frames checkpoint, or a directory of them')
+    parser.add_argument('-b', '--batch_size', type=int, default=4,
+                        help='Number of chunks a worker runs through the model at once')
+    parser.add_argument('-p', '--peak_picker', action='store_true',
+                        help='Use the spectral peak picker instead of the onsets and frames model')
+    args = parser.parse_args()
+
+    transcribe(args.wav_input, args.midi_output, args.chunk_seconds, num_workers=args.num_workers,
+               checkpoint=None if args.peak_picker else args.checkpoint, batch_size=args.batch_size)
+    if args.ly_output:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+        from midi_to_lilypond import convert_midi_to_ly
+        convert_midi_to_ly(args.midi_output, args.ly_output, verbose=False)
+
+
+if __name__ == '__main__':
+    main()
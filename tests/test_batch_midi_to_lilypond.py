@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+from batch_midi_to_lilypond import output_paths_for
+
+
+def test_mirrors_subdirectories():
+    midi_paths = [os.path.join('d', 'a', 'take1.mid'), os.path.join('d', 'b', 'take1.mid'), os.path.join('d', 'c.mid')]
+    assert output_paths_for(midi_paths, 'out') == [
+        os.path.join('out', 'a', 'take1.ly'), os.path.join('out', 'b', 'take1.ly'), os.path.join('out', 'c.ly')]
+
+
+def test_rejects_colliding_outputs():
+    with pytest.raises(ValueError):
+        output_paths_for([os.path.join('d', 'take.mid'), os.path.join('d', 'take.midi')], 'out')
@@ -0,0 +1,33 @@
+import benchmarks
+
+
+def results_of(by_stage):
+    return {'results': by_stage}
+
+
+def test_compare_finds_regressions():
+    baseline = results_of({'get_chords': {'1000': {'seconds': 0.1, 'peak_bytes': 10 << 20}}})
+    results = results_of({'get_chords': {'1000': {'seconds': 0.2, 'peak_bytes': 10 << 20}}})
+    assert benchmarks.compare(results, baseline) == [('get_chords', 1000, 'seconds', 0.1, 0.2)]
+    assert benchmarks.compare(baseline, baseline) == []
+
+
+def test_newly_skipped():
+    baseline = results_of({
+        'convert_midi_to_ly': {'1000': {'seconds': 0.1, 'peak_bytes': 1}},
+        'get_chords': {'1000': {'skipped': 'ImportError()'}},
+    })
+    results = results_of({
+        'convert_midi_to_ly': {'1000': {'skipped': "ImportError('magenta')"}},
+        'get_chords': {'1000': {'skipped': 'ImportError()'}},
+    })
+    assert benchmarks.newly_skipped(results, baseline) == [('convert_midi_to_ly', 1000, "ImportError('magenta')")]
+    assert benchmarks.compare(results, baseline) == []
+    assert benchmarks.newly_skipped(baseline, baseline) == []
+
+
+def test_small_run():
+    results = benchmarks.run_benchmarks([200], ['find_note_lengths', 'get_chords', 'write_output'], repeat=1,
+                                        verbose=False)
+    assert benchmarks.newly_skipped(results, results) == []
+    assert benchmarks.compare(results, results) == []
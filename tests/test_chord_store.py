@@ -0,0 +1,42 @@
+import mido
+import numpy as np
+import pytest
+
+import chord_store
+
+
+def chord(*notes):
+    return [mido.Message('note_on', note=note, velocity=60+i) for i, note in enumerate(notes)]
+
+
+def test_append_and_read(tmpdir):
+    filename = str(tmpdir.join('bank.chords'))
+    chords = [chord(60, 64, 67), chord(62), chord(*range(40, 40+chord_store.MAX_CHORD_SIZE))]
+    chord_store.append_chords(filename, chords[:2], timestamp=1.)
+    chord_store.append_chords(filename, chords[2:], timestamp=2.)
+    records = chord_store.read_chords(filename)
+    assert [chord_store.to_chord(record) for record in records] == chords
+    assert records['timestamp'].tolist() == [1., 1., 2.]
+    assert chord_store.read_header(filename)['size_counts'][[1, 3, chord_store.MAX_CHORD_SIZE]].tolist() == [1, 1, 1]
+    assert [chord_store.to_chord(record) for record in chord_store.read_chords(filename, 3)] == chords[:1]
+    assert len(chord_store.read_chords(filename, 2)) == 0
+
+
+def test_chord_keys():
+    records = chord_store.chords_to_records([chord(0, 63, 64, 127)], timestamp=0.)
+    assert chord_store.chord_keys(records) == [(1 << 0) | (1 << 63) | (1 << 64) | (1 << 127)]
+
+
+def test_too_large_chord_is_rejected(tmpdir):
+    filename = str(tmpdir.join('bank.chords'))
+    with pytest.raises(ValueError):
+        chord_store.append_chords(filename, [chord(60), chord(*range(40, 41+chord_store.MAX_CHORD_SIZE))])
+    assert not tmpdir.join('bank.chords').exists()
+
+
+@pytest.mark.parametrize('size', [-1, chord_store.MAX_CHORD_SIZE+1])
+def test_invalid_size_is_rejected(tmpdir, size):
+    filename = str(tmpdir.join('bank.chords'))
+    chord_store.append_chords(filename, [chord(60)])
+    with pytest.raises(ValueError):
+        chord_store.read_chords(filename, size)
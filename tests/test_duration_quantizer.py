@@ -0,0 +1,66 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from duration_quantizer import cluster_1d, largest_cluster_mean
+
+
+def partition_cost(sorted_values, boundaries):
+    return sum(((part-part.mean())**2).sum() for part in np.split(sorted_values, boundaries) if len(part))
+
+
+def brute_force_cost(values, n_clusters):
+    """Lowest k-means cost over all splits of the sorted values into contiguous clusters."""
+    sorted_values = np.sort(values)
+    return min(partition_cost(sorted_values, list(boundaries))
+               for boundaries in itertools.combinations(range(1, len(values)), n_clusters-1))
+
+
+def kmeans_cost(values, labels):
+    return sum(((values[labels == label]-values[labels == label].mean())**2).sum() for label in np.unique(labels))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_cluster_1d_is_optimal(seed):
+    random = np.random.RandomState(seed)
+    values = np.round(random.choice([0.25, 0.5, 1.], size=10)*(1+0.1*random.randn(10)), 2)
+    n_clusters = min(3, len(np.unique(values)))
+    labels, centers, sizes = cluster_1d(values, n_clusters)
+    assert np.isclose(kmeans_cost(values, labels), brute_force_cost(values, n_clusters))
+    assert sizes.sum() == len(values)
+    assert np.all(np.diff(centers) > 0)
+
+
+@pytest.mark.parametrize('values, n_clusters, expected', [
+    ([0.25]*45+[0.5]*55, 4, 0.5),
+    ([0.25]*48+[0.5]*52, 3, 0.5),
+    ([0.5]*10, 4, 0.5),
+    ([0.25]*30+[0.5]*20+[1.]*5, 4, 0.25),
+])
+def test_ties_stay_together(values, n_clusters, expected):
+    labels, centers, sizes = cluster_1d(values, n_clusters)
+    assert len(sizes) == len(np.unique(values))
+    assert largest_cluster_mean(np.array(values), n_clusters) == expected
+
+
+def test_labels_follow_input_order():
+    labels, centers, sizes = cluster_1d([3., 1., 2., 10., 11., 12.], 2)
+    assert labels.tolist() == [0, 0, 0, 1, 1, 1]
+    assert centers.tolist() == [2., 11.]
+    assert sizes.tolist() == [3, 3]
+
+
+@pytest.mark.parametrize('values, n_clusters', [
+    ([0.25]*45+[0.5]*55, 4),
+    ([0.25]*48+[0.5]*52, 3),
+    (list(np.random.RandomState(0).choice([0.25, 0.5, 1., 2.], size=300)*(1+0.03*np.random.RandomState(1).randn(300))), 4),
+])
+def test_matches_kmeans(values, n_clusters):
+    cluster = pytest.importorskip('sklearn.cluster')
+    values = np.array(values)
+    n_clusters = min(n_clusters, len(np.unique(values)))
+    kmeans = cluster.KMeans(n_clusters=n_clusters, n_init=10, random_state=0).fit(values.reshape(-1, 1))
+    sizes = np.bincount(kmeans.labels_)
+    expected = kmeans.cluster_centers_[np.argmax(sizes), 0]
+    assert np.isclose(largest_cluster_mean(values, n_clusters), expected)
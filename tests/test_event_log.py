@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import event_log
+
+
+def random_events(num_events, seed=0):
+    random = np.random.RandomState(seed)
+    events = np.zeros(num_events, dtype=event_log.EVENT_DTYPE)
+    events['status'] = random.randint(0x80, 0x100, size=num_events)
+    events['data1'] = random.randint(128, size=num_events)
+    events['data2'] = random.randint(128, size=num_events)
+    events['timestamp'] = np.cumsum(random.exponential(0.1, size=num_events))
+    return events
+
+
+def test_round_trip(tmpdir):
+    filename = str(tmpdir.join('session.evl'))
+    events = random_events(10000)
+    with event_log.EventLogWriter(filename, buffer_size=100) as writer:
+        for event in events[:250].tolist():
+            writer.write(*event)
+        writer.write_array(events[250:])
+    assert event_log.is_event_log(filename)
+    np.testing.assert_array_equal(event_log.read_event_log(filename), events)
+    assert list(event_log.iter_events(filename, chunk_size=999)) == events.tolist()
+
+
+def test_append_and_partial_record(tmpdir):
+    filename = str(tmpdir.join('session.evl'))
+    events = random_events(10)
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_array(events[:4])
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_array(events[4:])
+    # a session that crashed in the middle of a record
+    with open(filename, 'ab') as f:
+        f.write(b'\x90\x3c')
+    np.testing.assert_array_equal(event_log.read_event_log(filename), events)
+
+
+def test_append_after_partial_record(tmpdir):
+    filename = str(tmpdir.join('session.evl'))
+    events = random_events(10)
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_array(events[:4])
+    with open(filename, 'ab') as f:
+        f.write(b'\x90\x3c')
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_array(events[4:])
+    np.testing.assert_array_equal(event_log.read_event_log(filename), events)
+
+
+def test_append_to_other_file_is_refused(tmpdir):
+    other = tmpdir.join('notes.txt')
+    other.write('not an event log')
+    with pytest.raises(ValueError):
+        event_log.EventLogWriter(str(other))
+    assert other.read() == 'not an event log'
+
+
+def test_write_pygame_events(tmpdir):
+    filename = str(tmpdir.join('session.evl'))
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_pygame_events([[[144, 60, 100, 0], 1000], [[128, 60, 0, 0], 1250]])
+    assert event_log.read_event_log(filename).tolist() == [(144, 60, 100, 1.), (128, 60, 0, 1.25)]
+
+
+def test_empty_log(tmpdir):
+    filename = str(tmpdir.join('empty.evl'))
+    event_log.EventLogWriter(filename).close()
+    assert len(event_log.read_event_log(filename)) == 0
+    assert list(event_log.iter_events(filename)) == []
+
+
+def test_convert_text_log(tmpdir):
+    text_log = tmpdir.join('session.txt')
+    text_log.write('[[144, 60, 100, 0], 1000]\n\n[[128, 60, 0, 0], 1500]\n')
+    filename = str(tmpdir.join('session.evl'))
+    event_log.convert_text_log(str(text_log), filename)
+    # pygame timestamps are in ms, logs in seconds
+    assert event_log.read_events(filename).tolist() == [(144, 60, 100, 1.), (128, 60, 0, 1.5)]
+    assert event_log.read_events(str(text_log)).tolist() == event_log.read_events(filename).tolist()
@@ -0,0 +1,73 @@
+import mido
+import numpy as np
+import pytest
+
+import event_log
+import midi_record
+
+
+def reference_midi_file(messages, times, output_file):
+    """The midi file mido writes for messages and times, as midi_record did before the bulk writer."""
+    tempo = mido.bpm2tempo(midi_record.TICKS_PER_SECOND)
+    mid = mido.MidiFile()
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    last_tick = 0
+    for message, time in zip(messages, times):
+        tick = mido.second2tick(time, midi_record.TICKS_PER_SECOND, tempo)
+        track.append(message.copy(time=tick-last_tick))
+        last_tick = tick
+    mid.save(output_file)
+
+
+def random_messages(num_messages, seed=0):
+    random = np.random.RandomState(seed)
+    messages = []
+    for _ in range(num_messages):
+        kind = random.choice(['note_on', 'note_off', 'control_change', 'program_change', 'pitchwheel'])
+        channel = int(random.randint(2))
+        if kind in ('note_on', 'note_off'):
+            messages.append(mido.Message(kind, channel=channel, note=int(random.randint(128)),
+                                         velocity=int(random.randint(128))))
+        elif kind == 'control_change':
+            messages.append(mido.Message(kind, channel=channel, control=64, value=int(random.randint(128))))
+        elif kind == 'program_change':
+            messages.append(mido.Message(kind, channel=channel, program=int(random.randint(128))))
+        else:
+            messages.append(mido.Message(kind, channel=channel, pitch=int(random.randint(-8192, 8192))))
+    # long pauses too, for delta times of several bytes
+    gaps = random.choice([0., 0.001, 0.0123, 0.5, 3., 300.], size=num_messages)
+    return messages, np.cumsum(gaps).tolist()
+
+
+def test_seconds_to_ticks_matches_mido():
+    tempo = mido.bpm2tempo(midi_record.TICKS_PER_SECOND)
+    times = np.r_[np.arange(0, 10, 0.0005), 0.5/256, 1.5/256, 2.5/256, 12345.678]
+    expected = [mido.second2tick(time, midi_record.TICKS_PER_SECOND, tempo) for time in times]
+    assert midi_record.seconds_to_ticks(times).tolist() == expected
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_write_output_matches_mido(tmpdir, seed):
+    messages, times = random_messages(2000, seed)
+    midi_record.write_output(messages, times, str(tmpdir.join('bulk.mid')))
+    reference_midi_file(messages, times, str(tmpdir.join('mido.mid')))
+    assert tmpdir.join('bulk.mid').read_binary() == tmpdir.join('mido.mid').read_binary()
+    track = mido.MidiFile(str(tmpdir.join('bulk.mid'))).tracks[0]
+    assert [msg.copy(time=0) for msg in track if not msg.is_meta] == messages
+
+
+def test_write_output_with_sysex(tmpdir):
+    messages = [mido.Message('note_on', note=60), mido.Message('sysex', data=[1, 2, 3, 4]),
+                mido.Message('note_off', note=60)]
+    times = [0., 0.25, 1.]
+    midi_record.write_output(messages, times, str(tmpdir.join('bulk.mid')))
+    reference_midi_file(messages, times, str(tmpdir.join('mido.mid')))
+    assert tmpdir.join('bulk.mid').read_binary() == tmpdir.join('mido.mid').read_binary()
+
+
+def test_write_events_drops_realtime_messages(tmpdir):
+    events = np.array([(0x90, 60, 100, 0.), (0xF8, 0, 0, 0.1), (0x80, 60, 0, 0.5)], dtype=event_log.EVENT_DTYPE)
+    midi_record.write_events(events, str(tmpdir.join('events.mid')))
+    track = mido.MidiFile(str(tmpdir.join('events.mid'))).tracks[0]
+    assert [msg.type for msg in track] == ['note_on', 'note_off', 'end_of_track']
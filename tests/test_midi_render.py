@@ -0,0 +1,77 @@
+import os
+
+import mido
+import numpy as np
+import pytest
+
+from midi_render import Playback, Player, read_schedule
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'midifiles')
+
+
+class RecordingPort():
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+def notes(count):
+    return [mido.Message('note_on', note=60+i) for i in range(count)]
+
+
+def test_pop_due_in_order():
+    messages = notes(4)
+    playback = Playback(RecordingPort(), messages, [0., 0.5, 0.5, 1.])
+    assert playback.pop_due(-0.1) == []
+    assert playback.pop_due(0.) == messages[:1]
+    assert playback.pop_due(0.6) == messages[1:3]
+    assert playback.pop_due(0.6) == []
+    assert playback.pop_due(10.) == messages[3:]
+    assert playback.next_time() is None
+
+
+def test_pop_due_tempo_scale():
+    messages = notes(2)
+    playback = Playback(RecordingPort(), messages, [0., 1.], tempo_scale=2.)
+    assert playback.pop_due(0.4) == messages[:1]
+    assert playback.pop_due(0.5) == messages[1:]
+
+
+def test_loop_starts_over_after_length():
+    messages = notes(2)
+    playback = Playback(RecordingPort(), messages, [0., 0.5], length=2., loop=True)
+    assert playback.pop_due(0.5) == messages
+    assert playback.next_time() == 2.
+    assert playback.pop_due(1.9) == []
+    assert playback.pop_due(2.5) == messages
+    assert playback.next_time() == 4.
+    # a late pop sends every missed message, in order
+    assert playback.pop_due(6.) == messages + messages[:1]
+
+
+def test_loop_of_nothing_ends():
+    playback = Playback(RecordingPort(), [], [], loop=True)
+    assert playback.next_time() is None
+    playback = Playback(RecordingPort(), notes(1), [0.], loop=True)
+    assert playback.pop_due(0.) == notes(1)
+    # a zero length loop would never advance the clock
+    assert playback.next_time() is None
+
+
+def test_invalid_tempo_scale():
+    with pytest.raises(ValueError):
+        Playback(RecordingPort(), notes(1), [0.], tempo_scale=0.)
+
+
+def test_player_sends_file_in_order():
+    midi_path = os.path.join(DATA_DIR, 'transcription_alle_voegel.mid')
+    messages, times, _ = read_schedule(midi_path)
+    port = RecordingPort()
+    player = Player(lookahead=0.)
+    # fast enough for a test, the order is what is checked
+    player.add(Playback(port, messages, times, tempo_scale=max(times[-1], 1.)/0.2))
+    player.run()
+    assert port.sent == messages
+    assert player.report()['playbacks'][0]['sent'] == len(messages)
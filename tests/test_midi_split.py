@@ -0,0 +1,70 @@
+import os
+
+import mido
+import pytest
+
+from midi_split import split_corpus, split_file
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'midifiles')
+MIDI_FILES = [os.path.join(DATA_DIR, filename) for filename in ('goldberg.mid', 'transcription_alle_voegel.mid')]
+
+
+def channel_events(midi_path):
+    """(absolute tick, message bytes) of every channel message, by channel, read through mido."""
+    events = {}
+    for track in mido.MidiFile(midi_path).tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if not msg.is_meta and msg.type != 'sysex':
+                events.setdefault(msg.channel, []).append((tick, msg.bytes()))
+    return {channel: sorted(channel_list, key=lambda event: event[0]) for channel, channel_list in events.items()}
+
+
+def meta_events(midi_path):
+    """Absolute tick, type and attributes of the meta events other than track names and ends."""
+    events = []
+    for track in mido.MidiFile(midi_path).tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if msg.is_meta and msg.type not in ('track_name', 'end_of_track'):
+                events.append((tick, str(msg.copy(time=0))))
+    return sorted(events)
+
+
+@pytest.mark.parametrize('midi_path', MIDI_FILES)
+def test_split_matches_mido(midi_path, tmpdir):
+    output_path, = split_file(midi_path, str(tmpdir))
+    split = mido.MidiFile(output_path)
+    assert split.ticks_per_beat == mido.MidiFile(midi_path).ticks_per_beat
+    assert channel_events(output_path) == channel_events(midi_path)
+    assert meta_events(output_path) == meta_events(midi_path)
+    for track in split.tracks[1:]:
+        assert len(set(msg.channel for msg in track if not msg.is_meta)) == 1
+
+
+def test_separate_files_per_channel(tmpdir):
+    output_paths = split_file(MIDI_FILES[0], str(tmpdir), separate=True)
+    original = channel_events(MIDI_FILES[0])
+    assert len(output_paths) == len(original)
+    for output_path in output_paths:
+        events = channel_events(output_path)
+        assert len(events) == 1
+        channel, channel_list = events.popitem()
+        assert channel_list == original[channel]
+
+
+def test_corpus_mirrors_subdirectories(tmpdir):
+    with open(MIDI_FILES[0], 'rb') as f:
+        data = f.read()
+    midi_paths = []
+    for directory in ('a', 'b'):
+        tmpdir.mkdir(directory).join('take.mid').write_binary(data)
+        midi_paths.append(str(tmpdir.join(directory, 'take.mid')))
+    output_dir = str(tmpdir.join('split'))
+    results = split_corpus(midi_paths, output_dir, num_workers=1)
+    assert sorted(path for _, output_paths, _ in results for path in output_paths) == [
+        os.path.join(output_dir, 'a', 'take_split.mid'), os.path.join(output_dir, 'b', 'take_split.mid')]
+    with pytest.raises(ValueError):
+        split_corpus([midi_paths[0], midi_paths[0][:-len('.mid')] + '.midi'], output_dir, num_workers=1)
@@ -0,0 +1,70 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+import midi_to_lilypond_server
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+
+
+def test_remove_stale_socket(tmpdir):
+  socket_path = str(tmpdir.join('stale.sock'))
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.bind(socket_path)
+  sock.close()
+  midi_to_lilypond_server.remove_stale_socket(socket_path)
+  assert not os.path.exists(socket_path)
+  # nothing to remove
+  midi_to_lilypond_server.remove_stale_socket(socket_path)
+
+
+def test_live_socket_is_kept(tmpdir):
+  socket_path = str(tmpdir.join('live.sock'))
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.bind(socket_path)
+  sock.listen(1)
+  try:
+    with pytest.raises(OSError):
+      midi_to_lilypond_server.remove_stale_socket(socket_path)
+    assert os.path.exists(socket_path)
+  finally:
+    sock.close()
+
+
+def test_other_file_is_kept(tmpdir):
+  path = tmpdir.join('not_a_socket')
+  path.write('')
+  with pytest.raises(OSError):
+    midi_to_lilypond_server.remove_stale_socket(str(path))
+  assert path.exists()
+
+
+def test_request_conversion(tmpdir):
+  socket_path = str(tmpdir.join('server.sock'))
+  server = midi_to_lilypond_server.ThreadingUnixStreamServer(socket_path, EchoHandler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.start()
+  try:
+    request = {'midi_path': 'a.mid', 'num_notes': -1, 'tempo_window': 0, 'bar_length': 8}
+    assert json.loads(midi_to_lilypond_server.request_conversion(request, socket_path)) == request
+    with pytest.raises(RuntimeError):
+      midi_to_lilypond_server.request_conversion({'fail': True}, socket_path)
+  finally:
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+class EchoHandler(midi_to_lilypond_server.ConversionHandler):
+  """Answers with the request instead of converting it."""
+
+  def handle(self):
+    request = json.loads(self.rfile.read().decode('utf-8'))
+    if request.get('fail'):
+      response = {'error': 'failed'}
+    else:
+      response = {'lilypond': json.dumps(request)}
+    self.wfile.write(json.dumps(response).encode('utf-8'))
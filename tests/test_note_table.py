@@ -0,0 +1,23 @@
+import collections
+
+import numpy as np
+
+import note_table
+
+Note = collections.namedtuple('Note', ['pitch', 'start_time', 'end_time', 'velocity', 'instrument'])
+NoteSequence = collections.namedtuple('NoteSequence', ['notes'])
+
+
+def test_from_note_sequence_keeps_instruments():
+  note_seq = NoteSequence([Note(62, 1., 2., 80, 1), Note(60, 0., 1., 70, 0), Note(64, 1., 1.5, 90, 2)])
+  notes = note_table.from_note_sequence(note_seq)
+  assert notes['pitch'].tolist() == [60, 62, 64]
+  assert notes['instrument'].tolist() == [0, 1, 2]
+  assert notes['velocity'].tolist() == [70, 80, 90]
+
+
+def test_from_arrays_sorts_stably():
+  notes = note_table.from_arrays([60, 62, 64], [1., 0., 1.], [2., 1., 2.], instruments=[3, 4, 5])
+  assert notes['pitch'].tolist() == [62, 60, 64]
+  assert notes['instrument'].tolist() == [4, 3, 5]
+  assert np.all(notes['velocity'] == 64)
@@ -0,0 +1,49 @@
+import mido
+import pytest
+
+import chord_store
+import notes_io
+
+
+def chord(*notes):
+    return [mido.Message('note_on', note=note, velocity=64) for note in notes]
+
+
+class FakePort():
+    """Plays back chords, then interrupts like Ctrl-C."""
+    opened = []
+
+    def __init__(self, port_string, chords):
+        self.chords = list(chords)
+        self.closed = False
+        FakePort.opened.append(self)
+
+    async def read_chord(self):
+        if not self.chords:
+            raise KeyboardInterrupt()
+        return self.chords.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def test_save_chords_interactively(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('bank.chords'))
+    played = [chord(60, 64, 67), chord(62, 65), chord(*range(40, 41+chord_store.MAX_CHORD_SIZE)), chord(59)]
+    # the too large chord is not offered for saving
+    answers = iter(['', 'n', 'Y'])
+    FakePort.opened = []
+    monkeypatch.setattr(notes_io, 'AsyncMidiPort', lambda port_string: FakePort(port_string, played))
+    monkeypatch.setattr('builtins.input', lambda prompt: next(answers))
+    notes_io.save_chords_interactively('Digital Piano', filename)
+    saved = [chord_store.to_chord(record) for record in chord_store.read_chords(filename)]
+    assert saved == [chord(60, 64, 67), chord(59)]
+    assert [port.closed for port in FakePort.opened] == [True]
+
+
+def test_debug_io_closes_port(monkeypatch, capsys):
+    FakePort.opened = []
+    monkeypatch.setattr(notes_io, 'AsyncMidiPort', lambda port_string: FakePort(port_string, [chord(60)]))
+    notes_io.debug_io('Digital Piano')
+    assert 'Num notes:\n1\n' in capsys.readouterr().out
+    assert [port.closed for port in FakePort.opened] == [True]
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+import piano_game
+
+
+class FakePort():
+    opened = []
+
+    def __init__(self, port_string):
+        if port_string == 'missing':
+            raise IOError('unknown port')
+        self.name = port_string
+        self.closed = False
+        FakePort.opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+def test_open_ports_are_closed_when_one_fails(monkeypatch):
+    FakePort.opened = []
+    monkeypatch.setattr(piano_game, 'AsyncMidiPort', FakePort)
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(SystemExit):
+            loop.run_until_complete(piano_game.run_drills(['left', 'right', 'missing'], piano_game.ChordBank()))
+    finally:
+        loop.close()
+    assert [port.name for port in FakePort.opened] == ['left', 'right']
+    assert all(port.closed for port in FakePort.opened)
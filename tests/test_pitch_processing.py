@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from pitch_processing import get_f0, hz_to_midi, midi_to_hz
+
+
+def harmonic_tone(f0, fs=44100, seconds=1., n_harmonics=8):
+    t = np.arange(int(fs*seconds))/float(fs)
+    return sum(0.7**k*np.sin(2*np.pi*(k+1)*f0*t) for k in range(n_harmonics))*np.exp(-2*t)
+
+
+@pytest.mark.parametrize('pitch', [45.23, 57.5, 60., 69.81, 81.07])
+def test_f0_is_not_snapped_to_the_grid(pitch):
+    fs = 44100
+    f0 = get_f0(fs, harmonic_tone(midi_to_hz(pitch), fs))
+    assert abs(hz_to_midi(f0)-pitch)*100 < 2
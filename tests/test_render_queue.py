@@ -0,0 +1,57 @@
+import os
+import shutil
+import stat
+
+import pytest
+
+import render_queue
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'midifiles')
+
+# stands in for fluidsynth: counts its runs and writes the output file (-F)
+FAKE_FLUIDSYNTH = """#!/bin/sh
+echo run >> "{runs}"
+sleep 0.2
+echo wav > "$5"
+"""
+
+
+@pytest.fixture
+def batch(tmpdir):
+    if os.name != 'posix':
+        pytest.skip('needs a shell script as fluidsynth')
+    for name in ('a.mid', 'b.mid'):
+        shutil.copy(os.path.join(DATA_DIR, 'goldberg.mid'), str(tmpdir.join(name)))
+    tmpdir.join('x.sf2').write('soundfont')
+    fluidsynth = tmpdir.join('fluidsynth.sh')
+    fluidsynth.write(FAKE_FLUIDSYNTH.format(runs=tmpdir.join('runs')))
+    os.chmod(str(fluidsynth), stat.S_IRWXU)
+    return tmpdir
+
+
+def num_runs(tmpdir):
+    return len(tmpdir.join('runs').readlines()) if tmpdir.join('runs').exists() else 0
+
+
+def test_identical_takes_are_rendered_once(batch):
+    jobs = render_queue.make_jobs([str(batch.join('a.mid')), str(batch.join('b.mid'))], [str(batch.join('x.sf2'))])
+    results = render_queue.render_batch(jobs, str(batch.join('cache')), 4, str(batch.join('fluidsynth.sh')),
+                                        verbose=False)
+    assert num_runs(batch) == 1
+    assert sorted(status for _, status, _, _ in results) == ['cached', 'rendered']
+    for job in jobs:
+        assert os.path.exists(job.output_path)
+
+    results = render_queue.render_batch(jobs, str(batch.join('cache')), 4, str(batch.join('fluidsynth.sh')),
+                                        verbose=False)
+    assert num_runs(batch) == 1
+    assert [status for _, status, _, _ in results] == ['cached', 'cached']
+
+
+def test_unreadable_job_fails_alone(batch):
+    jobs = render_queue.make_jobs([str(batch.join('missing.mid')), str(batch.join('a.mid'))],
+                                  [str(batch.join('x.sf2'))])
+    results = render_queue.render_batch(jobs, str(batch.join('cache')), 2, str(batch.join('fluidsynth.sh')),
+                                        verbose=False)
+    statuses = dict((os.path.basename(job.midi_path), status) for job, status, _, _ in results)
+    assert statuses == {'missing.mid': 'failed', 'a.mid': 'rendered'}
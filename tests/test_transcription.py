@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+import transcription
+
+FS = 16000
+HOP_SIZE = 512
+NUM_FRAMES = 300
+# (key, start frame, end frame) of the notes the fake model hears
+NOTES = [(39, 0, 40), (43, 10, 31), (39, 40, 90), (50, 95, 97), (60, 120, 299)]
+# active without an onset, which starts no note
+GHOSTS = [(70, 150, 170)]
+
+
+class FakeModel():
+    """Stands in for OnsetsFramesModel, its spectrogram frames hold their position in the recording."""
+    hop_size = HOP_SIZE
+    sample_rate = FS
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def spectrogram(self, samples, fs):
+        assert fs == FS
+        # centered frames like librosa's
+        return samples[::HOP_SIZE][:1+len(samples)//HOP_SIZE, None]
+
+    def predict(self, specs):
+        self.batch_sizes.append(len(specs))
+        results = []
+        for spec in specs:
+            frame = np.round(spec[:, 0]*NUM_FRAMES).astype(np.int64)
+            frames = np.zeros((len(spec), transcription.NUM_PITCHES), dtype=bool)
+            onsets = np.zeros_like(frames)
+            for key, start, end in NOTES + GHOSTS:
+                frames[:, key] |= (frame >= start) & (frame < end)
+            for key, start, end in NOTES:
+                onsets[:, key] |= (frame == start) | (frame == start+1)
+            results.append((frames, onsets, np.full(frames.shape, 0.5)))
+        return results
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    # every sample holds the frame it belongs to
+    samples = (np.arange(NUM_FRAMES*HOP_SIZE)//HOP_SIZE/float(NUM_FRAMES)).astype(np.float32)
+    model = FakeModel()
+    monkeypatch.setattr(transcription, '_samples', samples)
+    monkeypatch.setattr(transcription, '_settings', (FS,))
+    monkeypatch.setattr(transcription, '_model', model)
+    return model
+
+
+@pytest.mark.parametrize('chunk_frames, batch_size', [(300, 1), (7, 1), (40, 3), (64, 8)])
+def test_model_chunks_stitch(fake_model, chunk_frames, batch_size):
+    context = 5
+    chunks = [(first, min(first+chunk_frames, NUM_FRAMES), context) for first in range(0, NUM_FRAMES, chunk_frames)]
+    tracker = transcription.NoteTracker(min_frames=1, require_onsets=True)
+    notes = []
+    for i in range(0, len(chunks), batch_size):
+        for chunk in transcription.model_chunks(chunks[i:i+batch_size]):
+            notes.extend(tracker.update(*chunk))
+    notes.extend(tracker.close(NUM_FRAMES))
+    expected = [(transcription.MIN_PITCH+key, start, end, 50) for key, start, end in NOTES]
+    assert sorted(notes, key=lambda note: (note[1], note[0])) == sorted(expected, key=lambda note: (note[1], note[0]))
+    assert max(fake_model.batch_sizes) == min(batch_size, len(chunks))
+
+
+def test_peak_picker_without_model(tmpdir):
+    t = np.arange(2*FS)/float(FS)
+    x = 0.3*np.sin(2*np.pi*440.*t)*(t < 1.5)
+    wav_file = str(tmpdir.join('a4.wav'))
+    wavfile.write(wav_file, FS, (x*32767).astype(np.int16))
+    num_notes, _ = transcription.transcribe(wav_file, str(tmpdir.join('a4.mid')), num_workers=1, verbose=False,
+                                            checkpoint=str(tmpdir.join('missing')))
+    assert num_notes == 1
+    assert transcription.find_checkpoint(str(tmpdir.join('missing'))) is None
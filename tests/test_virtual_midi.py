@@ -0,0 +1,69 @@
+import os
+
+import mido
+import numpy as np
+import pytest
+
+import event_log
+import virtual_midi
+from midi_render import read_schedule
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'midifiles')
+
+
+@pytest.fixture
+def backend():
+    yield mido.Backend('virtual_midi', load=True)
+    virtual_midi.reset()
+
+
+def receive_all(port, count):
+    return [port.receive() for _ in range(count)]
+
+
+def test_midi_file_replay_in_order(backend):
+    midi_path = os.path.join(DATA_DIR, 'transcription_alle_voegel.mid')
+    messages, _, _ = read_schedule(midi_path)
+    device = virtual_midi.add_replay('Digital Piano', midi_path, speed=float('inf'))
+    with backend.open_input('Digital Piano') as port:
+        received = receive_all(port, len(messages))
+        device.join()
+        assert port.poll() is None
+    assert received == [msg.copy(time=0) for msg in messages]
+
+
+def test_event_log_replay_in_order(backend, tmpdir):
+    filename = str(tmpdir.join('session.evl'))
+    events = np.zeros(50, dtype=event_log.EVENT_DTYPE)
+    events['status'] = 0x90
+    events['data1'] = 40 + np.arange(50)
+    events['data2'] = np.tile([100, 0], 25)
+    # some simultaneous
+    events['timestamp'] = 1 + np.repeat(np.arange(25), 2)*1e-3
+    with event_log.EventLogWriter(filename) as writer:
+        writer.write_array(events)
+    device = virtual_midi.add_replay('Digital Piano', filename, speed=10.)
+    received = []
+    with backend.open_input('Digital Piano', callback=received.append):
+        device.join()
+    assert [msg.note for msg in received] == events['data1'].tolist()
+    assert [msg.velocity for msg in received] == events['data2'].tolist()
+
+
+def test_output_capture_and_echo(backend):
+    virtual_midi.get_device('Synth', echo=True)
+    messages = [mido.Message('note_on', note=note) for note in range(60, 70)]
+    with backend.open_input('Synth') as inport, backend.open_output('Synth') as outport:
+        for msg in messages:
+            outport.send(msg)
+        assert receive_all(inport, len(messages)) == messages
+    captured = virtual_midi.captured('Synth')
+    assert [msg for _, msg in captured] == messages
+    assert all(a <= b for (a, _), (b, _) in zip(captured, captured[1:]))
+
+
+def test_replay_from_environment(backend):
+    midi_path = os.path.join(DATA_DIR, 'goldberg.mid')
+    virtual_midi.add_replays_from_environment('Left={}@inf;Right={}@2'.format(midi_path, midi_path))
+    assert backend.get_input_names() == ['Left', 'Right']
+    assert virtual_midi.get_device('Left').playback.times.max() == 0.
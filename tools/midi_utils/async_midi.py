@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import mido
+from midi_constants import *
+from latency import NULL_TRACE
+
+
+class AsyncMidiPort():
+    def __init__(self, port_string, loop=None):
+        """
+        asyncio wrapper of a midi input and output port pair.
+
+        Incoming messages are handed from the backend's callback thread to the
+        event loop with their arrival time, so waiting for input costs no CPU
+        and one event loop can serve many ports. Must be created while the
+        event loop is running, or with loop given.
+
+        Args:
+            port_string (str): Midi port name
+            loop: Event loop to deliver messages to, defaults to the running one
+
+        """
+        self.name = port_string
+        self.loop = loop or asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+        self.outport = mido.open_output(port_string)
+        try:
+            self.inport = mido.open_input(port_string, callback=self._on_message)
+        except:
+            self.outport.close()
+            raise
+
+    def _on_message(self, msg):
+        # runs in the backend's thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (time.perf_counter(), msg))
+
+    async def receive(self, timeout=None):
+        """
+        Waits for the next message.
+
+        Args:
+            timeout (float): Seconds to wait at most, None to wait forever
+
+        Returns:
+            Tuple of (arrival_time, message), or None on timeout. arrival_time
+            is on the time.perf_counter clock.
+        """
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def flush(self):
+        """Drops all messages received so far."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def send(self, msg):
+        self.outport.send(msg)
+
+    def schedule_note_offs(self, chord, delay):
+        """
+        Sends note_off messages for all notes of chord after delay seconds
+        without blocking.
+
+        Returns:
+            asyncio.TimerHandle that can cancel the note_offs
+        """
+        off_events = [mido.Message('note_off', note=note.note) for note in chord]
+        return self.loop.call_later(delay, lambda: [self.send(off) for off in off_events])
+
+    async def play_chord(self, chord, duration=3):
+        """Plays chord for duration seconds."""
+        self.outport.reset()
+        for note in chord:
+            self.send(note)
+        self.schedule_note_offs(chord, duration)
+        await asyncio.sleep(duration)
+
+    async def read_chord(self, window=DELTA_T_MAX, timeout=None, trace=NULL_TRACE):
+        """
+        Collects the messages arriving within window seconds of the first one.
+
+        Args:
+            window (float): Chord window in seconds, measured on arrival times
+            timeout (float): Seconds to wait for the first message, None to wait
+                forever
+            trace: latency.Trace to mark the key_press, received and
+                chord_closed times in
+
+        Returns:
+            List of messages, empty on timeout
+        """
+        self.flush()
+        first = await self.receive(timeout)
+        if first is None:
+            return []
+        chord_start, msg = first
+        trace.mark('key_press', chord_start)
+        trace.mark('received')
+        chord = [msg]
+        while True:
+            received = await self.receive(max(chord_start+window-time.perf_counter(), 0))
+            if received is None:
+                break
+            arrival_time, msg = received
+            if arrival_time-chord_start > window:
+                break
+            chord.append(msg)
+        trace.mark('chord_closed')
+        return chord
+
+    def close(self):
+        self.inport.close()
+        self.outport.close()
@@ -0,0 +1,355 @@
+"""
+Benchmarks of the midi tools on synthetic recordings.
+
+A seeded generator plays chords and melody notes on an eighth note grid at
+120 bpm with a human amount of timing jitter, for any number of notes. From
+the same notes it builds every input the benchmarked stages take: a note
+table, mido messages with their times, an event log and a midi file. Each
+stage is timed as the best of a few runs, and its peak memory is measured in
+one more run under tracemalloc. Stages whose dependencies are missing (e.g.
+magenta for convert_midi_to_ly) are reported as skipped.
+
+Results are written as json. Compared against a baseline saved on the same
+machine, stages that got slower or hungrier by more than a tolerance are
+reported and the script exits with status 1, as it does when a stage the
+baseline measured was skipped, e.g. because a dependency went missing.
+
+Example usage:
+
+python benchmarks.py -n 1000 10000 100000 -o results.json -b benchmark_baseline.json
+
+Save a new baseline:
+
+python benchmarks.py -n 1000 10000 100000 -o benchmark_baseline.json
+
+"""
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mido
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models'))
+import note_table
+import event_log
+
+BENCHMARK_VERSION = 1
+DEFAULT_SIZES = (1000, 10000, 100000)
+UNIT_LENGTH = 0.25  # an eighth note at 120 bpm
+
+
+def synthetic_notes(num_notes, seed=0):
+    """
+    Notes of a synthetic performance: chords of 1 to 4 notes on an eighth
+    note grid, onsets jittered by a few ms and chord notes spread like a
+    pianist's.
+
+    Args:
+        num_notes (int): Number of notes
+        seed (int): Seed of the generator
+
+    Returns:
+        Note table, see note_table.from_arrays
+    """
+    random = np.random.RandomState(seed)
+    chord_sizes = random.choice([1, 1, 1, 2, 3, 4], size=num_notes)
+    chord_sizes = chord_sizes[:np.searchsorted(np.cumsum(chord_sizes), num_notes)+1]
+    chord_sizes[-1] -= chord_sizes.sum()-num_notes
+    # mostly eighths, some quarters and halves
+    steps = random.choice([1, 1, 1, 2, 2, 4], size=len(chord_sizes))
+    chord_starts = np.cumsum(steps)*UNIT_LENGTH + random.normal(0, 0.005, size=len(chord_sizes))
+    chord_index = np.repeat(np.arange(len(chord_sizes)), chord_sizes)
+    starts = chord_starts[chord_index] + random.uniform(0, 0.02, size=num_notes)
+    ends = starts + steps[chord_index]*UNIT_LENGTH*random.uniform(0.5, 0.95, size=num_notes)
+    roots = 48 + np.cumsum(random.randint(-2, 3, size=len(chord_sizes))) % 24
+    pitches = roots[chord_index] + random.choice([0, 4, 7, 12], size=num_notes)
+    velocities = random.randint(40, 100, size=num_notes)
+    return note_table.from_arrays(pitches, np.maximum(starts, 0), ends, velocities)
+
+
+def note_events(notes):
+    """
+    Raw midi events of a note table, note ons and note ons of velocity 0
+    as digital pianos send them.
+
+    Returns:
+        Structured array of event_log.EVENT_DTYPE sorted by time, timestamps in seconds
+    """
+    events = np.zeros(2*len(notes), dtype=event_log.EVENT_DTYPE)
+    events['status'] = 0x90
+    events['data1'] = np.repeat(notes['pitch'], 2)
+    events['data2'][::2] = notes['velocity']
+    events['timestamp'][::2] = notes['start']
+    events['timestamp'][1::2] = notes['end']
+    return events[np.argsort(events['timestamp'], kind='mergesort')]
+
+
+class SyntheticInputs():
+    def __init__(self, num_notes, work_dir, seed=0):
+        """
+        Inputs of all stages for one synthetic performance, each built on
+        first use so only the inputs of the selected stages are made.
+
+        Args:
+            num_notes (int): Number of notes
+            work_dir (str): Directory for the input and output files
+            seed (int): Seed of the generator
+
+        """
+        self.num_notes = num_notes
+        self.work_dir = work_dir
+        self.seed = seed
+        self._cache = {}
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def path(self, filename):
+        return os.path.join(self.work_dir, '{}_{}'.format(self.num_notes, filename))
+
+    def notes(self):
+        return self._get('notes', lambda: synthetic_notes(self.num_notes, self.seed))
+
+    def events(self):
+        return self._get('events', lambda: note_events(self.notes()))
+
+    def messages(self):
+        """Tuple of (messages, times) as MidiRecorder collects them."""
+        def build():
+            events = self.events()
+            messages = [mido.Message('note_on', note=note, velocity=velocity)
+                        for note, velocity in zip(events['data1'].tolist(), events['data2'].tolist())]
+            return messages, events['timestamp'].tolist()
+        return self._get('messages', build)
+
+    def midi_file(self):
+        def build():
+            import midi_record
+            midi_record.write_events(self.events(), self.path('input.mid'))
+            return self.path('input.mid')
+        return self._get('midi_file', build)
+
+    def event_log_file(self):
+        def build():
+            with event_log.EventLogWriter(self.path('input.evl')) as writer:
+                writer.write_array(self.events())
+            return self.path('input.evl')
+        return self._get('event_log_file', build)
+
+
+# Each stage takes the SyntheticInputs and returns the function to measure.
+
+def stage_convert_midi_to_ly(inputs):
+    import midi_to_lilypond
+    midi_file = inputs.midi_file()
+    return lambda: midi_to_lilypond.convert_midi_to_ly(midi_file, inputs.path('output.ly'), verbose=False)
+
+
+def stage_find_note_lengths(inputs):
+    import midi_to_lilypond
+    notes = inputs.notes()
+    return lambda: midi_to_lilypond.find_note_lengths(notes)
+
+
+def stage_get_chords(inputs):
+    import note_processing
+    messages, times = inputs.messages()
+    return lambda: note_processing.get_chords(messages, times)
+
+
+def stage_write_output(inputs):
+    import midi_record
+    messages, times = inputs.messages()
+    return lambda: midi_record.write_output(messages, times, inputs.path('output.mid'))
+
+
+def stage_midi_chords_parser(inputs):
+    import midi_parse
+    log_file = inputs.event_log_file()
+    return lambda: list(midi_parse.MidiChordsParser(log_file))
+
+
+STAGES = collections.OrderedDict([
+    ('convert_midi_to_ly', stage_convert_midi_to_ly),
+    ('find_note_lengths', stage_find_note_lengths),
+    ('get_chords', stage_get_chords),
+    ('write_output', stage_write_output),
+    ('MidiChordsParser', stage_midi_chords_parser),
+])
+
+
+def measure(func, repeat=3):
+    """
+    Times a function and measures its peak memory.
+
+    Args:
+        func: Function without arguments
+        repeat (int): Number of timed runs
+
+    Returns:
+        Dict of the best and mean seconds of the timed runs and the peak
+        bytes allocated during one more run
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter()-start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return collections.OrderedDict([
+        ('seconds', min(seconds)),
+        ('mean_seconds', sum(seconds)/len(seconds)),
+        ('peak_bytes', peak_bytes),
+    ])
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, repeat=3, seed=0, verbose=True):
+    """
+    Runs stages on synthetic performances of each size.
+
+    Args:
+        sizes (list): Numbers of notes
+        stages (list): Names of stages to run, defaults to all of STAGES
+        repeat (int): Number of timed runs per stage and size
+        seed (int): Seed of the generator
+        verbose (bool): If True, prints one line per stage and size
+
+    Returns:
+        Results as a dict of meta data and, for every stage and size, the
+        measurement of measure or the reason the stage was skipped
+    """
+    stages = stages or list(STAGES)
+    results = collections.OrderedDict([
+        ('meta', collections.OrderedDict([
+            ('version', BENCHMARK_VERSION),
+            ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+            ('python', platform.python_version()),
+            ('numpy', np.__version__),
+            ('machine', platform.machine()),
+            ('processor', platform.processor()),
+            ('repeat', repeat),
+            ('seed', seed),
+        ])),
+        ('results', collections.OrderedDict((stage, collections.OrderedDict()) for stage in stages)),
+    ])
+    work_dir = tempfile.mkdtemp(prefix='midi_benchmarks_')
+    try:
+        for size in sizes:
+            inputs = SyntheticInputs(size, work_dir, seed)
+            for stage in stages:
+                try:
+                    func = STAGES[stage](inputs)
+                except ImportError as e:
+                    result = collections.OrderedDict([('skipped', repr(e))])
+                else:
+                    result = measure(func, repeat)
+                results['results'][stage][str(size)] = result
+                if verbose:
+                    print (format_result(stage, size, result))
+            del inputs
+            gc.collect()
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def format_result(stage, size, result):
+    if 'skipped' in result:
+        return '{:<20} {:>8} notes  skipped: {}'.format(stage, size, result['skipped'])
+    return '{:<20} {:>8} notes {:10.4f}s {:10.1f}MB {:10.0f} notes/s'.format(
+        stage, size, result['seconds'], result['peak_bytes']/2.**20, size/max(result['seconds'], 1e-9))
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=1e-3, min_bytes=1<<20):
+    """
+    Finds regressions against a baseline.
+
+    Differences below min_seconds or min_bytes are ignored, they are mostly
+    noise of the timer and the allocator.
+
+    Args:
+        results (dict): Results of run_benchmarks
+        baseline (dict): Earlier results of run_benchmarks on the same machine
+        tolerance (float): Allowed relative increase of seconds and peak bytes
+
+    Returns:
+        List of (stage, size, metric, baseline value, value) tuples
+    """
+    regressions = []
+    for stage, by_size in results['results'].items():
+        for size, result in by_size.items():
+            reference = baseline['results'].get(stage, {}).get(size, {})
+            for metric, floor in (('seconds', min_seconds), ('peak_bytes', min_bytes)):
+                if metric not in result or metric not in reference:
+                    continue
+                if result[metric] > reference[metric]*(1+tolerance) and result[metric]-reference[metric] > floor:
+                    regressions.append((stage, int(size), metric, reference[metric], result[metric]))
+    return regressions
+
+
+def newly_skipped(results, baseline):
+    """
+    Finds stages that were skipped but measured in a baseline, whose
+    regressions compare cannot check.
+
+    Returns:
+        List of (stage, size, reason) tuples
+    """
+    skipped = []
+    for stage, by_size in results['results'].items():
+        for size, result in by_size.items():
+            reference = baseline['results'].get(stage, {}).get(size, {})
+            if 'skipped' in result and 'seconds' in reference:
+                skipped.append((stage, int(size), result['skipped']))
+    return skipped
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the midi tools on synthetic recordings')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='Numbers of notes of the synthetic recordings, e.g. 1000 to 1000000')
+    parser.add_argument('-s', '--stages', nargs='+', choices=list(STAGES), default=None,
+                        help='Stages to run, defaults to all')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of timed runs per stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='Json file to write the results to')
+    parser.add_argument('-b', '--baseline', default=None, help='Json file of earlier results to compare to')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of time and memory over the baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.stages, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for stage, size, metric, reference, value in regressions:
+            print ('regression: {} {} notes {}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                stage, size, metric, reference, value, value/float(reference)-1))
+        skipped = newly_skipped(results, baseline)
+        for stage, size, reason in skipped:
+            print ('skipped: {} {} notes, measured in the baseline: {}'.format(stage, size, reason))
+        print ('{} regressions, {} newly skipped against {}'.format(len(regressions), len(skipped), args.baseline))
+        if regressions or skipped:
+            sys.exit(1)
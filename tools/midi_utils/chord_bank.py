@@ -0,0 +1,112 @@
+import numpy as np
+
+# Number of set bits of every byte value.
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pitch_mask(pitches):
+    """Canonical key of a set of midi pitches, a 128 bit int with bit p set for pitch p."""
+    mask = 0
+    for pitch in pitches:
+        mask |= 1 << pitch
+    return mask
+
+
+def chord_key(chord):
+    """Canonical key of a chord of note messages, see pitch_mask."""
+    return pitch_mask(n.note for n in chord)
+
+
+def mask_to_words(mask):
+    """Splits a 128 bit pitch mask into (low, high) 64 bit words."""
+    return mask & 0xFFFFFFFFFFFFFFFF, mask >> 64
+
+
+def hamming_distance(mask1, mask2):
+    """Number of pitches in one of the masks but not in the other."""
+    return bin(mask1 ^ mask2).count('1')
+
+
+class ChordBank():
+    def __init__(self, chords=()):
+        """
+        Deduplicated collection of chords indexed by their pitch sets.
+
+        Exact lookups and duplicate checks are dict lookups on the chord key.
+        Nearest chord queries compare the query against all masks at once.
+
+        Args:
+            chords (list): Chords of note messages, duplicates are dropped
+
+        """
+        self.chords = []
+        self.keys = []
+        self.index = {}
+        self._words = None
+        for chord in chords:
+            self.add(chord)
+
+    def __len__(self):
+        return len(self.chords)
+
+    def __contains__(self, chord):
+        return chord_key(chord) in self.index
+
+    def add(self, chord, key=None):
+        """
+        Adds a chord unless the bank already has one with the same pitches.
+
+        Args:
+            chord (list): Note messages of the chord
+            key (int): Precomputed chord_key of the chord
+
+        Returns:
+            True if the chord was added
+        """
+        if key is None:
+            key = chord_key(chord)
+        if key in self.index:
+            return False
+        self.index[key] = len(self.chords)
+        self.chords.append(chord)
+        self.keys.append(key)
+        self._words = None
+        return True
+
+    def lookup(self, chord):
+        """Returns the bank's chord with the same pitches as chord, or None."""
+        i = self.index.get(chord_key(chord))
+        return None if i is None else self.chords[i]
+
+    def words(self):
+        """All chord masks as an (n, 2) uint64 array of (low, high) words."""
+        if self._words is None:
+            self._words = np.array([mask_to_words(key) for key in self.keys],
+                                   dtype=np.uint64).reshape(-1, 2)
+        return self._words
+
+    def distances(self, chord):
+        """Hamming distance between chord and every chord of the bank."""
+        query = np.array(mask_to_words(chord_key(chord)), dtype=np.uint64)
+        xor = np.ascontiguousarray(self.words() ^ query)
+        return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(len(self.keys), 16).sum(axis=1)
+
+    def nearest(self, chord, k=1):
+        """
+        Finds the chords of the bank closest to chord.
+
+        Args:
+            chord (list): Note messages of the chord
+            k (int): Number of chords to return
+
+        Returns:
+            List of (distance, chord) tuples, closest first, where distance is
+            the number of differing pitches
+        """
+        if not self.chords:
+            return []
+        distances = self.distances(chord)
+        k = min(k, len(distances))
+        closest = np.argpartition(distances, k-1)[:k]
+        closest = closest[np.argsort(distances[closest], kind='mergesort')]
+        return [(int(distances[i]), self.chords[i]) for i in closest]
@@ -0,0 +1,172 @@
+"""
+Append-only store of recorded chords.
+
+The file starts with a fixed-size header holding the number of chords and the
+number of chords of every size, followed by fixed-width records of pitches,
+velocities, chord size and timestamp. Appending writes the new records and
+rewrites the header in place, and readers memory map the records and filter
+them by size without building any Python objects.
+
+Example usage (convert the old pickled chord bank):
+
+python chord_store.py data/chord_bank.pickle data/chord_bank.chords
+
+"""
+import os
+import pickle
+import sys
+import time
+
+import mido
+import numpy as np
+
+MAGIC = b'MELYCHD1'
+MAX_CHORD_SIZE = 16
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('num_chords', '<u8'),
+    ('size_counts', '<u8', (MAX_CHORD_SIZE+1,)),
+])
+CHORD_DTYPE = np.dtype([
+    ('pitches', 'u1', (MAX_CHORD_SIZE,)),
+    ('velocities', 'u1', (MAX_CHORD_SIZE,)),
+    ('size', 'u1'),
+    ('timestamp', '<f8'),
+])
+
+
+def read_header(filename):
+    """Returns the header of a chord store as a structured scalar of HEADER_DTYPE."""
+    header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if not len(header) or header['magic'][0] != MAGIC:
+        raise ValueError("'{}' is not a chord store.".format(filename))
+    return header[0]
+
+
+def chords_to_records(chords, timestamp=None):
+    """
+    Packs chords of note messages into records.
+
+    Args:
+        chords (list): Chords, each a list of note messages
+        timestamp (float): Time stored with the chords, defaults to now
+
+    Returns:
+        Structured array of CHORD_DTYPE
+
+    Raises:
+        ValueError: If a chord has more than MAX_CHORD_SIZE notes
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    records = np.zeros(len(chords), dtype=CHORD_DTYPE)
+    for i, chord in enumerate(chords):
+        if len(chord) > MAX_CHORD_SIZE:
+            raise ValueError('chord {} has {} notes, a chord store holds at most {}'.format(
+                i, len(chord), MAX_CHORD_SIZE))
+        records['pitches'][i, :len(chord)] = [n.note for n in chord]
+        records['velocities'][i, :len(chord)] = [n.velocity for n in chord]
+        records['size'][i] = len(chord)
+    records['timestamp'] = timestamp
+    return records
+
+
+def append_records(filename, records):
+    """
+    Appends records to a chord store, creating it if needed.
+
+    Only the new records and the header are written, the header last, so an
+    interrupted append leaves the previous contents readable.
+
+    Args:
+        filename (str): Chord store file name
+        records (array): Structured array of CHORD_DTYPE
+
+    """
+    if os.path.exists(filename):
+        header = read_header(filename)
+    else:
+        header = np.zeros(1, dtype=HEADER_DTYPE)[0]
+        header['magic'] = MAGIC
+        with open(filename, 'wb') as f:
+            f.write(header.tobytes())
+    with open(filename, 'r+b') as f:
+        f.seek(HEADER_DTYPE.itemsize + int(header['num_chords'])*CHORD_DTYPE.itemsize)
+        f.write(np.ascontiguousarray(records, dtype=CHORD_DTYPE).tobytes())
+        f.truncate()
+        header['num_chords'] += len(records)
+        header['size_counts'] += np.bincount(records['size'], minlength=MAX_CHORD_SIZE+1).astype(np.uint64)
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(header.tobytes())
+
+
+def append_chords(filename, chords, timestamp=None):
+    """Appends chords of note messages to a chord store, see append_records."""
+    append_records(filename, chords_to_records(chords, timestamp))
+
+
+def read_chords(filename, size=None):
+    """
+    Reads the records of a chord store.
+
+    Args:
+        filename (str): Chord store file name
+        size (int): If given, only chords with this many notes are returned
+
+    Returns:
+        Structured array of CHORD_DTYPE, memory mapped if size is None
+
+    Raises:
+        ValueError: If size is not between 0 and MAX_CHORD_SIZE
+    """
+    if size is not None and not 0 <= size <= MAX_CHORD_SIZE:
+        raise ValueError('chord size must be between 0 and {}, got {}'.format(MAX_CHORD_SIZE, size))
+    header = read_header(filename)
+    num_chords = int(header['num_chords'])
+    if not num_chords or (size is not None and not header['size_counts'][size]):
+        return np.zeros(0, dtype=CHORD_DTYPE)
+    records = np.memmap(filename, dtype=CHORD_DTYPE, mode='r',
+                        offset=HEADER_DTYPE.itemsize, shape=(num_chords,))
+    if size is None:
+        return records
+    return records[records['size'] == size]
+
+
+def chord_keys(records):
+    """Chord keys (see chord_bank.pitch_mask) of all records."""
+    pitches = records['pitches'].astype(np.uint64)
+    in_chord = np.arange(MAX_CHORD_SIZE) < records['size'][:, None]
+    low = np.where(in_chord & (pitches < 64), np.uint64(1) << (pitches % np.uint64(64)), np.uint64(0))
+    high = np.where(in_chord & (pitches >= 64), np.uint64(1) << (pitches % np.uint64(64)), np.uint64(0))
+    low = np.bitwise_or.reduce(low, axis=1).tolist()
+    high = np.bitwise_or.reduce(high, axis=1).tolist()
+    return [l | (h << 64) for l, h in zip(low, high)]
+
+
+def to_chord(record):
+    """Turns a record back into a chord of note_on messages."""
+    size = int(record['size'])
+    return [mido.Message('note_on', note=int(note), velocity=int(velocity))
+            for note, velocity in zip(record['pitches'][:size], record['velocities'][:size])]
+
+
+def convert_pickle(pickle_file, store_file):
+    """
+    Converts a pickled list of chords, e.g. the old data/chord_bank.pickle, to a
+    chord store.
+
+    Args:
+        pickle_file (str): Pickled chords file name
+        store_file (str): Chord store file name, overwritten if it exists
+
+    """
+    with open(pickle_file, 'rb') as f:
+        chords = pickle.load(f)
+    if os.path.exists(store_file):
+        os.remove(store_file)
+    append_chords(store_file, chords, os.path.getmtime(pickle_file))
+
+
+if __name__=='__main__':
+    convert_pickle(sys.argv[1], sys.argv[2])
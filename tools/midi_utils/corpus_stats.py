@@ -0,0 +1,253 @@
+"""
+Note statistics of whole midi corpora.
+
+Generalizes analyze_times.py to any number of files and to more statistics:
+inter-onset intervals, pitches, velocities, chord sizes and polyphony, all as
+histograms with fixed bins. Fixed bins make the histograms of different files
+add up, so a pool of worker processes computes one partial result per file
+and the main process sums them. Partial results are cached under the hash of
+the file contents, so a rerun after adding files only reads the new ones.
+
+Example usage:
+
+python corpus_stats.py -i ../../data/midifiles -o corpus_stats.npz
+
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+
+import numpy as np
+
+from midi_constants import DELTA_T_MAX
+from midi_split import find_midi_files, split_events
+from note_processing import chord_ranges
+
+# part of every cache key, bump it when the statistics or their bins change
+STATS_VERSION = b'corpus_stats 1'
+IOI_BIN_WIDTH = 0.01
+IOI_BINS = 200  # the last bin collects all longer intervals
+MAX_CHORD_SIZE = 16
+MAX_POLYPHONY = 32
+HISTOGRAMS = ('ioi', 'pitch', 'velocity', 'chord_size', 'polyphony')
+COUNTS = ('files', 'notes', 'seconds')
+
+
+def empty_stats():
+    """Statistics of no notes at all, the neutral element of merge_stats."""
+    return {
+        'ioi': np.zeros(IOI_BINS, dtype=np.int64),
+        'pitch': np.zeros(128, dtype=np.int64),
+        'velocity': np.zeros(128, dtype=np.int64),
+        'chord_size': np.zeros(MAX_CHORD_SIZE+1, dtype=np.int64),
+        # seconds spent with each number of sounding notes
+        'polyphony': np.zeros(MAX_POLYPHONY+1, dtype=np.float64),
+        'files': np.zeros((), dtype=np.int64),
+        'notes': np.zeros((), dtype=np.int64),
+        'seconds': np.zeros((), dtype=np.float64),
+    }
+
+
+def merge_stats(a, b):
+    """Sums two statistics, in place into a."""
+    for key in HISTOGRAMS + COUNTS:
+        a[key] += b[key]
+    return a
+
+
+def ticks_to_seconds(ticks, header, conductor):
+    """
+    Converts absolute ticks to seconds following the tempo changes of a file.
+
+    Args:
+        ticks (array): Absolute ticks
+        header (bytes): MThd chunk data, see midi_split.split_events
+        conductor (list): Meta events, see midi_split.split_events
+
+    """
+    division = struct.unpack('>h', header[4:6])[0]
+    ticks = np.asarray(ticks, dtype=np.float64)
+    if division < 0:
+        # SMPTE division: frames per second times ticks per frame
+        return ticks/(-(division >> 8)*(division & 0xFF))
+    changes = [(tick, (event[3] << 16) | (event[4] << 8) | event[5])
+               for tick, _, event in sorted(conductor) if event[1] == 0x51 and len(event) >= 6]
+    change_ticks = np.array([0] + [tick for tick, _ in changes], dtype=np.float64)
+    tempos = np.array([500000] + [tempo for _, tempo in changes], dtype=np.float64)
+    change_seconds = np.r_[0, np.cumsum(np.diff(change_ticks)*tempos[:-1])]/(division*1e6)
+    k = np.searchsorted(change_ticks, ticks, side='right')-1
+    return change_seconds[k] + (ticks-change_ticks[k])*tempos[k]/(division*1e6)
+
+
+def note_stats(times, pitches, velocities, max_delta=DELTA_T_MAX):
+    """
+    Statistics of the note events of one file.
+
+    Args:
+        times (array): Event times in seconds, sorted
+        pitches (array): Midi pitches
+        velocities (array): Velocities, 0 for note offs
+
+    Returns:
+        Statistics as returned by empty_stats
+    """
+    stats = empty_stats()
+    stats['files'] += 1
+    is_on = velocities > 0
+    onsets = times[is_on]
+    stats['notes'] += len(onsets)
+    if len(times):
+        stats['seconds'] += times[-1]
+    stats['pitch'] += np.bincount(pitches[is_on], minlength=128)
+    stats['velocity'] += np.bincount(velocities[is_on], minlength=128)
+    onset_times = np.unique(onsets)
+    # the epsilon keeps intervals of exactly k bin widths in bin k despite rounding
+    ioi = np.minimum((np.diff(onset_times)/IOI_BIN_WIDTH + 1e-9).astype(np.int64), IOI_BINS-1)
+    stats['ioi'] += np.bincount(ioi, minlength=IOI_BINS)
+    starts, ends = chord_ranges(onsets, max_delta, min_size=1)
+    stats['chord_size'] += np.bincount(np.minimum(ends-starts, MAX_CHORD_SIZE), minlength=MAX_CHORD_SIZE+1)
+    # sounding notes between events, note offs sort before note ons at the same time
+    order = np.lexsort((is_on, times))
+    sounding = np.maximum(np.cumsum(np.where(is_on[order], 1, -1)), 0)
+    durations = np.diff(times[order])
+    stats['polyphony'] += np.bincount(np.minimum(sounding[:-1], MAX_POLYPHONY), weights=durations,
+                                      minlength=MAX_POLYPHONY+1)
+    return stats
+
+
+def file_stats(data):
+    """
+    Statistics of a midi file.
+
+    Args:
+        data (bytes): Midi file contents
+
+    """
+    header, conductor, channels = split_events(data)
+    notes = [(tick, event[0] >> 4, event[1], event[2])
+             for events in channels.values() for tick, _, event in events
+             if event[0] >> 4 in (0x8, 0x9)]
+    if not notes:
+        stats = empty_stats()
+        stats['files'] += 1
+        return stats
+    ticks, kinds, pitches, velocities = (np.array(column, dtype=np.int64) for column in zip(*notes))
+    velocities[kinds == 0x8] = 0
+    order = np.argsort(ticks, kind='mergesort')
+    return note_stats(ticks_to_seconds(ticks[order], header, conductor), pitches[order], velocities[order])
+
+
+def stats_job(job):
+    """
+    Statistics of a single file inside a worker process, from the cache if
+    the file was seen before.
+
+    Args:
+        job: Tuple of (midi_path, cache_dir)
+
+    Returns:
+        Tuple of (midi_path, stats, cached, error), stats is None on errors
+    """
+    midi_path, cache_dir = job
+    try:
+        with open(midi_path, 'rb') as f:
+            data = f.read()
+        cache_path = None
+        if cache_dir:
+            cache_path = os.path.join(cache_dir, hashlib.sha1(STATS_VERSION+data).hexdigest() + '.npz')
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as cached:
+                    return midi_path, {key: cached[key] for key in cached.files}, True, ''
+        stats = file_stats(data)
+        if cache_path:
+            partial_path = '{}.{}.tmp.npz'.format(cache_path[:-len('.npz')], os.getpid())
+            np.savez(partial_path, **stats)
+            os.rename(partial_path, cache_path)
+        return midi_path, stats, False, ''
+    except (IOError, ValueError, IndexError, KeyError, struct.error) as e:
+        return midi_path, None, False, repr(e)
+
+
+def corpus_stats(midi_paths, cache_dir=None, num_workers=None):
+    """
+    Statistics of many midi files, computed in a pool of worker processes.
+
+    Args:
+        midi_paths (list): Midi file names
+        cache_dir (str): Directory to cache per file statistics in, None for no caching
+        num_workers (int): Number of worker processes, defaults to the number of cores
+
+    Returns:
+        Tuple of (stats, num_cached, errors), errors a list of (midi_path, error)
+    """
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    num_workers = num_workers or multiprocessing.cpu_count()
+    jobs = [(midi_path, cache_dir) for midi_path in midi_paths]
+    stats = empty_stats()
+    num_cached = 0
+    errors = []
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        for midi_path, partial, cached, error in pool.imap_unordered(
+                stats_job, jobs, max(1, len(jobs)//(num_workers*8))):
+            if error:
+                errors.append((midi_path, error))
+                continue
+            merge_stats(stats, partial)
+            num_cached += cached
+    finally:
+        pool.close()
+        pool.join()
+    return stats, num_cached, errors
+
+
+def histogram_percentile(histogram, q, bin_width=1.):
+    """Lower edge of the bin holding the q-th percentile of a histogram."""
+    cumulative = np.cumsum(histogram)
+    if not cumulative[-1]:
+        return None
+    return np.searchsorted(cumulative, q/100.*cumulative[-1])*bin_width
+
+
+def summary(stats):
+    """Human readable summary of statistics."""
+    lines = ['{} files, {} notes, {:.1f} minutes'.format(int(stats['files']), int(stats['notes']),
+                                                          stats['seconds']/60.)]
+    if stats['notes']:
+        lines.append('inter-onset interval p10/p50/p90: {:.2f}/{:.2f}/{:.2f}s'.format(
+            *[histogram_percentile(stats['ioi'], q, IOI_BIN_WIDTH) for q in (10, 50, 90)]))
+        lines.append('pitch p10/p50/p90: {}/{}/{}'.format(
+            *[histogram_percentile(stats['pitch'], q) for q in (10, 50, 90)]))
+        lines.append('mean velocity: {:.1f}'.format(
+            np.dot(np.arange(128), stats['velocity'])/float(stats['velocity'].sum())))
+        sizes = stats['chord_size'][1:]
+        lines.append('chord sizes 1..{}: {}'.format(MAX_CHORD_SIZE, ' '.join(str(n) for n in sizes.tolist())))
+        lines.append('mean polyphony while playing: {:.2f}'.format(
+            np.dot(np.arange(1, MAX_POLYPHONY+1), stats['polyphony'][1:])/max(stats['polyphony'][1:].sum(), 1e-9)))
+    return '\n'.join(lines)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Note statistics of midi corpora')
+    parser.add_argument('-i', '--input_path', required=True, help='Midi file or directory of midi files')
+    parser.add_argument('-o', '--output', default=None, help='Optional npz file to store the statistics in')
+    parser.add_argument('-c', '--cache_dir', default='.corpus_stats_cache',
+                        help='Directory to cache per file statistics in')
+    parser.add_argument('-w', '--num_workers', type=int, default=None,
+                        help='Number of worker processes, defaults to the number of cores')
+    args = parser.parse_args()
+
+    start = time.time()
+    midi_paths = find_midi_files(args.input_path)
+    stats, num_cached, errors = corpus_stats(midi_paths, args.cache_dir, args.num_workers)
+    for midi_path, error in errors:
+        print ('{}: {}'.format(midi_path, error))
+    print (summary(stats))
+    print ('{} files in {:.2f}s, {} from cache, {} failed'.format(
+        len(midi_paths), time.time()-start, num_cached, len(errors)))
+    if args.output:
+        np.savez(args.output, **stats)
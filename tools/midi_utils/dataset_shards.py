@@ -0,0 +1,301 @@
+"""
+Sharded, indexed dataset of recorded takes.
+
+A recording session leaves a .json/.mid/.wav triplet per take (see
+midi_record.py). The builder decodes every take once and packs the note table
+of its midi file (see models/note_table.py) and the raw samples of its wav
+file into shard files of a bounded size, each block aligned so it can be
+memory mapped in place. Every shard ends with the metadata of its takes as
+json, including the tempo computed from the notes, and a fixed-size footer.
+A global manifest lists the shards and where every take lives in them.
+
+Loading a take maps its shard once and returns views into it, and an epoch
+visits the shards one after another, so reading a dataset streams a few
+large files instead of opening thousands of small ones.
+
+Example usage:
+
+python dataset_shards.py ../../data/datasets/recorded_data ../../data/datasets/recorded_shards
+
+"""
+import collections
+import json
+import os
+import sys
+
+import mido
+import numpy as np
+from scipy.io import wavfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models'))
+from duration_quantizer import largest_cluster_mean
+import note_table
+
+MAGIC = b'MELYSHD1'
+MANIFEST_FILE = 'manifest.json'
+ALIGNMENT = 64
+DEFAULT_SHARD_SIZE = 256 << 20
+FOOTER_DTYPE = np.dtype([
+    ('metadata_offset', '<u8'),
+    ('metadata_length', '<u8'),
+    ('magic', 'S8'),
+])
+
+
+def read_notes(midi_file):
+    """
+    Reads the notes of a midi file.
+
+    Returns:
+        Note table, see note_table.from_arrays
+    """
+    pitches, starts, ends, velocities, channels = [], [], [], [], []
+    held = {}
+    now = 0.
+    for msg in mido.MidiFile(midi_file):
+        now += msg.time
+        if msg.type == 'note_on' and msg.velocity > 0:
+            held[(msg.channel, msg.note)] = (now, msg.velocity)
+        elif msg.type in ('note_on', 'note_off') and (msg.channel, msg.note) in held:
+            start, velocity = held.pop((msg.channel, msg.note))
+            pitches.append(msg.note)
+            starts.append(start)
+            ends.append(now)
+            velocities.append(velocity)
+            channels.append(msg.channel)
+    # a take is a single track, so its channels tell its instruments apart
+    return note_table.from_arrays(pitches, starts, ends, velocities, channels)
+
+
+def compute_tempo(notes, n_diff_lengths=4):
+    """
+    Quarter note bpm of a take, taking the most common time between note
+    onsets as a quarter note like models/midi_to_lilypond.py does.
+
+    Returns:
+        bpm as an int, None if the take has too few distinct onsets
+    """
+    onsets = np.unique(notes['start'])
+    if len(onsets) < n_diff_lengths+1:
+        return None
+    return int(np.round(60./largest_cluster_mean(np.diff(onsets), n_diff_lengths)))
+
+
+def find_takes(input_dir):
+    """
+    Names of the takes of a recording directory, i.e. the base names of its
+    sidecar json files.
+    """
+    return sorted(os.path.splitext(filename)[0] for filename in os.listdir(input_dir)
+                  if filename.endswith('.json'))
+
+
+class ShardWriter():
+    def __init__(self, filename):
+        """
+        Writes the blocks of takes to a shard file, see build_dataset.
+
+        Args:
+            filename (str): Shard file name, overwritten if it exists
+
+        """
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.takes = []
+
+    def tell(self):
+        return self.file.tell()
+
+    def _write_block(self, array):
+        """Writes array at the next aligned offset and returns that offset."""
+        padding = -self.file.tell() % ALIGNMENT
+        self.file.write(b'\0'*padding)
+        offset = self.file.tell()
+        self.file.write(np.ascontiguousarray(array).tobytes())
+        return offset
+
+    def add(self, meta_data, notes, samples, sample_rate):
+        """
+        Appends a take.
+
+        Args:
+            meta_data (dict): Sidecar metadata of the take
+            notes (array): Note table
+            samples (array): Audio samples as stored in the wav file, may be empty
+            sample_rate (int): Audio sample rate
+
+        Returns:
+            Index entry of the take, the metadata extended by its location in the shard
+        """
+        samples = np.asarray(samples)
+        entry = collections.OrderedDict(meta_data)
+        entry['notes_offset'] = self._write_block(notes)
+        entry['num_notes'] = len(notes)
+        entry['audio_offset'] = self._write_block(samples)
+        entry['audio_dtype'] = samples.dtype.str
+        entry['audio_shape'] = list(samples.shape)
+        entry['sample_rate'] = sample_rate
+        self.takes.append(entry)
+        return entry
+
+    def close(self):
+        """Writes the metadata of all takes and the footer."""
+        metadata = json.dumps(self.takes).encode()
+        footer = np.zeros(1, dtype=FOOTER_DTYPE)
+        footer['metadata_offset'] = self.file.tell()
+        footer['metadata_length'] = len(metadata)
+        footer['magic'] = MAGIC
+        self.file.write(metadata)
+        self.file.write(footer.tobytes())
+        self.file.close()
+
+
+def build_dataset(input_dir, output_dir, shard_size=DEFAULT_SHARD_SIZE, verbose=True):
+    """
+    Packs the takes of a recording directory into shards.
+
+    Args:
+        input_dir (str): Directory of .json/.mid/.wav take triplets
+        output_dir (str): Directory to write the shards and the manifest to
+        shard_size (int): A new shard is started once a shard grows past this many bytes
+        verbose (bool): If True, prints one line per take
+
+    Returns:
+        Manifest as a dict
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    manifest = collections.OrderedDict([('shards', []), ('takes', [])])
+    writer = None
+    for take in find_takes(input_dir):
+        base_filename = os.path.join(input_dir, take)
+        with open(base_filename + '.json', 'r') as f:
+            meta_data = json.load(f, object_pairs_hook=collections.OrderedDict)
+        notes = read_notes(base_filename + '.mid') if os.path.exists(base_filename + '.mid') \
+            else np.zeros(0, dtype=note_table.NOTE_DTYPE)
+        if os.path.exists(base_filename + '.wav'):
+            sample_rate, samples = wavfile.read(base_filename + '.wav', mmap=True)
+        else:
+            sample_rate, samples = 0, np.zeros(0, dtype=np.int16)
+        meta_data['take'] = take
+        meta_data['tempo'] = compute_tempo(notes)
+
+        if writer is None or writer.tell() >= shard_size:
+            if writer is not None:
+                writer.close()
+            shard_name = 'shard-{:05d}.bin'.format(len(manifest['shards']))
+            writer = ShardWriter(os.path.join(output_dir, shard_name))
+            manifest['shards'].append(shard_name)
+        entry = writer.add(meta_data, notes, samples, sample_rate)
+        index_entry = collections.OrderedDict([('take', take), ('shard', len(manifest['shards'])-1)])
+        index_entry.update((key, entry[key]) for key in
+                           ('notes_offset', 'num_notes', 'audio_offset', 'audio_dtype', 'audio_shape', 'sample_rate'))
+        manifest['takes'].append(index_entry)
+        if verbose:
+            print ('{} -> {}: {} notes, {} samples, tempo {}'.format(
+                take, manifest['shards'][-1], len(notes), len(samples), meta_data['tempo']))
+    if writer is not None:
+        writer.close()
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        f.write(json.dumps(manifest, indent=4))
+    return manifest
+
+
+def read_shard_metadata(filename):
+    """Reads the metadata of all takes of a shard from its footer."""
+    with open(filename, 'rb') as f:
+        f.seek(-FOOTER_DTYPE.itemsize, os.SEEK_END)
+        footer = np.frombuffer(f.read(FOOTER_DTYPE.itemsize), dtype=FOOTER_DTYPE)[0]
+        if footer['magic'] != MAGIC:
+            raise ValueError("'{}' is not a dataset shard.".format(filename))
+        f.seek(int(footer['metadata_offset']))
+        return json.loads(f.read(int(footer['metadata_length'])).decode(),
+                          object_pairs_hook=collections.OrderedDict)
+
+
+Take = collections.namedtuple('Take', ['meta_data', 'notes', 'audio', 'sample_rate'])
+
+
+class ShardedDataset():
+    def __init__(self, dataset_dir):
+        """
+        Random access to a dataset written by build_dataset.
+
+        Shards are memory mapped the first time one of their takes is read,
+        the notes and audio of a take are views into the mapping.
+
+        Args:
+            dataset_dir (str): Directory holding the shards and the manifest
+
+        """
+        self.dataset_dir = dataset_dir
+        with open(os.path.join(dataset_dir, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self.index = {entry['take']: i for i, entry in enumerate(self.manifest['takes'])}
+        self._shards = {}
+        self._metadata = {}
+
+    def __len__(self):
+        return len(self.manifest['takes'])
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            filename = os.path.join(self.dataset_dir, self.manifest['shards'][shard])
+            self._shards[shard] = np.memmap(filename, dtype=np.uint8, mode='r')
+        return self._shards[shard]
+
+    def meta_data(self, i):
+        """Sidecar metadata of take i, with its computed tempo."""
+        shard = self.manifest['takes'][i]['shard']
+        if shard not in self._metadata:
+            metadata = read_shard_metadata(os.path.join(self.dataset_dir, self.manifest['shards'][shard]))
+            self._metadata[shard] = {entry['take']: entry for entry in metadata}
+        return self._metadata[shard][self.manifest['takes'][i]['take']]
+
+    def __getitem__(self, i):
+        """
+        Reads take i.
+
+        Returns:
+            Take of (meta_data, notes, audio, sample_rate), notes and audio are
+            read-only views into the shard
+        """
+        entry = self.manifest['takes'][i]
+        data = self._shard(entry['shard'])
+        notes_bytes = entry['num_notes']*note_table.NOTE_DTYPE.itemsize
+        notes = data[entry['notes_offset']:entry['notes_offset']+notes_bytes].view(note_table.NOTE_DTYPE)
+        audio_dtype = np.dtype(entry['audio_dtype'])
+        audio_bytes = int(np.prod(entry['audio_shape']))*audio_dtype.itemsize
+        audio = data[entry['audio_offset']:entry['audio_offset']+audio_bytes].view(audio_dtype) \
+            .reshape(entry['audio_shape'])
+        return Take(self.meta_data(i), notes, audio, entry['sample_rate'])
+
+    def find(self, take):
+        """Reads a take by its name."""
+        return self[self.index[take]]
+
+    def iter_epoch(self, seed=None):
+        """
+        Yields all takes in random order, one shard after another so only
+        one shard is read at a time.
+
+        Args:
+            seed (int): Seed of the shuffle, None for no shuffling
+
+        """
+        by_shard = collections.defaultdict(list)
+        for i, entry in enumerate(self.manifest['takes']):
+            by_shard[entry['shard']].append(i)
+        shards = sorted(by_shard)
+        if seed is not None:
+            random = np.random.RandomState(seed)
+            random.shuffle(shards)
+            for shard in shards:
+                random.shuffle(by_shard[shard])
+        for shard in shards:
+            for i in by_shard[shard]:
+                yield self[i]
+
+
+if __name__=='__main__':
+    build_dataset(sys.argv[1], sys.argv[2])
@@ -0,0 +1,192 @@
+"""
+Compact binary log of raw midi events.
+
+A log is an 8 byte magic header followed by fixed-width little-endian records
+of (status, data1, data2, timestamp), 11 bytes each, timestamps in seconds.
+Logs are read through a memory map, so opening one is instant regardless of
+its size and columns are NumPy views into the file. Pygame timestamps, in
+milliseconds, are converted to seconds on the way in.
+
+Example usage (convert a text log of pygame events):
+
+python event_log.py session.txt session.evl
+
+"""
+import ast
+import os
+import sys
+
+import numpy as np
+
+# version 1 logs held whatever unit their source used, version 2 holds seconds
+MAGIC = b'MELYEVT2'
+HEADER_SIZE = len(MAGIC)
+EVENT_DTYPE = np.dtype([
+    ('status', '<u1'),
+    ('data1', '<u1'),
+    ('data2', '<u1'),
+    ('timestamp', '<f8'),
+])
+PYGAME_TIME_UNIT = 1e-3  # seconds per pygame.midi timestamp
+
+
+# Length in bytes of the midi message starting with each status byte.
+MESSAGE_SIZES = np.ones(256, dtype=np.int64)
+MESSAGE_SIZES[0x80:0xF0] = 3
+MESSAGE_SIZES[0xC0:0xE0] = 2
+MESSAGE_SIZES[[0xF1, 0xF2, 0xF3]] = [2, 3, 2]
+
+
+def is_event_log(filename):
+    """Returns True if filename starts with the event log header."""
+    with open(filename, 'rb') as f:
+        return f.read(HEADER_SIZE) == MAGIC
+
+
+class EventLogWriter():
+    def __init__(self, filename, buffer_size=4096):
+        """
+        Appends events to a binary event log, creating it if needed.
+
+        A partially written last record, e.g. from a crashed session, is cut
+        off first, so the appended records stay aligned.
+
+        Args:
+            filename (str): Event log file name
+            buffer_size (int): Number of events buffered before writing to disk
+
+        Raises:
+            ValueError: If filename exists and is not an event log
+        """
+        size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        if size and not is_event_log(filename):
+            raise ValueError("'{}' is not a midi event log.".format(filename))
+        self.file = open(filename, 'ab')
+        if not size:
+            self.file.write(MAGIC)
+        elif (size-HEADER_SIZE) % EVENT_DTYPE.itemsize:
+            self.file.truncate(size - (size-HEADER_SIZE) % EVENT_DTYPE.itemsize)
+        self.buffer = np.zeros(buffer_size, dtype=EVENT_DTYPE)
+        self.size = 0
+
+    def write(self, status, data1, data2, timestamp):
+        """Appends a single event."""
+        self.buffer[self.size] = (status, data1, data2, timestamp)
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def write_array(self, events):
+        """Appends a structured array of EVENT_DTYPE."""
+        self.flush()
+        self.file.write(np.ascontiguousarray(events, dtype=EVENT_DTYPE).tobytes())
+
+    def write_pygame_events(self, events):
+        """
+        Appends events as returned by pygame.midi.Input.read.
+
+        Args:
+            events (list): List of [[status, data1, data2, data3], timestamp],
+                timestamps in milliseconds
+
+        """
+        for data, timestamp in events:
+            self.write(data[0], data[1], data[2], timestamp*PYGAME_TIME_UNIT)
+
+    def flush(self):
+        if self.size:
+            self.file.write(self.buffer[:self.size].tobytes())
+            self.size = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_event_log(filename):
+    """
+    Memory maps an event log.
+
+    A partially written last record, e.g. from a crashed session, is ignored.
+
+    Args:
+        filename (str): Event log file name
+
+    Returns:
+        Read-only structured array of EVENT_DTYPE backed by the file
+    """
+    if not is_event_log(filename):
+        raise ValueError("'{}' is not a midi event log.".format(filename))
+    num_events = (os.path.getsize(filename)-HEADER_SIZE)//EVENT_DTYPE.itemsize
+    if not num_events:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(filename, dtype=EVENT_DTYPE, mode='r', offset=HEADER_SIZE,
+                     shape=(num_events,))
+
+
+def iter_events(filename, chunk_size=65536):
+    """
+    Streams the events of a log as (status, data1, data2, timestamp) tuples.
+
+    Args:
+        filename (str): Event log file name
+        chunk_size (int): Number of events converted to Python objects at once
+
+    """
+    events = read_event_log(filename)
+    for start in range(0, len(events), chunk_size):
+        for event in events[start:start+chunk_size].tolist():
+            yield event
+
+
+def read_text_log(filename):
+    """
+    Parses a text log with one pygame event, [[status, data1, data2, data3], timestamp],
+    per line.
+
+    Returns:
+        Structured array of EVENT_DTYPE, timestamps converted to seconds
+    """
+    events = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data, timestamp = ast.literal_eval(line)
+            events.append((data[0], data[1], data[2], timestamp*PYGAME_TIME_UNIT))
+    return np.array(events, dtype=EVENT_DTYPE)
+
+
+def read_events(filename):
+    """Reads an event log, or a legacy text log, as a structured array of EVENT_DTYPE."""
+    if is_event_log(filename):
+        return read_event_log(filename)
+    return read_text_log(filename)
+
+
+def convert_text_log(text_filename, log_filename):
+    """
+    Converts a text log of pygame events to a binary event log.
+
+    Args:
+        text_filename (str): Text log file name
+        log_filename (str): Event log file name, overwritten if it exists
+
+    """
+    events = read_text_log(text_filename)
+    if os.path.exists(log_filename):
+        os.remove(log_filename)
+    with EventLogWriter(log_filename) as writer:
+        writer.write_array(events)
+
+
+if __name__=='__main__':
+    convert_text_log(sys.argv[1], sys.argv[2])
@@ -0,0 +1,182 @@
+"""
+Latency histograms and timestamped spans of the live loops.
+
+A LatencyTracer collects one Trace per answer of a session: the timestamps,
+on the time.perf_counter clock, at which the key press arrived, reached the
+event loop, closed its chord, was matched and got its verdict printed. When a
+trace finishes, the time between pairs of these marks is added to one
+histogram per span. Tracing is switched off by passing NULL_TRACER, whose
+traces ignore every mark.
+
+Example usage (summary of an exported session):
+
+python latency.py piano_game_latency.json
+
+"""
+import collections
+import json
+import sys
+import time
+
+import numpy as np
+
+# (span, start mark, end mark) of the piano_game loop
+GAME_SPANS = (
+    ('capture', 'key_press', 'received'),
+    ('chord_close', 'key_press', 'chord_closed'),
+    ('match', 'chord_closed', 'matched'),
+    ('feedback', 'matched', 'feedback_done'),
+    ('total', 'key_press', 'feedback_done'),
+)
+
+
+class LatencyStats():
+    def __init__(self, bin_width=1e-5, num_bins=10000):
+        """
+        Histogram of durations, cheap enough to update from a midi callback.
+
+        Args:
+            bin_width (float): Histogram resolution in seconds
+            num_bins (int): Number of bins, longer durations go to the last one
+
+        """
+        self.bin_width = bin_width
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.max = 0.
+        self.total = 0.
+        self.total_sq = 0.
+
+    def add(self, duration):
+        self.counts[min(int(duration/self.bin_width), len(self.counts)-1)] += 1
+        self.max = max(self.max, duration)
+        self.total += duration
+        self.total_sq += duration*duration
+
+    def summary(self):
+        """Returns count, mean, std (jitter), p50, p99 and max in seconds."""
+        count = int(self.counts.sum())
+        if not count:
+            return {'count': 0}
+        cumulative = np.cumsum(self.counts)
+        mean = self.total/count
+        percentile = lambda q: (np.searchsorted(cumulative, q*count)+1)*self.bin_width
+        return {
+            'count': count,
+            'mean': mean,
+            'std': max(self.total_sq/count-mean*mean, 0.)**0.5,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99),
+            'max': self.max,
+        }
+
+    def histogram(self):
+        """Bin width and the non-empty bins as [bin, count] pairs."""
+        bins = np.flatnonzero(self.counts)
+        return {
+            'bin_width': self.bin_width,
+            'bins': np.stack([bins, self.counts[bins]], axis=1).tolist(),
+        }
+
+
+class Trace():
+    __slots__ = ('labels', 'marks')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.marks = {}
+
+    def mark(self, event, timestamp=None):
+        """Records the time of event, now unless timestamp is given."""
+        self.marks[event] = time.perf_counter() if timestamp is None else timestamp
+
+
+class NullTrace():
+    __slots__ = ()
+
+    def mark(self, event, timestamp=None):
+        pass
+
+
+class LatencyTracer():
+    def __init__(self, spans=GAME_SPANS, bin_width=1e-5, num_bins=100000):
+        """
+        Latency histograms of a session, one per span.
+
+        Args:
+            spans (tuple): (span, start mark, end mark) triplets
+            bin_width (float): Histogram resolution in seconds
+            num_bins (int): Number of bins per histogram
+
+        """
+        self.spans = spans
+        self.stats = collections.OrderedDict((span, LatencyStats(bin_width, num_bins)) for span, _, _ in spans)
+        self.traces = []
+        self.origin = time.perf_counter()
+
+    def start(self, **labels):
+        """Starts a trace, labels (e.g. the port name) are exported with it."""
+        return Trace(labels)
+
+    def finish(self, trace):
+        """Adds the spans of a trace to the histograms. Spans missing a mark are left out."""
+        marks = trace.marks
+        for span, start, end in self.spans:
+            if start in marks and end in marks:
+                self.stats[span].add(max(marks[end]-marks[start], 0.))
+        self.traces.append(trace)
+
+    def summary(self):
+        return collections.OrderedDict((span, stats.summary()) for span, stats in self.stats.items())
+
+    def export(self, filename):
+        """
+        Writes the summaries, histograms and traces of the session as json.
+        Trace marks are seconds since the tracer was created.
+        """
+        traces = []
+        for trace in self.traces:
+            entry = collections.OrderedDict(sorted(trace.labels.items()))
+            entry.update(sorted(((event, timestamp-self.origin) for event, timestamp in trace.marks.items()),
+                                key=lambda item: item[1]))
+            traces.append(entry)
+        spans = collections.OrderedDict()
+        for span, start, end in self.spans:
+            spans[span] = collections.OrderedDict([('start', start), ('end', end)])
+            spans[span].update(sorted(self.stats[span].summary().items()))
+            spans[span].update(self.stats[span].histogram())
+        with open(filename, 'w') as f:
+            f.write(json.dumps(collections.OrderedDict([('spans', spans), ('traces', traces)]), indent=4))
+
+
+class NullTracer():
+    """Tracer of a session without tracing, every call is a no-op."""
+    def start(self, **labels):
+        return NULL_TRACE
+
+    def finish(self, trace):
+        pass
+
+    def summary(self):
+        return collections.OrderedDict()
+
+
+NULL_TRACE = NullTrace()
+NULL_TRACER = NullTracer()
+
+
+def format_summary(summary):
+    """One line per span with its p50, p99 and max in ms."""
+    lines = []
+    for span, stats in summary.items():
+        if not stats.get('count'):
+            lines.append('{:<12} no samples'.format(span))
+            continue
+        lines.append('{:<12} n={:<5} p50 {:8.2f}ms  p99 {:8.2f}ms  max {:8.2f}ms'.format(
+            span, stats['count'], stats['p50']*1e3, stats['p99']*1e3, stats['max']*1e3))
+    return '\n'.join(lines)
+
+
+if __name__=='__main__':
+    with open(sys.argv[1], 'r') as f:
+        spans = json.load(f, object_pairs_hook=collections.OrderedDict)['spans']
+    print (format_summary(spans))
@@ -1,5 +1,10 @@
-from sklearn.cluster import KMeans
-from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models'))
+from duration_quantizer import largest_cluster_mean
 
 def extract_deltas(note_seq):
   times = [note.start_time for note in note_seq.notes]
@@ -7,33 +12,11 @@ def extract_deltas(note_seq):
   deltas = [times[i+1]-times[i] for i in range(len(times)-1)]
   return deltas
 
-def find_largest_cluster_mean(cluster_to_deltas, cluster_to_size, n_clusters):
-  max_cl = 0
-  max_size = 0
-  for cl in xrange(0, n_clusters):
-    if cluster_to_size[cl] > max_size:
-      max_cl = cl
-      max_size = cluster_to_size[cl]
-  cl_mean = np.mean(cluster_to_deltas[max_cl])
-  return cl_mean
-  
 def find_note_lengths(note_seq, n_diff_lengths=4):
   
   deltas = np.array(extract_deltas(note_seq))
-  kmeans = KMeans(n_clusters=n_diff_lengths, random_state=0).fit(np.array(deltas).reshape(-1, 1))
-  cluster_to_deltas = defaultdict(list)
-  cluster_to_size = defaultdict(int)
-  for i in xrange(len(deltas)):
-    cl = kmeans.labels_[i]
-    cluster_to_deltas[cl].append(deltas[i])
-    cluster_to_size[cl] += 1
-  unit_len = find_largest_cluster_mean(cluster_to_deltas, cluster_to_size, n_diff_lengths)
-  note_lengths = []
-  
-  for d in deltas:
-    ratio = d/float(unit_len)
-    note_length = np.round(ratio * 2)
-    note_lengths.append(note_length)
+  unit_len = largest_cluster_mean(deltas, n_diff_lengths)
+  note_lengths = list(np.round(deltas/float(unit_len) * 2))
   note_lengths.append(unit_len * 2)
   
   return note_lengths
@@ -1,19 +1,74 @@
+"""
+Selects a working mido backend, imported for its side effect.
+
+Probing a backend means importing it and listing its ports, which is slow
+for the backends that are not installed. The first backend that works is
+remembered in a cache file, so later processes try it first and normally
+probe nothing else. MIDO_BACKEND, if set, is used without probing, e.g.
+MIDO_BACKEND=virtual_midi for the in-process ports of virtual_midi.py.
+
+"""
+import os
+
 import mido
 
 possible_backends = ['mido.backends.pygame', 'mido.backends.rtmidi', 'mido.backends.portmidi', 'mido.backends.rtmidi_python', 'mido.backends.amidi']
-found_backend = False
-for backend in possible_backends:
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'melydi', 'midi_backend')
+
+
+def works(backend):
+    """Selects backend and returns True if it can list its ports."""
     try:
         mido.set_backend(backend)
         mido.get_input_names()
-        found_backend = True
-        break
+        return True
     except:
+        return False
+
+
+def read_cached_backend():
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def write_cached_backend(backend):
+    try:
+        if not os.path.exists(os.path.dirname(CACHE_FILE)):
+            os.makedirs(os.path.dirname(CACHE_FILE))
+        with open(CACHE_FILE, 'w') as f:
+            f.write(backend)
+    except (IOError, OSError):
         pass
-if not found_backend:
-    raise Excetion("Error: could not find valid backend for mido.")
+
+
+def find_backend():
+    """
+    Selects the backend given by MIDO_BACKEND, the cached one, or the first
+    working one of possible_backends.
+
+    Returns:
+        Name of the selected backend
+    """
+    if os.environ.get('MIDO_BACKEND'):
+        mido.set_backend(os.environ['MIDO_BACKEND'])
+        return os.environ['MIDO_BACKEND']
+    cached = read_cached_backend()
+    if cached and works(cached):
+        return cached
+    for backend in possible_backends:
+        if backend != cached and works(backend):
+            write_cached_backend(backend)
+            return backend
+    raise ImportError("could not find valid backend for mido.")
+
+
+backend = find_backend()
 
 if __name__=='__main__':
+    print (backend)
     print (mido.get_input_names())
     import IPython as ipy
-    ipy.embed() 
+    ipy.embed()
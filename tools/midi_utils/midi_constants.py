@@ -1,3 +1,4 @@
 DELTA_T_MAX = 0.05 # see chord_recognition.key
 LETTER_NAMES = ['A', 'Bb', 'B', 'C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab']
-MIDI_OFFSET = 21
\ No newline at end of file
+MIDI_OFFSET = 21
+CHORD_BANK_FILE = 'data/chord_bank.chords' # see chord_store.py
@@ -1,4 +1,7 @@
-import pygame, pygame.midi, sys
+import sys
+import numpy as np
+from note_processing import chord_ranges
+import event_log
 
 def convert_pitch(midi_pitch):
     offset = 21
@@ -60,16 +63,15 @@ class Chord:
     def order(self):
         self.notes = sorted(self.notes)
 
+def read_note_events(filename):
+    """Reads the note events of an event log, or of a legacy text log."""
+    events = event_log.read_events(filename)
+    note_status = [status for status, event_type in MidiEvent.type_dict.items() if event_type=='note']
+    return events[np.isin(events['status'], note_status)]
+
 class MidiEventParser():
     def __init__(self, filename):
-        with open(filename, 'r') as f:
-            lines = f.readlines()
-        self.events = []
-        for line in lines:
-            event_data = eval(line)
-            event = MidiEvent(event_data)
-            if event.type == 'note':
-                self.events.append(event)
+        self.events = read_note_events(filename)
         self.index = 0
 
     def __iter__(self):
@@ -79,47 +81,41 @@ class MidiEventParser():
         if self.index==len(self.events):
             raise StopIteration
         else:
-            event = self.events[self.index]
-            tick = event.time
-            velocity = event.data[2]
-            octave, letter_name = convert_pitch(event.data[1])
+            _, note, velocity, tick = self.events[self.index].tolist()
+            octave, letter_name = convert_pitch(note)
             pitch = letter_name+'_'+str(octave)
             self.index += 1
             return tick, velocity, pitch
 
+    __next__ = next
+
 class MidiChordsParser():
     def __init__(self, filename):
-        with open(filename, 'r') as f:
-            lines = f.readlines()
-        self.note_events = []
-        for line in lines:
-            event_data = eval(line)
-            t = MidiEvent(event_data).type
-            if t=='note':
-                self.note_events.append(NoteEvent(event_data))
-        self.index = 0
+        self.note_events = read_note_events(filename)
         self.num_notes = len(self.note_events)
+        # chord must be a combination of notes within 600 ms of its first note
+        times = self.note_events['timestamp']
+        self.chord_starts, self.chord_ends = chord_ranges(times, 0.6, min_size=1, anchored=True)
+        self.index = 0
 
     def __iter__(self):
         return self
 
     def next(self):
+        if self.index==len(self.chord_starts):
+            raise StopIteration
         chord = self.find_next_chord()
         chord.order()
-        if not chord:
-            raise StopIteration
-        else:
-            return chord
+        return chord
+
+    __next__ = next
 
     def find_next_chord(self):
-        curr_time = self.note_events[self.index].time
-        new_i = self.index+1
-        # chord mush be a combination of notes within 600 ms of each other
-        while new_i<self.num_notes and self.note_events[new_i].time<curr_time+600:
-            new_i += 1
-        notes = [self.note_events[i] for i in range(self.index, new_i)]
-        self.index = new_i
-        return Chord(notes)
+        start, end = self.chord_starts[self.index], self.chord_ends[self.index]
+        self.index += 1
+        note_events = [NoteEvent(([status, data1, data2], timestamp))
+                       for status, data1, data2, timestamp in self.note_events[start:end].tolist()]
+        return Chord(note_events)
 
 if __name__=='__main__':
     parser = MidiChordsParser(sys.argv[1])
@@ -10,32 +10,164 @@ python midi_record.py \
 
 """
 import sys, os, mido, time, pickle
+import struct
 import uuid
 import argparse
 import subprocess
 import signal
-import midi_backends
+import threading
 import datetime
 import json
+import numpy as np
+import event_log
+import render_queue
+from latency import LatencyStats
+
+
+TICKS_PER_BEAT = 480 # mido.MidiFile default
+TICKS_PER_SECOND = 256
+
+
+def seconds_to_ticks(times):
+    """
+    Vectorized mido.second2tick(time, TICKS_PER_SECOND, tempo) for all times.
+
+    Rounds to the nearest tick, halves to even, like the round() of mido 1.3
+    (older versions truncated).
+    """
+    tempo = mido.bpm2tempo(TICKS_PER_SECOND)
+    scale = tempo * 1e-6 / TICKS_PER_SECOND
+    return np.round(np.asarray(times, dtype=np.float64) / scale).astype(np.int64)
+
+
+def encode_track_events(deltas, status, data1, data2):
+    """
+    Serializes channel and system common messages into the body of a midi track.
+
+    Args:
+        deltas (array): Delta time of every message in ticks
+        status (array): Status byte of every message
+        data1 (array): First data byte of every message
+        data2 (array): Second data byte of every message
+
+    Returns:
+        uint8 array of variable length delta times and message bytes, using
+        running status like mido does
+    """
+    deltas = np.asarray(deltas, dtype=np.int64)
+    status = np.asarray(status, dtype=np.int64)
+    if (deltas < 0).any():
+        raise ValueError('message time must be non-negative in MIDI file')
+    delta_sizes = 1 + (deltas >= 1<<7) + (deltas >= 1<<14) + (deltas >= 1<<21)
+    message_sizes = event_log.MESSAGE_SIZES[status]
+    previous = np.r_[-1, status][:-1]
+    running = (status < 0xF0) & (status == previous)
+    sizes = delta_sizes + message_sizes - running
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    data = np.zeros(ends[-1] if len(ends) else 0, dtype=np.uint8)
+
+    # variable length quantity, most significant group first
+    for group in range(4):
+        has_group = delta_sizes > group
+        shift = 7*(delta_sizes[has_group]-1-group)
+        byte = (deltas[has_group] >> shift) & 0x7F
+        byte[shift > 0] |= 0x80
+        data[starts[has_group]+group] = byte
+    message_starts = starts + delta_sizes
+    data[message_starts[~running]] = status[~running]
+    data_starts = message_starts + 1 - running
+    has_data1 = message_sizes > 1
+    data[data_starts[has_data1]] = np.asarray(data1)[has_data1]
+    has_data2 = message_sizes > 2
+    data[data_starts[has_data2]+1] = np.asarray(data2)[has_data2]
+    return data
+
+
+def write_events(events, output_file):
+    """
+    Writes raw midi events, e.g. an event log or ring buffer contents, to a
+    single track midi file.
+
+    Realtime messages, which midi files cannot hold, are left out.
+
+    Args:
+        events (array): Structured array of event_log.EVENT_DTYPE, timestamps in seconds
+        output_file (str): Midi output file name
+
+    """
+    events = events[events['status'] < 0xF8]
+    ticks = seconds_to_ticks(events['timestamp'])
+    deltas = np.diff(ticks, prepend=0)
+    track = encode_track_events(deltas, events['status'], events['data1'], events['data2'])
+    end_of_track = np.array([0x00, 0xFF, 0x2F, 0x00], dtype=np.uint8)
+    with open(output_file, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>Lhhh', 6, 1, 1, TICKS_PER_BEAT))
+        f.write(b'MTrk' + struct.pack('>L', len(track)+len(end_of_track)))
+        f.write(track.tobytes())
+        f.write(end_of_track.tobytes())
 
 
 def write_output(messages, times, output_file):
     """Writes messages and times to a midi file."""
-    ticks_per_second = 256
-    tempo = mido.bpm2tempo(ticks_per_second)
-    ticks = [int(mido.second2tick(time, ticks_per_second, tempo)) for time in times]
-    with open(output_file, 'w') as f:
-        mid = mido.MidiFile()
-        track = mido.MidiTrack()
-        mid.tracks.append(track)
-        # track.append(mido.MetaMessage('set_tempo', tempo=tempo))
-        last_tick = 0
-        for (tick, message) in zip(ticks, messages):
-            m = message.copy()
-            m.time = tick-last_tick
-            last_tick = tick
-            track.append(m)
-        mid.save(output_file)
+    events = np.zeros(len(messages), dtype=event_log.EVENT_DTYPE)
+    for i, message in enumerate(messages):
+        message_bytes = message.bytes()
+        if message.is_meta or len(message_bytes) > 3:
+            return _write_output_mido(messages, times, output_file)
+        events[i] = tuple(message_bytes + [0]*(3-len(message_bytes))) + (times[i],)
+    write_events(events, output_file)
+
+
+def _write_output_mido(messages, times, output_file):
+    """Writes messages and times to a midi file through mido, for sysex and meta messages."""
+    ticks = seconds_to_ticks(times).tolist()
+    mid = mido.MidiFile()
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    last_tick = 0
+    for (tick, message) in zip(ticks, messages):
+        track.append(message.copy(time=tick-last_tick))
+        last_tick = tick
+    mid.save(output_file)
+
+class EventRingBuffer():
+    def __init__(self, capacity):
+        """
+        Preallocated single-producer single-consumer buffer of raw midi events.
+
+        Args:
+            capacity (int): Maximum number of events waiting to be flushed
+
+        """
+        self.events = np.zeros(capacity, dtype=event_log.EVENT_DTYPE)
+        self.capacity = capacity
+        self.written = 0
+        self.read = 0
+        self.dropped = 0
+
+    def push(self, status, data1, data2, timestamp):
+        """Stores an event, or drops it if the consumer fell a full buffer behind."""
+        if self.written-self.read >= self.capacity:
+            self.dropped += 1
+            return
+        self.events[self.written % self.capacity] = (status, data1, data2, timestamp)
+        # publish the slot only once it is filled
+        self.written += 1
+
+    def pop(self):
+        """Returns a copy of all events stored since the last pop, in order."""
+        written = self.written
+        start, end = self.read % self.capacity, written % self.capacity
+        if written-self.read == 0:
+            events = self.events[:0].copy()
+        elif start < end:
+            events = self.events[start:end].copy()
+        else:
+            events = np.concatenate([self.events[start:], self.events[:end]])
+        self.read = written
+        return events
+
 
 class MidiRecorder():
     def __init__(self, midi_input='Digital Piano'):
@@ -47,6 +179,9 @@ class MidiRecorder():
             midi_input (str): input filename or port name
         
         """
+        # selects a working mido backend, only needed to open ports, so the
+        # file writing functions of this module import without midi hardware
+        import midi_backends
         self.input = midi_input
         self.messages = []
         self.times = []
@@ -67,6 +202,96 @@ class MidiRecorder():
         except KeyboardInterrupt:
             inport.close()
 
+    def record_streaming(self, log_file, capacity=1<<16, flush_interval=0.25, monitor_interval=2.):
+        """
+        Record midi events until a keyboard interrupt, streaming them to an
+        event log on disk.
+
+        Messages are captured in the backend's callback with a monotonic clock
+        into a preallocated ring buffer. A background thread appends them to
+        log_file, which stays a valid event log while it grows, so a crash only
+        loses the last flush_interval. The console shows a status line every
+        monitor_interval instead of every message.
+
+        callback_duration is the time spent inside the callback per message,
+        i.e. how long capturing holds up the backend's thread. It does not
+        include the time between the key press and the callback, which the
+        backend does not report. flush_lag is the age of the oldest event of
+        each write when it reaches the disk.
+
+        Args:
+            log_file (str): Event log file name, see event_log.py
+            capacity (int): Ring buffer size in events
+            flush_interval (float): Seconds between writes to disk
+            monitor_interval (float): Seconds between status lines
+
+        Returns:
+            Dict of capture and flush statistics
+        """
+        buffer = EventRingBuffer(capacity)
+        callback_duration = LatencyStats()
+        flush_lag = LatencyStats(bin_width=1e-3, num_bins=10000)
+        skipped = [0]
+        stop = threading.Event()
+        start_time = time.perf_counter()
+
+        def capture(msg):
+            now = time.perf_counter()
+            data = msg.bytes()
+            if len(data) > 3:
+                # sysex does not fit the fixed width log
+                skipped[0] += 1
+                return
+            data += [0]*(3-len(data))
+            buffer.push(data[0], data[1], data[2], now-start_time)
+            callback_duration.add(time.perf_counter()-now)
+
+        writer = event_log.EventLogWriter(log_file)
+
+        def flush():
+            events = buffer.pop()
+            if len(events):
+                writer.write_array(events)
+                writer.flush()
+                os.fsync(writer.file.fileno())
+                flush_lag.add(time.perf_counter()-start_time-events['timestamp'][0])
+
+        def flush_loop():
+            while not stop.wait(flush_interval):
+                flush()
+
+        flusher = threading.Thread(target=flush_loop)
+        flusher.daemon = True
+        flusher.start()
+        inport = mido.open_input(self.input, callback=capture)
+        print ("Midi recording started")
+        try:
+            while True:
+                time.sleep(monitor_interval)
+                print ("{:.0f}s: {} events, {} dropped".format(
+                    time.perf_counter()-start_time, buffer.written, buffer.dropped))
+        except KeyboardInterrupt:
+            inport.close()
+        stop.set()
+        flusher.join()
+        flush()
+        writer.close()
+
+        stats = {
+            'events': buffer.written,
+            'dropped': buffer.dropped,
+            'skipped': skipped[0],
+            'callback_duration': callback_duration.summary(),
+            'flush_lag': flush_lag.summary(),
+        }
+        print ("Midi recording stopped: {events} events, {dropped} dropped, {skipped} skipped".format(**stats))
+        for name in ['callback_duration', 'flush_lag']:
+            summary = stats[name]
+            if summary['count']:
+                print ("{}: p50 {:.3f}ms, p99 {:.3f}ms, max {:.3f}ms, jitter {:.3f}ms".format(
+                    name, 1e3*summary['p50'], 1e3*summary['p99'], 1e3*summary['max'], 1e3*summary['std']))
+        return stats
+
     def write_output(self, midi_output):
         """
         Write midi messages to a midi file.
@@ -90,6 +315,8 @@ if __name__=='__main__':
             help='Path to directory where soundfonts are saved')
     parser.add_argument('-sfn', '--soundfont_name', type=str, default='general_user_v1.471', \
             help='Soundfont name without file ending, e.g. general_user_v1.471')
+    parser.add_argument('-st', '--stream', action='store_true', \
+            help='If set, streams the recording to an event log while recording')
     parser.add_argument('-ins', '--instrument', type=str, required=True, help='Instrument type, e.g. piano or violin')
     parser.add_argument('-mt', '--music_type', type=str, required=True, help='Music type, e.g. melody or harmony')
     args = parser.parse_args()
@@ -97,25 +324,24 @@ if __name__=='__main__':
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    recorder = MidiRecorder(midi_input=args.midi_input)
-    if args.record_audio:
-        subprocess.Popen(['sox', '-d', '{}.wav'.format(args.filename)])
-    recorder.record()
-
     file_uuid = str(uuid.uuid4())
     base_filename = '{}_{}'.format(args.filename_prefix, file_uuid)
 
+    recorder = MidiRecorder(midi_input=args.midi_input)
+    if args.record_audio:
+        subprocess.Popen(['sox', '-d', '{}.wav'.format(os.path.join(args.output_dir, base_filename))])
+    if args.stream:
+        log_file_path = os.path.join(args.output_dir, '{}.evl'.format(base_filename))
+        recorder.record_streaming(log_file_path)
+    else:
+        recorder.record()
 
     midi_filename = '{}.mid'.format(base_filename)
     midi_file_path = os.path.join(args.output_dir, midi_filename)
-    recorder.write_output(midi_file_path)
-
-    if args.synthesize:
-        synth_filename = '{}_synth_{}.wav'.format(base_filename, args.soundfont_name)
-        synth_file_path = os.path.join(args.output_dir, synth_filename)
-        soundfont_path = os.path.join(args.soundfonts_dir, '{}.sf2'.format(args.soundfont_name))
-        print (soundfont_path)
-        subprocess.call(['fluidsynth', '-ni', soundfont_path, midi_file_path, '-F', synth_file_path, '-r', '44100'])
+    if args.stream:
+        write_events(event_log.read_event_log(log_file_path), midi_file_path)
+    else:
+        recorder.write_output(midi_file_path)
 
     meta_data = {}
     print(datetime.datetime.now())
@@ -125,11 +351,13 @@ if __name__=='__main__':
     meta_data['instrument'] = args.instrument
     meta_data['music_type'] = args.music_type
     meta_data['tempo'] = '<>'
-    meta_data['synthetic_versions'] = [args.soundfont_name]
+    meta_data['synthetic_versions'] = [] # filled in by render_queue
 
     with open('{}.json'.format(os.path.join(args.output_dir, base_filename)), 'w') as file:
      file.write(json.dumps(meta_data, indent=4)) 
 
-
-
-
+    if args.synthesize:
+        soundfont_path = os.path.join(args.soundfonts_dir, '{}.sf2'.format(args.soundfont_name))
+        print (soundfont_path)
+        render_queue.render_batch(render_queue.make_jobs([midi_file_path], [soundfont_path]),
+                                  os.path.join(args.output_dir, '.render_cache'))
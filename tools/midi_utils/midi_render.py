@@ -1,11 +1,301 @@
-import mido, midi_backends
+"""
+Plays midi files on midi output ports.
 
-def play(midi_filename):
-    outport = mido.open_output('Digital Piano')
-    for msg in mido.MidiFile(midi_filename).play():
-        outport.send(msg)
-    outport.close()
+Every file is turned into absolute send times once, before playback starts.
+A single player thread serves any number of files and ports from a heap of
+their next send times, sleeping until shortly before the next one is due
+(the lookahead) and spinning on the monotonic perf_counter clock for the
+rest. Send times are never derived from the previous send, so sleep errors
+do not add up the way they do with mido.MidiFile.play(); if the player falls
+far behind (e.g. the machine was suspended) a playback is shifted instead of
+rushing through the missed messages. The lateness of every send is
+collected in a histogram.
+
+Example usage (two files on two ports, the first looped at 1.5 times the speed):
+
+python midi_render.py -f left.mid right.mid -p 'Digital Piano' 'Synth' -l 0 -t 1.5 1
+
+"""
+import argparse
+import heapq
+import os
+import threading
+import time
+
+import mido
+import numpy as np
+
+from latency import LatencyStats
+
+DEFAULT_PORT = 'Digital Piano'
+LOOKAHEAD = 0.002  # seconds spent spinning before each send
+PREROLL = 0.05  # seconds between starting the player and the first send
+RESYNC_LATENESS = 0.1  # later than this, a playback is shifted instead of catching up
+
+
+def read_schedule(midi_filename):
+    """
+    Reads the messages of a midi file with their absolute times.
+
+    Returns:
+        Tuple of (messages, times, length), times in seconds following the
+        tempo changes of the file, length the time of its last event
+        including meta events
+    """
+    messages = []
+    times = []
+    now = 0.
+    for msg in mido.MidiFile(midi_filename):
+        now += msg.time
+        if not msg.is_meta:
+            messages.append(msg)
+            times.append(now)
+    return messages, np.array(times, dtype=np.float64), now
+
+
+def open_port(port_string):
+    # selects a working mido backend, only needed for real ports
+    import midi_backends
+    return mido.open_output(port_string)
+
+
+class Playback():
+    def __init__(self, port, messages, times, length=None, loop=False, tempo_scale=1., name=''):
+        """
+        One file playing on one port.
+
+        Args:
+            port: Output port, anything with a send method
+            messages (list): Messages to send
+            times (array): Send times of messages in seconds, sorted
+            length (float): Loop length in seconds, defaults to the last send time
+            loop (bool): If True, starts over after length seconds until stopped
+            tempo_scale (float): Speed factor, 2 plays twice as fast
+            name (str): Name in reports
+
+        """
+        if tempo_scale <= 0:
+            raise ValueError('tempo_scale must be positive, got {}'.format(tempo_scale))
+        self.port = port
+        self.messages = messages
+        self.name = name
+        self.loop = loop and len(messages) > 0
+        # absolute times in the playback's own clock, scaled once
+        self.times = np.asarray(times, dtype=np.float64)/tempo_scale
+        last_time = self.times[-1] if len(self.times) else 0.
+        self.length = last_time if length is None else max(length/tempo_scale, last_time)
+        self.start = 0.
+        self.index = 0
+        self.num_sent = 0
+        self.num_resyncs = 0
+
+    def next_time(self):
+        """Send time of the next message on the player clock, None when done."""
+        if self.index == len(self.messages):
+            if not self.loop or self.length <= 0:
+                return None
+            self.index = 0
+            self.start += self.length
+        return self.start + self.times[self.index]
+
+    def pop_due(self, now):
+        """Returns the messages due at now, in order, and advances past them."""
+        due = []
+        while True:
+            send_time = self.next_time()
+            if send_time is None or send_time > now:
+                return due
+            due.append(self.messages[self.index])
+            self.index += 1
+
+    def shift(self, seconds):
+        """Delays the rest of the playback."""
+        self.start += seconds
+        self.num_resyncs += 1
+
+
+class Player():
+    def __init__(self, lookahead=LOOKAHEAD, resync_lateness=RESYNC_LATENESS, realtime=False):
+        """
+        Plays any number of Playbacks at once from a single thread.
+
+        Args:
+            lookahead (float): Seconds before each send to stop sleeping and
+                spin, more than the sleep overshoot of the system
+            resync_lateness (float): A playback later than this is shifted
+                instead of sending its missed messages in a burst
+            realtime (bool): If True, asks for realtime scheduling of the
+                player thread, so busy processes cannot delay sends by a
+                time slice. Needs the privileges to do so, ignored otherwise.
+
+        """
+        self.lookahead = lookahead
+        self.resync_lateness = resync_lateness
+        self.realtime = realtime
+        self.playbacks = []
+        self.timing_error = LatencyStats(bin_width=1e-5, num_bins=100000)
+        self._ports = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, playback):
+        self.playbacks.append(playback)
+        return playback
+
+    def add_file(self, midi_filename, port=DEFAULT_PORT, loop=False, tempo_scale=1.):
+        """
+        Adds a midi file.
+
+        Args:
+            midi_filename (str): Midi file name
+            port: Output port, or the name of one to open. Ports opened by
+                name are shared between files and closed by the player.
+            loop (bool): If True, plays the file over and over until stopped
+            tempo_scale (float): Speed factor, 2 plays twice as fast
+
+        """
+        if isinstance(port, str):
+            if port not in self._ports:
+                self._ports[port] = open_port(port)
+            port = self._ports[port]
+        messages, times, length = read_schedule(midi_filename)
+        return self.add(Playback(port, messages, times, length, loop, tempo_scale, midi_filename))
+
+    def _wait_until(self, deadline):
+        """Sleeps until lookahead before deadline, then spins. Returns False if stopped."""
+        remaining = deadline-time.perf_counter()-self.lookahead
+        if remaining > 0 and self._stop.wait(remaining):
+            return False
+        while time.perf_counter() < deadline:
+            pass
+        return not self._stop.is_set()
+
+    def _set_realtime(self):
+        """Realtime scheduling of the calling thread, returns True on success."""
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+            return True
+        except (AttributeError, OSError):
+            return False
+
+    def run(self, duration=None):
+        """
+        Plays all playbacks from their beginning until they are done,
+        duration seconds have passed, or stop is called.
+        """
+        if self.realtime:
+            self._set_realtime()
+        start = time.perf_counter()+PREROLL
+        end = start+duration if duration is not None else float('inf')
+        heap = []
+        for i, playback in enumerate(self.playbacks):
+            playback.start = start
+            playback.index = 0
+            send_time = playback.next_time()
+            if send_time is not None:
+                heap.append((send_time, i))
+        heapq.heapify(heap)
+        try:
+            while heap:
+                send_time, i = heap[0]
+                if send_time > end or not self._wait_until(send_time):
+                    break
+                playback = self.playbacks[i]
+                now = time.perf_counter()
+                lateness = now-send_time
+                if lateness > self.resync_lateness:
+                    playback.shift(lateness)
+                    heapq.heapreplace(heap, (playback.next_time(), i))
+                    continue
+                port = playback.port
+                for msg in playback.pop_due(now):
+                    port.send(msg)
+                    playback.num_sent += 1
+                self.timing_error.add(lateness)
+                next_time = playback.next_time()
+                if next_time is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (next_time, i))
+        finally:
+            self._silence()
+
+    def _silence(self):
+        """Stops all sounding notes, and closes the ports opened by name."""
+        for port in set(playback.port for playback in self.playbacks):
+            if hasattr(port, 'reset'):
+                port.reset()
+        for port in self._ports.values():
+            port.close()
+        self._ports = {}
+
+    def start(self, duration=None):
+        """Plays in a background thread, see run."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(duration,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.join()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        """Timing error summary in seconds, and the sends and resyncs of every playback."""
+        return {
+            'timing_error': self.timing_error.summary(),
+            'playbacks': [{'name': playback.name, 'sent': playback.num_sent, 'resyncs': playback.num_resyncs}
+                          for playback in self.playbacks],
+        }
+
+
+def play(midi_filename, port_string=DEFAULT_PORT, loop=False, tempo_scale=1.):
+    """Plays a midi file, blocking until it is done."""
+    player = Player()
+    player.add_file(midi_filename, port_string, loop, tempo_scale)
+    player.run()
+    return player.report()
 
 
 if __name__=='__main__':
-    play('test.mid')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Play midi files on midi output ports')
+    parser.add_argument('-f', '--midi_files', nargs='+', default=['test.mid'], help='Midi files to play at once')
+    parser.add_argument('-p', '--ports', nargs='+', default=[DEFAULT_PORT],
+                        help='One output port for all files, or one per file')
+    parser.add_argument('-l', '--loop', type=int, nargs='+', default=[0],
+                        help='1 to loop a file, one value for all files or one per file')
+    parser.add_argument('-t', '--tempo_scale', type=float, nargs='+', default=[1.],
+                        help='Speed factor, one value for all files or one per file')
+    parser.add_argument('-d', '--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('-r', '--realtime', action='store_true',
+                        help='Ask for realtime scheduling, for exact timing on busy machines')
+    args = parser.parse_args()
+    for name in ('ports', 'loop', 'tempo_scale'):
+        if len(getattr(args, name)) not in (1, len(args.midi_files)):
+            parser.error('--{} takes one value for all files or one per file, got {} for {} files'.format(
+                name, len(getattr(args, name)), len(args.midi_files)))
+    if any(tempo_scale <= 0 for tempo_scale in args.tempo_scale):
+        parser.error('--tempo_scale must be positive')
+
+    per_file = lambda values: values*len(args.midi_files) if len(values) == 1 else values
+    player = Player(realtime=args.realtime)
+    for midi_file, port, loop, tempo_scale in zip(args.midi_files, per_file(args.ports),
+                                                  per_file(args.loop), per_file(args.tempo_scale)):
+        player.add_file(midi_file, port, bool(loop), tempo_scale)
+    player.start(args.duration)
+    try:
+        player.join()
+    except KeyboardInterrupt:
+        player.stop()
+    report = player.report()
+    error = report['timing_error']
+    if error['count']:
+        print ('{} sends, timing error mean {:.3f}ms p50 {:.3f}ms p99 {:.3f}ms max {:.3f}ms'.format(
+            error['count'], error['mean']*1e3, error['p50']*1e3, error['p99']*1e3, error['max']*1e3))
+    for playback in report['playbacks']:
+        print ('{}: {} sends, {} resyncs'.format(playback['name'], playback['sent'], playback['resyncs']))
@@ -1,6 +1,5 @@
 import mido, pickle, time
 import numpy as np
-from midi_read import MidiReader
 from midi_constants import *
 
 def convert_pitch(midi_pitch):
@@ -15,25 +14,62 @@ def get_note_on_events(messages, times):
     note_on_indices = [i for i in range(len(times)) if is_note_on(messages[i])]
     return zip(*[(messages[i], times[i]) for i in note_on_indices])
 
-def get_chords(messages, times):
-    m, t = get_note_on_events(messages, times)
-    t = np.array(t)
-    diffs = t[1:]-t[:-1]
-    simultaneous = diffs<DELTA_T_MAX
-    chord_start_indices = [i for i in range(1, len(simultaneous)) if (simultaneous[i] and not simultaneous[i-1])]
-    chords = []
-    for start in chord_start_indices:
-        chord = []
+def chord_ranges(times, max_delta=DELTA_T_MAX, min_size=2, anchored=False):
+    """
+    Groups sorted onset times into chords.
+
+    Args:
+        times (array): Sorted onset times
+        max_delta (float): Without anchored, consecutive onsets closer than
+            max_delta belong to the same chord. With anchored, a chord holds
+            all onsets earlier than its first onset plus max_delta.
+        min_size (int): Groups with fewer onsets are not returned
+        anchored (bool): See max_delta
+
+    Returns:
+        Tuple of (starts, ends) index arrays, chord k is times[starts[k]:ends[k]]
+    """
+    times = np.asarray(times)
+    n = times.size
+    if not n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if anchored:
+        # next_start[i] is where a chord starting at onset i would end, the
+        # loop only visits the onsets that actually start a chord
+        next_start = np.searchsorted(times, times+max_delta, side='left')
+        next_start = np.maximum(next_start, np.arange(1, n+1))
+        starts = []
         i = 0
-        while simultaneous[start+i]:
-            chord.append(m[start+i])
-            i += 1
-            if start+i>=len(simultaneous):
-                break
-        chord.append(m[start+i])
-        chords.append(chord)
-    return chords
+        while i < n:
+            starts.append(i)
+            i = next_start[i]
+        starts = np.array(starts, dtype=np.int64)
+    else:
+        starts = np.flatnonzero(np.r_[True, np.diff(times) >= max_delta])
+    ends = np.r_[starts[1:], n]
+    keep = ends-starts >= min_size
+    return starts[keep], ends[keep]
 
-def print_chord(chord):
+def get_chord_indices(messages, times):
+    """
+    Finds the chords in a recording.
+
+    Returns:
+        Tuple of (note_on_indices, starts, ends), chord k consists of
+        messages[note_on_indices[starts[k]:ends[k]]]
+    """
+    note_on = np.fromiter((is_note_on(m) for m in messages), dtype=bool, count=len(messages))
+    note_on_indices = np.flatnonzero(note_on)
+    starts, ends = chord_ranges(np.asarray(times, dtype=np.float64)[note_on_indices])
+    return note_on_indices, starts, ends
+
+def get_chords(messages, times):
+    note_on_indices, starts, ends = get_chord_indices(messages, times)
+    return [[messages[i] for i in note_on_indices[start:end]] for start, end in zip(starts, ends)]
+
+def chord_string(chord):
     notes = [convert_pitch(note) for note in sorted([n.note for n in chord])]
-    print (', '.join([note[1]+str(note[0]) for note in notes]))
+    return ', '.join([note[1]+str(note[0]) for note in notes])
+
+def print_chord(chord):
+    print (chord_string(chord))
@@ -1,88 +1,88 @@
-import mido, pickle, time, os
+import asyncio
 import numpy as np
-from midi_read import MidiReader
 from midi_constants import *
 import note_processing
+import chord_store
+from async_midi import AsyncMidiPort
 
-def play_chord(chord, ioport):
-    ioport.reset()
-    off_events = [mido.Message('note_off', note=note.note) for note in chord]
-    for note in chord:
-        ioport.send(note)
-    time.sleep(3)
-    for note_off in off_events:
-        ioport.send(note_off)
-
-def read_chord(ioport):
-    # flush the port
-    while ioport.poll():
-        pass
-    chord = []
-    for msg in ioport:
-        if not chord:
-            chord_start = time.time()
-        delta_t = time.time()-chord_start
-        if delta_t>DELTA_T_MAX:
-            break
-        else:
-            chord.append(msg)
-    return chord
-
-def debug_io(port_string):
+def open_port(port_string):
+    """Opens an AsyncMidiPort, exits with a message if there is no such port."""
     try:
-        port = mido.open_ioport(port_string)
+        return AsyncMidiPort(port_string)
     except:
         print("'{}' is not a valid port. Please change the midi port.".format(port_string))
         exit(1)
-    while True:
-        print("Please play a chord.")
-        chord = read_chord(port)
-        print("Your chord:")
-        note_processing.print_chord(chord)
-        print("Num notes:")
-        print(len(chord))
 
+def run_until_interrupted(coroutine):
+    """
+    Runs coroutine in a new event loop until it returns or the user presses
+    Ctrl-C. Either way its finally blocks run, so it can close its ports.
+    """
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(coroutine)
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+    finally:
+        loop.close()
 
-def save_chords_interactively(port_string, save_file):
+async def print_chords_played(port_string):
+    port = open_port(port_string)
     try:
-        port = mido.open_ioport(port_string)
-    except:
-        print("'{}' is not a valid port. Please change the midi port.".format(port_string))
-        exit(1)
+        while True:
+            print("Please play a chord.")
+            chord = await port.read_chord()
+            print("Your chord:")
+            note_processing.print_chord(chord)
+            print("Num notes:")
+            print(len(chord))
+    finally:
+        port.close()
+
+def debug_io(port_string):
+    run_until_interrupted(print_chords_played(port_string))
+
+async def collect_chords(port_string, chords):
+    """Appends the chords played on port_string that the user wants to save to chords."""
+    port = open_port(port_string)
     try:
-        chords = []
         while True:
             print("Please play a chord.")
-            chord = read_chord(port)
+            chord = await port.read_chord()
             print("Your chord:")
             note_processing.print_chord(chord)
             print("Num notes:")
             print(len(chord))
-            answer = raw_input("Save? ([Y]/n)")
-            if not answer or answer.lower=='y':
+            if len(chord) > chord_store.MAX_CHORD_SIZE:
+                print("Chords of more than {} notes cannot be saved.".format(chord_store.MAX_CHORD_SIZE))
+                continue
+            # blocks the loop, the port keeps queueing and read_chord flushes
+            answer = input("Save? ([Y]/n)")
+            if not answer or answer.lower()=='y':
                 chords.append(chord)
-    except KeyboardInterrupt:
-        try:
-            if os.path.isfile(save_file):
-                with open(save_file, 'r') as f:
-                    previous_data = pickle.load(f)
-            else:
-                previous_data = []
-            with open(save_file, 'w') as f:
-                pickle.dump(previous_data+chords, f)
-        except Exception as e: # debugging
-            import IPython as ipy
-            ipy.embed()
+    finally:
+        port.close()
+
+def save_chords_interactively(port_string, save_file):
+    """Asks to save every chord played on port_string until Ctrl-C, then appends them to save_file."""
+    chords = []
+    try:
+        run_until_interrupted(collect_chords(port_string, chords))
+    finally:
+        chord_store.append_chords(save_file, chords)
 
 def print_chords_file(save_file):
-    with open(save_file, 'r') as f:
-        chords = pickle.load(f)
-    for chord in chords:
-        note_processing.print_chord(chord)
+    for record in chord_store.read_chords(save_file):
+        note_processing.print_chord(chord_store.to_chord(record))
 
 if __name__=='__main__':
     import sys
     debug_io(' '.join(sys.argv[1:]))
-    # save_chords_interactively('Digital Piano', 'data/chord_bank.pickle')
+    # save_chords_interactively('Digital Piano', CHORD_BANK_FILE)
     # print "Printing chords file:"
-    # print_chords_file('data/chord_bank.pickle')
+    # print_chords_file(CHORD_BANK_FILE)
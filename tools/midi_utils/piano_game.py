@@ -1,42 +1,105 @@
-import mido, pickle, time
+import argparse
+import asyncio
 import numpy as np
-from midi_read import MidiReader
 from midi_constants import *
-import note_processing, notes_io
+import note_processing, chord_store
+from async_midi import AsyncMidiPort
+from chord_bank import ChordBank, chord_key, hamming_distance
+from latency import LatencyTracer, NULL_TRACER, format_summary
 
 def chord_match(chord1, chord2):
-    notes1 = [n.note for n in chord1]
-    notes2 = [n.note for n in chord2]
-    return set(notes1)==set(notes2)
+    return chord_key(chord1)==chord_key(chord2)
 
 def unique(chords):
-    unique_set = []
-    for chord in chords:
-        if not any([chord_match(chord, c) for c in unique_set]):
-            unique_set.append(chord)
-    return unique_set
-
-def main(port_string):
-    with open('data/chord_bank.pickle', 'r') as f:
-        chords = unique(pickle.load(f))
-    np.random.shuffle(chords)
-    try:
-        port = mido.open_ioport(port_string)
-    except:
-        print "'{}' is not a valid port. Please change the midi port.".format(port_string)
-        exit(1)
-    test = [chord for chord in chords if len(chord)==3]
-    for chord in test:
-        notes_io.play_chord(chord, port)
-        user_chord = notes_io.read_chord(port)
-        if chord_match(user_chord, chord):
-            print "You got it right!"
+    return ChordBank(chords).chords
+
+def load_chord_bank(save_file, size=None):
+    """
+    Loads the records of a chord store with the given number of notes into a
+    ChordBank. Records are only turned into messages once they are played, see
+    chord_store.to_chord.
+    """
+    records = chord_store.read_chords(save_file, size)
+    bank = ChordBank()
+    for i, key in enumerate(chord_store.chord_keys(records)):
+        if key not in bank.index:
+            bank.add(records[i], key)
+    return bank
+
+async def drill(port, bank, prefix='', tracer=NULL_TRACER):
+    """
+    Plays the chords of bank on port one by one and grades the answers.
+
+    Args:
+        tracer: latency.LatencyTracer timing every answer from the key press
+            to the printed verdict, NULL_TRACER for no tracing
+
+    """
+    test = list(bank.chords)
+    np.random.shuffle(test)
+    for record in test:
+        chord = chord_store.to_chord(record)
+        await port.play_chord(chord)
+        trace = tracer.start(port=port.name)
+        user_chord = await port.read_chord(trace=trace)
+        correct = chord_match(user_chord, chord)
+        trace.mark('matched')
+        if correct:
+            print(prefix+"You got it right!")
         else:
-            print "You missed this one. You played:"
-            print note_processing.print_chord(user_chord)
-            print "Here's the right answer:"
-            print note_processing.print_chord(chord)
-        time.sleep(3)
+            print(prefix+"You missed this one by {} notes. You played: {}".format(
+                hamming_distance(chord_key(user_chord), chord_key(chord)),
+                note_processing.chord_string(user_chord)))
+            if user_chord in bank:
+                print(prefix+"That is another chord from the bank.")
+            print(prefix+"Here's the right answer: {}".format(note_processing.chord_string(chord)))
+        trace.mark('feedback_done')
+        tracer.finish(trace)
+        await asyncio.sleep(3)
+
+async def run_drills(port_strings, bank, tracer=NULL_TRACER):
+    ports = []
+    try:
+        # inside the try, so the ports opened before a bad one are closed
+        for port_string in port_strings:
+            try:
+                ports.append(AsyncMidiPort(port_string))
+            except:
+                print("'{}' is not a valid port. Please change the midi port.".format(port_string))
+                exit(1)
+        prefix = lambda port: '[{}] '.format(port.name) if len(ports) > 1 else ''
+        await asyncio.gather(*[drill(port, bank, prefix(port), tracer) for port in ports])
+    finally:
+        for port in ports:
+            port.close()
+
+def main(port_strings, latency_file=None):
+    """
+    Runs a drill on every port.
+
+    Args:
+        port_strings (list): Midi port names
+        latency_file (str): If given, the latencies of every answer are traced
+            and written to this json file when the session ends
+
+    """
+    bank = load_chord_bank(CHORD_BANK_FILE, size=3)
+    tracer = LatencyTracer() if latency_file else NULL_TRACER
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run_drills(port_strings, bank, tracer))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+        if latency_file:
+            print(format_summary(tracer.summary()))
+            tracer.export(latency_file)
 
 if __name__=='__main__':
-    main('Digital Piano')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Chord ear training drill')
+    parser.add_argument('port_strings', nargs='*', default=['Digital Piano'], help='Midi port names')
+    parser.add_argument('-l', '--latency_file', default=None,
+                        help='Json file to write the latencies from key press to verdict to')
+    args = parser.parse_args()
+    main(args.port_strings, args.latency_file)
@@ -0,0 +1,264 @@
+"""
+Renders midi files with fluidsynth, many at a time and never twice.
+
+Every (midi file, soundfont, sample rate) job is keyed by a hash of the midi
+bytes, the soundfont contents and the sample rate. Renders are stored in a
+cache directory under their key and linked to their usual file name next to
+the midi file, so a job whose inputs did not change is skipped, however its
+files were named. At most num_workers fluidsynth processes run at once. After
+a job succeeds, the soundfont is added to the synthetic_versions list of the
+midi file's sidecar json.
+
+Example usage (render all takes with two soundfonts):
+
+python render_queue.py \
+    -i ../recorded_data \
+    -sfd ../soundfonts \
+    -sfn general_user_v1.471 fluid_r3_gm
+
+"""
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_SAMPLE_RATE = 44100
+# part of every key, bump it when the rendering command changes
+RENDER_VERSION = b'fluidsynth -ni -F -r 1'
+
+RenderJob = collections.namedtuple('RenderJob', ['midi_path', 'soundfont_path', 'sample_rate', 'output_path'])
+
+_soundfont_digests = {}
+_soundfont_digests_lock = threading.Lock()
+
+
+def file_digest(path, block_size=1<<20):
+    """Hex sha256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def soundfont_digest(path):
+    """file_digest of a soundfont, remembered while its size and mtime stay the same."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    # hashing under the lock, so a soundfont is never hashed twice at once
+    with _soundfont_digests_lock:
+        if key not in _soundfont_digests:
+            _soundfont_digests[key] = file_digest(path)
+        return _soundfont_digests[key]
+
+
+def render_key(job, midi_digest=None):
+    """
+    Content hash identifying the output of a job.
+
+    Args:
+        job: RenderJob
+        midi_digest (str): file_digest of the midi file, computed if not given
+
+    """
+    digest = hashlib.sha256(RENDER_VERSION)
+    digest.update((midi_digest or file_digest(job.midi_path)).encode())
+    digest.update(soundfont_digest(job.soundfont_path).encode())
+    digest.update(str(job.sample_rate).encode())
+    return digest.hexdigest()
+
+
+def group_jobs(jobs):
+    """
+    Groups jobs by render_key, hashing every midi file and soundfont once.
+
+    Returns:
+        Tuple of (groups, failed), groups an OrderedDict mapping keys to the
+        jobs with that key in job order, failed a list of (job, 'failed', 0,
+        error) results of jobs whose files could not be read
+    """
+    midi_digests = {}
+    groups = collections.OrderedDict()
+    failed = []
+    for job in jobs:
+        try:
+            if job.midi_path not in midi_digests:
+                midi_digests[job.midi_path] = file_digest(job.midi_path)
+            key = render_key(job, midi_digests[job.midi_path])
+        except (IOError, OSError) as e:
+            failed.append((job, 'failed', 0., repr(e)))
+            continue
+        groups.setdefault(key, []).append(job)
+    return groups, failed
+
+
+def soundfont_name(soundfont_path):
+    return os.path.splitext(os.path.basename(soundfont_path))[0]
+
+
+def output_path_for(midi_path, soundfont_path, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Maps a midi file to its rendering, e.g. take_synth_general_user_v1.471.wav."""
+    base_filename = os.path.splitext(midi_path)[0]
+    suffix = '' if sample_rate == DEFAULT_SAMPLE_RATE else '_{}'.format(sample_rate)
+    return '{}_synth_{}{}.wav'.format(base_filename, soundfont_name(soundfont_path), suffix)
+
+
+def make_jobs(midi_paths, soundfont_paths, sample_rate=DEFAULT_SAMPLE_RATE):
+    """One job for every midi file and soundfont."""
+    return [RenderJob(midi_path, soundfont_path, sample_rate,
+                      output_path_for(midi_path, soundfont_path, sample_rate))
+            for midi_path in midi_paths for soundfont_path in soundfont_paths]
+
+
+def link_output(cached_path, output_path):
+    """Hard links a cached render to its output path, copying where links are not possible."""
+    if os.path.exists(output_path):
+        if os.path.samefile(cached_path, output_path):
+            return
+        os.remove(output_path)
+    try:
+        os.link(cached_path, output_path)
+    except OSError:
+        shutil.copyfile(cached_path, output_path)
+
+
+def update_sidecar(job):
+    """Adds the soundfont of job to the synthetic_versions of the midi file's sidecar json, if there is one."""
+    sidecar_path = os.path.splitext(job.midi_path)[0] + '.json'
+    if not os.path.exists(sidecar_path):
+        return
+    with open(sidecar_path, 'r') as f:
+        meta_data = json.load(f, object_pairs_hook=collections.OrderedDict)
+    versions = meta_data.setdefault('synthetic_versions', [])
+    if soundfont_name(job.soundfont_path) in versions:
+        return
+    versions.append(soundfont_name(job.soundfont_path))
+    with open(sidecar_path + '.tmp', 'w') as f:
+        f.write(json.dumps(meta_data, indent=4))
+    os.rename(sidecar_path + '.tmp', sidecar_path)
+
+
+def render_job(args):
+    """
+    Renders the jobs sharing one key inside a worker thread, running
+    fluidsynth once unless the key is already cached, and links the render
+    to the output paths of all of them.
+
+    Args:
+        args: Tuple of (key, jobs, cache_dir, fluidsynth)
+
+    Returns:
+        List of (job, status, seconds, error) tuples, one per job, where
+        status is one of 'rendered', 'cached' or 'failed'. Only the first job
+        of a key that was rendered is 'rendered'.
+    """
+    key, jobs, cache_dir, fluidsynth = args
+    start = time.time()
+    partial_path = None
+    cached_path = os.path.join(cache_dir, key + '.wav')
+    status = 'cached'
+    try:
+        if not os.path.exists(cached_path):
+            # render next to the cache entry and move it in place once complete,
+            # so an interrupted render is never taken for a cached one
+            job = jobs[0]
+            fd, partial_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            os.close(fd)
+            subprocess.check_output([fluidsynth, '-ni', job.soundfont_path, job.midi_path,
+                                     '-F', partial_path, '-r', str(job.sample_rate)],
+                                    stderr=subprocess.STDOUT)
+            os.rename(partial_path, cached_path)
+            status = 'rendered'
+    except (OSError, subprocess.CalledProcessError) as e:
+        if partial_path and os.path.exists(partial_path):
+            os.remove(partial_path)
+        return [(job, 'failed', time.time()-start, repr(e)) for job in jobs]
+    results = []
+    for i, job in enumerate(jobs):
+        try:
+            link_output(cached_path, job.output_path)
+            results.append((job, status if i == 0 else 'cached', time.time()-start, ''))
+        except OSError as e:
+            results.append((job, 'failed', time.time()-start, repr(e)))
+    return results
+
+
+def render_batch(jobs, cache_dir, num_workers=None, fluidsynth='fluidsynth', verbose=True):
+    """
+    Renders many jobs with a bounded number of fluidsynth processes.
+
+    Every midi file and soundfont is hashed once, up front, and jobs with the
+    same key are rendered once, e.g. identical takes in one batch.
+
+    Args:
+        jobs (list): RenderJobs, see make_jobs
+        cache_dir (str): Directory holding the renders under their keys
+        num_workers (int): Number of fluidsynth processes, defaults to the number of cores
+        fluidsynth (str): fluidsynth executable
+        verbose (bool): If True, prints one line per job
+
+    Returns:
+        List of (job, status, seconds, error) tuples, see render_job
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    num_workers = num_workers or multiprocessing.cpu_count()
+    groups, failed = group_jobs(jobs)
+    results = []
+    pool = ThreadPool(num_workers)
+    try:
+        for group_results in itertools.chain([failed], pool.imap_unordered(
+                render_job, [(key, key_jobs, cache_dir, fluidsynth) for key, key_jobs in groups.items()])):
+            for result in group_results:
+                job, status, seconds, error = result
+                # sidecars are only written from this thread
+                if status != 'failed':
+                    update_sidecar(job)
+                if verbose:
+                    print ('{:>8} {:6.2f}s {} {}'.format(status, seconds, job.output_path, error))
+                results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def find_files(directory, extensions):
+    return sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                  if filename.lower().endswith(extensions))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Render midi files with fluidsynth')
+    parser.add_argument('-i', '--input_dir', type=str, default='../recorded_data',
+            help='Directory of midi files to render')
+    parser.add_argument('-sfd', '--soundfonts_dir', type=str, default='../soundfonts',
+            help='Path to directory where soundfonts are saved')
+    parser.add_argument('-sfn', '--soundfont_names', type=str, nargs='*',
+            help='Soundfont names without file ending, defaults to all soundfonts in soundfonts_dir')
+    parser.add_argument('-r', '--sample_rate', type=int, default=DEFAULT_SAMPLE_RATE)
+    parser.add_argument('-c', '--cache_dir', type=str, default=None,
+            help='Directory to cache renders in, defaults to .render_cache in input_dir')
+    parser.add_argument('-w', '--num_workers', type=int, default=None,
+            help='Number of fluidsynth processes, defaults to the number of cores')
+    args = parser.parse_args()
+
+    if args.soundfont_names:
+        soundfont_paths = [os.path.join(args.soundfonts_dir, '{}.sf2'.format(name)) for name in args.soundfont_names]
+    else:
+        soundfont_paths = find_files(args.soundfonts_dir, ('.sf2',))
+    jobs = make_jobs(find_files(args.input_dir, ('.mid', '.midi')), soundfont_paths, args.sample_rate)
+    start = time.time()
+    results = render_batch(jobs, args.cache_dir or os.path.join(args.input_dir, '.render_cache'), args.num_workers)
+    counts = collections.Counter(result[1] for result in results)
+    print ('{} jobs in {:.2f}s: {} rendered, {} cached, {} failed'.format(
+        len(results), time.time()-start, counts['rendered'], counts['cached'], counts['failed']))
@@ -0,0 +1,278 @@
+"""
+In-process virtual midi ports, a mido backend.
+
+Every port name maps to a virtual device. Messages sent to a device's output
+are captured in memory with their send time. Its input delivers the messages
+of a recorded midi file or event log as live input, at their recorded times
+scaled by a speed factor, so the recorder and game loops run without a
+piano, deterministically and at many times the event rate of a player.
+Devices are created on first use, so a tool opening 'Digital Piano' gets a
+silent input and a capturing output unless a replay was registered for
+that name.
+
+Select the backend with MIDO_BACKEND=virtual_midi (see midi_backends.py) or
+mido.set_backend('virtual_midi'). Replays are registered with add_replay,
+or from the environment for tools started from the shell:
+
+VIRTUAL_MIDI_REPLAY='Digital Piano=session.evl@10' MIDO_BACKEND=virtual_midi python midi_record.py -i 'Digital Piano' ...
+
+"""
+import os
+import queue
+import threading
+import time
+
+import mido
+import numpy as np
+from mido import ports
+
+import event_log
+from midi_render import Playback, Player, read_schedule
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+
+class VirtualDevice():
+    def __init__(self, name, echo=False):
+        """
+        A virtual midi device, see get_device.
+
+        Args:
+            name (str): Port name
+            echo (bool): If True, messages sent to the output are also
+                delivered to the inputs
+
+        """
+        self.name = name
+        self.echo = echo
+        self.captured = []
+        self.inputs = []
+        self.playback = None
+        self.player = None
+        self._lock = threading.Lock()
+
+    def send(self, msg):
+        """Called by the replay for every message, delivers it to the open inputs."""
+        with self._lock:
+            inputs = list(self.inputs)
+        for port in inputs:
+            port._deliver(msg)
+
+    def capture(self, msg):
+        """Called by the outputs for every message sent."""
+        self.captured.append((time.perf_counter(), msg))
+        if self.echo:
+            self.send(msg)
+
+    def set_replay(self, messages, times, speed=1., loop=False):
+        """
+        Sets the messages the input delivers, replayed from the moment the
+        first input is opened.
+
+        Args:
+            messages (list): Messages
+            times (array): Times of messages in seconds, sorted
+            speed (float): Speed factor, float('inf') for as fast as possible
+            loop (bool): If True, replays until the device is removed
+
+        """
+        self.stop()
+        if speed == float('inf'):
+            times = np.zeros(len(times))
+            speed = 1.
+        self.playback = Playback(self, messages, times, loop=loop, tempo_scale=speed, name=self.name)
+        if self.inputs:
+            self.start()
+
+    def start(self):
+        """Starts the replay, if there is one."""
+        if self.playback is None or self.player is not None:
+            return
+        # no spinning, the replay should not compete with the loops it feeds
+        self.player = Player(lookahead=0.)
+        self.player.add(self.playback)
+        self.player.start()
+
+    def join(self):
+        """Waits for the replay to finish."""
+        if self.player is not None:
+            self.player.join()
+
+    def stop(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
+
+    def connect(self, port):
+        with self._lock:
+            self.inputs.append(port)
+        self.start()
+
+    def disconnect(self, port):
+        with self._lock:
+            if port in self.inputs:
+                self.inputs.remove(port)
+
+
+def get_device(name, echo=False):
+    """The virtual device of a port name, created if it does not exist yet."""
+    with _devices_lock:
+        if name not in _devices:
+            _devices[name] = VirtualDevice(name, echo)
+        return _devices[name]
+
+
+def remove_device(name):
+    """Stops a device's replay and forgets the device and its captured messages."""
+    with _devices_lock:
+        device = _devices.pop(name, None)
+    if device is not None:
+        device.stop()
+
+
+def reset():
+    for name in list(_devices):
+        remove_device(name)
+
+
+def read_replay(filename):
+    """
+    Reads the messages of a midi file or an event log with their times.
+
+    Args:
+        filename (str): Midi file or event log name
+
+    Returns:
+        Tuple of (messages, times), times in seconds from the first message
+    """
+    if not event_log.is_event_log(filename):
+        messages, times, _ = read_schedule(filename)
+        # live ports deliver messages without delta times
+        return [msg.copy(time=0) for msg in messages], times
+    events = event_log.read_event_log(filename)
+    sizes = event_log.MESSAGE_SIZES[events['status']]
+    messages = []
+    keep = []
+    for i, (status, data1, data2, _) in enumerate(events.tolist()):
+        try:
+            messages.append(mido.Message.from_bytes([status, data1, data2][:sizes[i]]))
+            keep.append(i)
+        except ValueError:
+            pass
+    times = np.asarray(events['timestamp'][keep], dtype=np.float64)
+    if len(times):
+        times -= times[0]
+    return messages, times
+
+
+def add_replay(name, filename, speed=1., loop=False):
+    """
+    Replays a recording as the input of a virtual device.
+
+    Args:
+        name (str): Port name
+        filename (str): Midi file or event log name
+        speed (float): Speed factor, float('inf') for as fast as possible
+        loop (bool): If True, replays until the device is removed
+
+    Returns:
+        The VirtualDevice
+    """
+    device = get_device(name)
+    messages, times = read_replay(filename)
+    device.set_replay(messages, times, speed, loop)
+    return device
+
+
+def captured(name):
+    """Messages sent to the output of a device so far, as (perf_counter time, message) tuples."""
+    return list(get_device(name).captured)
+
+
+def add_replays_from_environment(value):
+    """Registers replays given as 'name=filename[@speed];...'."""
+    for entry in value.split(';'):
+        if not entry.strip():
+            continue
+        name, filename = entry.split('=', 1)
+        speed = 1.
+        if '@' in filename:
+            filename, speed = filename.rsplit('@', 1)
+            speed = float(speed)
+        add_replay(name, filename, speed)
+
+
+# mido backend interface
+
+def get_devices(**kwargs):
+    with _devices_lock:
+        names = sorted(_devices)
+    return [{'name': name, 'is_input': True, 'is_output': True} for name in names]
+
+
+def _default_name(name):
+    if name is not None:
+        return name
+    names = [device['name'] for device in get_devices()]
+    if not names:
+        raise IOError('no virtual midi devices')
+    return names[0]
+
+
+class Input(ports.BaseInput):
+    _locking = False
+
+    def _open(self, callback=None, **kwargs):
+        self.name = _default_name(self.name)
+        self._device_type = 'virtual'
+        self._queue = queue.Queue()
+        self.callback = callback
+        self._device = get_device(self.name)
+        self._device.connect(self)
+
+    def _deliver(self, msg):
+        callback = self.callback
+        if callback is not None:
+            callback(msg)
+        else:
+            self._queue.put(msg)
+
+    def _close(self):
+        self._device.disconnect(self)
+        self.closed = True
+        # wakes a blocked receive
+        self._queue.put(None)
+
+    def receive(self, block=True):
+        self._check_callback()
+        try:
+            msg = self._queue.get(block)
+        except queue.Empty:
+            return None
+        if msg is None:
+            if block:
+                raise IOError('port closed during receive()')
+            return None
+        return msg
+
+    def poll(self):
+        return self.receive(block=False)
+
+    receive.__doc__ = ports.BaseInput.receive.__doc__
+
+
+class Output(ports.BaseOutput):
+    _locking = False
+
+    def _open(self, **kwargs):
+        self.name = _default_name(self.name)
+        self._device_type = 'virtual'
+        self._device = get_device(self.name)
+
+    def _send(self, msg):
+        self._device.capture(msg)
+
+
+if os.environ.get('VIRTUAL_MIDI_REPLAY'):
+    add_replays_from_environment(os.environ['VIRTUAL_MIDI_REPLAY'])